@@ -4,5 +4,8 @@ class CommentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'comments'
 
-    # def ready(self):
-    #     from comments_project.comments import signals  # signals для Events
\ No newline at end of file
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals  # signals для Events
+        from .metrics import install_query_recorder
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,329 @@
+import asyncio
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlencode
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+from PIL import Image
+from .models import Comment, OutboxEvent, User
+
+BENCHMARK_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+}
+
+
+class Rollback(Exception):
+    """Raised at the end of a benchmark run to discard its synthetic data."""
+
+
+def synthetic_threads(roots=25, breadth=3, depth=3, user=None, text='benchmark comment'):
+    """
+    Create `roots` threads with `breadth` replies on every level down to `depth`.
+
+    Goes through Comment.save() so paths and counters are maintained as in
+    production. Returns the root comments.
+    """
+    if user is None:
+        user, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com'})
+
+    def grow(parent, level):
+        if level == 0:
+            return
+        for _ in range(breadth):
+            grow(Comment.objects.create(user=user, text=text, parent=parent), level - 1)
+
+    threads = []
+    for _ in range(roots):
+        root = Comment.objects.create(user=user, text=text)
+        grow(root, depth)
+        threads.append(root)
+    return threads
+
+
+def summarize(samples):
+    """{'min', 'median', 'p95', 'max'} of millisecond samples, rounded to microseconds."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return {
+        'min': round(ordered[0], 3),
+        'median': round(statistics.median(ordered), 3),
+        'p95': round(p95, 3),
+        'max': round(ordered[-1], 3),
+    }
+
+
+def timed(fn, repeat=20, setup=None):
+    """Run fn `repeat` times (setup, if given, untimed before each run); returns summarize()."""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """
+    Throwaway test database (SQLite or PostgreSQL, whichever DATABASE_URL
+    points at) with BENCHMARK_SETTINGS, a temporary MEDIA_ROOT and eager Celery.
+    """
+    from comments_project.celery import app as celery_app
+
+    media_root = tempfile.mkdtemp()
+    old_name = connection.settings_dict['NAME']
+    eager = celery_app.conf.task_always_eager
+    setup_test_environment()
+    try:
+        with override_settings(MEDIA_ROOT=media_root, **BENCHMARK_SETTINGS):
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+            celery_app.conf.task_always_eager = True
+            yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        celery_app.conf.task_always_eager = eager
+        teardown_test_environment()
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def run_in_rollback(fn):
+    """Call fn inside a transaction that is always rolled back; returns its result."""
+    result = None
+    try:
+        with transaction.atomic():
+            result = fn()
+            raise Rollback
+    except Rollback:
+        pass
+    return result
+
+
+def list_url(params):
+    return f"{reverse('comment-list')}?{urlencode(params)}"
+
+
+def cursor_page_url(client, params, page):
+    """URL of the page-th keyset page, reached by following `next` links (untimed)."""
+    url = list_url(params)
+    for _ in range(page - 1):
+        url = client.get(url).json()['next']
+        if url is None:
+            return None
+    return url
+
+
+def measure_list(client, ordering, page, repeat=20):
+    """
+    Cold-cache GET /api/comments/ at one page depth, keyset and page-number mode.
+
+    The cache is cleared (untimed) before each request so every run hits the database.
+    """
+    params = {'ordering': ordering}
+    results = []
+    for mode, url in (
+        ('cursor', cursor_page_url(client, params, page)),
+        ('page', list_url({**params, 'page': page})),
+    ):
+        if url is None:
+            continue
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        if response.status_code != 200:
+            continue
+        results.append({
+            'ordering': ordering, 'page': page, 'mode': mode,
+            'queries': len(queries), 'bytes': len(response.content),
+            'ms': timed(lambda: client.get(url), repeat, setup=cache.clear),
+        })
+    return results
+
+
+def sample_image(size=(1280, 960)):
+    output = BytesIO()
+    Image.new('RGB', size, 'navy').save(output, format='JPEG')
+    return output.getvalue()
+
+
+def measure_create(client, count=50, attachment=False):
+    """
+    POST /api/comments/ throughput, with or without a JPEG attachment.
+
+    Celery tasks (outbox relay, thumbnail) are queued in production, so here
+    they are replaced by no-ops and only the request path is timed.
+    """
+    from .tasks import process_attachment, relay_outbox
+
+    image = sample_image() if attachment else None
+    samples = []
+    with mock.patch.object(relay_outbox, 'delay'), mock.patch.object(process_attachment, 'delay'):
+        for n in range(-1, count):  # n == -1 warms up and is not counted
+            data = {'user_name': f'bench{n % 10}', 'email': f'bench{n % 10}@example.com', 'home_page': '',
+                    'text': f'Benchmark <strong>post</strong> #{n}'}
+            if image is not None:
+                data['file'] = SimpleUploadedFile(f'photo{n}.jpg', image, content_type='image/jpeg')
+            started = time.perf_counter()
+            response = client.post(reverse('comment-list'), data)
+            if response.status_code != 201:
+                raise RuntimeError(f'POST failed with {response.status_code}: {response.content[:200]!r}')
+            if n >= 0:
+                samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'attachment': attachment, 'requests': count,
+        'per_second': round(count / (sum(samples) / 1000), 1), 'ms': summarize(samples),
+    }
+
+
+async def measure_fanout(sockets=10, messages=20, user=None):
+    """
+    Create-to-delivery latency of new root comments to `sockets` connected consumers.
+
+    Each sample is the time from starting Comment.objects.create() to one socket
+    receiving the frame, through the real signal -> outbox -> relay (eager Celery) ->
+    channel layer -> CommentConsumer path.
+    """
+    from channels.testing import WebsocketCommunicator
+    from .consumers import CommentConsumer
+
+    communicators = [WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/') for _ in range(sockets)]
+    for communicator in communicators:
+        await communicator.connect()
+
+    create = sync_to_async(lambda n: Comment.objects.create(user=user, text=f'fan-out #{n}'))
+
+    async def delivered(communicator, started):
+        await communicator.receive_from(timeout=10)
+        return (time.perf_counter() - started) * 1000
+
+    samples = []
+    try:
+        for n in range(-1, messages):  # n == -1 warms up and is not counted
+            started = time.perf_counter()
+            await create(n)
+            latencies = await asyncio.gather(*(delivered(c, started) for c in communicators))
+            if n >= 0:
+                samples += latencies
+    finally:
+        for communicator in communicators:
+            await communicator.disconnect()
+        # The worker thread's connection would otherwise keep the test database open.
+        await sync_to_async(connections.close_all)()
+    return {'sockets': sockets, 'messages': messages, 'ms': summarize(samples)}
+
+
+def measure_outbox(burst=1000, batch_size=500):
+    """
+    Relay throughput for a burst of `burst` new-comment events.
+
+    The events (copies of one rendered comment) are inserted untimed; the
+    timed part is outbox.relay() draining them to the in-memory channel
+    layer, with one subscribed channel. batch_size=1 sends one frame per
+    event, like the former one-task-per-comment broadcast minus its broker
+    round trips.
+    """
+    from channels.layers import get_channel_layer
+    from . import outbox
+    from .events import FEED_GROUP, new_comment_event
+
+    event = new_comment_event(Comment.objects.select_related('user').filter(parent__isnull=True).first())
+    OutboxEvent.objects.all().delete()
+    OutboxEvent.objects.bulk_create(
+        OutboxEvent(group=FEED_GROUP, payload={**event, 'comment': {**event['comment'], 'id': n}})
+        for n in range(burst)
+    )
+    layer = get_channel_layer()
+    channel = async_to_sync(layer.new_channel)()
+    async_to_sync(layer.group_add)(FEED_GROUP, channel)
+    frames = 0
+    group_send = layer.group_send
+
+    async def counting_send(group, message):
+        nonlocal frames
+        frames += 1
+        await group_send(group, message)
+
+    try:
+        with mock.patch.object(layer, 'group_send', counting_send):
+            started = time.perf_counter()
+            sent = outbox.relay(batch_size)
+            elapsed = time.perf_counter() - started
+    finally:
+        async_to_sync(layer.flush)()
+    return {
+        'burst': burst, 'batch_size': batch_size, 'sent': sent, 'frames': frames,
+        'ms': round(elapsed * 1000, 1), 'per_second': round(sent / elapsed, 1),
+    }
+
+
+async def asgi_get(app, url):
+    """One GET straight through an ASGI application, as Daphne would send it; returns the status."""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    finished = asyncio.Event()
+    requested = False
+    status = None
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif not message.get('more_body'):
+            finished.set()
+
+    await app(scope, receive, send)
+    finished.set()
+    return status
+
+
+async def measure_concurrency(app, url, clients=100, duration=5.0):
+    """
+    Sustained throughput of GET `url` with `clients` concurrent clients, each
+    sending its next request as soon as the previous one is answered.
+    """
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status = await asgi_get(app, url)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    return {
+        'url': url, 'clients': clients, 'requests': len(latencies), 'errors': errors,
+        'per_second': round(len(latencies) / elapsed, 1), 'ms': summarize(latencies),
+    }
@@ -0,0 +1,271 @@
+import csv
+import io
+from datetime import timedelta, timezone as dt_timezone
+from itertools import islice
+from django.core.management.color import no_style
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .encoding import dumps, loads
+from .models import Comment, User, path_segment
+from .sanitizer import get_cleaner
+
+# One comment per row/line. Export writes rows in path order, so every parent
+# comes before its replies, which is what import relies on.
+COLUMNS = ['id', 'parent', 'username', 'email', 'homepage', 'text', 'file', 'created_at']
+FORMATS = ('jsonl', 'csv')
+
+# Written by both the INSERT and the COPY path; search_vector is filled by the database.
+INSERT_COLUMNS = [
+    'id', 'user_id', 'text', 'parent_id', 'file', 'created_at',
+    'path', 'reply_count', 'descendant_count', 'last_activity_at',
+]
+
+
+def guess_format(filename, default='jsonl'):
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def export_rows(queryset, batch_size=1000):
+    """Stream comments as dicts in path (parent-before-child) order."""
+    rows = queryset.order_by('path').values_list(
+        'id', 'parent_id', 'user__username', 'user__email', 'user__homepage', 'text', 'file', 'created_at'
+    ).iterator(chunk_size=batch_size)
+    for row in rows:
+        yield dict(zip(COLUMNS, row))
+
+
+def synthetic_rows(roots, breadth=3, depth=2, users=50, start_id=1, text='Load test comment'):
+    """
+    Generate threads in the export format without touching the database.
+
+    Each root gets `breadth` replies on every level down to `depth`; comments
+    are spread over `users` authors and spaced one second apart.
+    """
+    next_id = start_id
+    started = timezone.now() - timedelta(days=30)
+
+    def row(parent):
+        nonlocal next_id
+        comment_id, next_id = next_id, next_id + 1
+        author = f'loadtest{comment_id % users}'
+        return {
+            'id': comment_id, 'parent': parent, 'username': author, 'email': f'{author}@example.com',
+            'homepage': '', 'text': f'{text} #{comment_id}', 'file': '',
+            'created_at': started + timedelta(seconds=comment_id - start_id),
+        }
+
+    def grow(parent_id, level):
+        if level == 0:
+            return
+        for _ in range(breadth):
+            reply = row(parent_id)
+            yield reply
+            yield from grow(reply['id'], level - 1)
+
+    for _ in range(roots):
+        root = row(None)
+        yield root
+        yield from grow(root['id'], depth)
+
+
+def write_rows(rows, stream, fmt):
+    """Write rows to a text stream one at a time; returns the number written."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'created_at': row['created_at'].isoformat()})
+            count += 1
+    else:
+        for row in rows:
+            # One write per line: management commands' OutputWrapper only adds '\n' when it is missing.
+            stream.write(dumps(row).decode() + '\n')
+            count += 1
+    return count
+
+
+def read_rows(stream, fmt):
+    """Lazily parse JSONL or CSV rows from a text stream."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield loads(line)
+
+
+class CommentImporter:
+    """
+    Insert exported rows in batches with their original ids.
+
+    Per batch: one query for the authors (missing ones are bulk-created), one
+    for the paths of parents imported by earlier batches, and one multi-row INSERT
+    (or PostgreSQL COPY). Memory stays bounded by the batch size. Counters are
+    left at zero here; run reconcile_thread_counters once afterwards.
+
+    A batch that violates a constraint is rolled back and reported as a
+    ValueError naming the rows whose ids are already taken.
+    """
+
+    def __init__(self, batch_size=1000, use_copy=False, clean_text=True, using='default'):
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.clean_text = clean_text
+        self.using = using
+        self.imported = 0
+        self.users_created = 0
+
+    def run(self, rows):
+        for batch in batched(rows, self.batch_size):
+            first = self.imported + 1
+            parsed = [self.parse(row, first + n) for n, row in enumerate(batch)]
+            try:
+                with transaction.atomic(using=self.using):
+                    self.import_batch(parsed)
+            except IntegrityError as e:
+                self.imported = first - 1
+                raise ValueError(self.describe_conflict(parsed, first, e))
+        self.reset_sequences()
+        return self.imported
+
+    def parse(self, row, number):
+        try:
+            created_at = row['created_at']
+            if isinstance(created_at, str):
+                created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError('created_at is missing or invalid')
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at, dt_timezone.utc)
+            text = row['text']
+            return {
+                'id': int(row['id']),
+                'parent': int(row['parent']) if row.get('parent') not in (None, '') else None,
+                'username': row['username'],
+                'email': row['email'],
+                'homepage': row.get('homepage') or '',
+                # Straight through the cleaner: caching one-off rows would only flood the cache.
+                'text': get_cleaner().clean(text) if self.clean_text else text,
+                'file': row.get('file') or '',
+                'created_at': created_at,
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'Row {number}: {e}')
+
+    def describe_conflict(self, rows, first, error):
+        ids = [row['id'] for row in rows]
+        taken = set(Comment.objects.using(self.using).filter(pk__in=ids).values_list('pk', flat=True))
+        if not taken:
+            return f'Rows {first}-{first + len(rows) - 1}: {error}'
+        conflicts = ', '.join(f'{first + n} (id {pk})' for n, pk in enumerate(ids) if pk in taken)
+        return f'Rows already in the database: {conflicts}'
+
+    def import_batch(self, rows):
+        users = self.resolve_users(rows)
+        paths = self.resolve_paths(rows)
+        comments = [
+            Comment(
+                id=row['id'], user_id=users[row['username']], text=row['text'], parent_id=row['parent'],
+                file=row['file'], created_at=row['created_at'], path=paths[row['id']],
+                last_activity_at=row['created_at'],
+            )
+            for row in rows
+        ]
+        if self.use_copy:
+            self.copy(comments)
+        else:
+            self.insert(comments)
+        self.imported += len(comments)
+
+    def resolve_users(self, rows):
+        """username -> id for every author in the batch, creating the missing ones."""
+        names = {row['username'] for row in rows}
+        users = {}
+        for user_id, username in (User.objects.using(self.using).filter(username__in=names)
+                                  .order_by('-id').values_list('id', 'username')):
+            users[username] = user_id
+        missing = {}
+        for row in rows:
+            if row['username'] not in users and row['username'] not in missing:
+                missing[row['username']] = User(username=row['username'], email=row['email'], homepage=row['homepage'])
+        if missing:
+            created = User.objects.using(self.using).bulk_create(missing.values(), batch_size=self.batch_size)
+            users.update((user.username, user.pk) for user in created)
+            self.users_created += len(created)
+        return users
+
+    def resolve_paths(self, rows):
+        """Materialized paths for the batch; parents come earlier in this batch or from the database."""
+        paths = {}
+        earlier = {row['parent'] for row in rows if row['parent'] is not None} - {row['id'] for row in rows}
+        if earlier:
+            paths.update(Comment.objects.using(self.using).filter(pk__in=earlier).values_list('id', 'path'))
+        for row in rows:
+            parent = row['parent']
+            if parent is None:
+                paths[row['id']] = path_segment(row['id'])
+            elif parent in paths:
+                paths[row['id']] = paths[parent] + path_segment(row['id'])
+            else:
+                raise ValueError(f"Comment {row['id']}: parent {parent} must come before its replies")
+        return paths
+
+    def insert(self, comments):
+        """
+        Multi-row INSERTs of the comments as given.
+
+        Values go through each field's database conversion but not pre_save()
+        (bulk_create's path), so created_at keeps the imported time instead of
+        auto_now_add's.
+        """
+        connection = connections[self.using]
+        fields = [Comment._meta.get_field(column) for column in INSERT_COLUMNS]
+        table = connection.ops.quote_name(Comment._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+        size = min(self.batch_size, connection.ops.bulk_batch_size(fields, comments))
+        with connection.cursor() as cursor:
+            for batch in batched(comments, size):
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) VALUES {', '.join([placeholders] * len(batch))}",
+                    [field.get_db_prep_save(getattr(c, field.attname), connection) for c in batch for field in fields],
+                )
+
+    def copy(self, comments):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for c in comments:
+            writer.writerow([
+                c.id, c.user_id, c.text, c.parent_id if c.parent_id is not None else '', c.file.name or '',
+                c.created_at.isoformat(), c.path, 0, 0, c.last_activity_at.isoformat(),
+            ])
+        buffer.seek(0)
+        columns = ', '.join(INSERT_COLUMNS)
+        connection = connections[self.using]
+        # copy_expert is the driver's own method: wrap its errors (IntegrityError) as Django does.
+        with connection.cursor() as cursor, connection.wrap_database_errors:
+            # Unquoted empty fields are NULL in CSV mode; text columns keep '' instead.
+            cursor.copy_expert(
+                f'COPY {Comment._meta.db_table} ({columns}) FROM STDIN '
+                'WITH (FORMAT csv, FORCE_NOT_NULL (text, file, path))',
+                buffer,
+            )
+
+    def reset_sequences(self):
+        # Explicit ids leave PostgreSQL sequences behind the imported rows.
+        connection = connections[self.using]
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Comment])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import time
+from collections import Counter
+from django.core.cache import cache
+
+LIST_CACHE_TIMEOUT = 60 * 15
+GENERATION_KEY = 'comments:generation'
+# Unix time of the last invalidation, for Last-Modified
+MODIFIED_KEY = 'comments:modified'
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 0.05
+LOCK_RETRIES = 20
+
+# Per-process hit/miss counters for the comment list cache.
+stats = Counter()
+
+
+def get_generation():
+    """
+    Current version stamp of the comment table.
+
+    Every cached list page embeds it in its key, so bumping it invalidates all
+    pages at once. A missing stamp is re-seeded from the clock, which keeps
+    keys from before an eviction from ever matching again.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+async def aget_generation():
+    """get_generation through the async cache API."""
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = await cache.aget(GENERATION_KEY, 0)
+    return generation
+
+
+def get_list_version():
+    """
+    (generation, last modified time) in one cache round trip, for conditional GETs.
+
+    A missing modification time is re-seeded from the clock: claiming a recent
+    change only makes clients download once more.
+    """
+    values = cache.get_many([GENERATION_KEY, MODIFIED_KEY])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        generation = get_generation()
+    modified = values.get(MODIFIED_KEY)
+    if modified is None:
+        cache.add(MODIFIED_KEY, time.time(), timeout=None)
+        modified = cache.get(MODIFIED_KEY, time.time())
+    return generation, modified
+
+
+async def aget_list_version():
+    """get_list_version through the async cache API."""
+    values = await cache.aget_many([GENERATION_KEY, MODIFIED_KEY])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        generation = await aget_generation()
+    modified = values.get(MODIFIED_KEY)
+    if modified is None:
+        await cache.aadd(MODIFIED_KEY, time.time(), timeout=None)
+        modified = await cache.aget(MODIFIED_KEY, time.time())
+    return generation, modified
+
+
+def invalidate_comment_lists():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+    cache.set(MODIFIED_KEY, time.time(), timeout=None)
+    stats['invalidations'] += 1
+
+
+def list_cache_key(request, generation=None):
+    """Key covering host, path and every query param (page/cursor, ordering, filters)."""
+    if generation is None:
+        generation = get_generation()
+    params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+    digest = hashlib.sha1(repr((request.get_host(), request.path, params)).encode()).hexdigest()
+    return f'comments:list:{generation}:{digest}'
+
+
+def list_etag(request, key):
+    """
+    Weak ETag of a cached list response: its generation-stamped key plus the
+    Accept header (JSON and the browsable API share the key, not the bytes).
+    """
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return 'W/"%s"' % hashlib.sha1(f'{key}\n{accept}'.encode()).hexdigest()[:24]
+
+
+def get_or_compute(key, compute, timeout=LIST_CACHE_TIMEOUT):
+    """
+    Read-through lookup with single-flight recompute.
+
+    On a miss only the caller that wins the lock computes the value; the rest
+    poll briefly for it and compute themselves only if the winner is too slow.
+    """
+    value = cache.get(key)
+    if value is not None:
+        stats['hits'] += 1
+        return value
+    stats['misses'] += 1
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        for _ in range(LOCK_RETRIES):
+            time.sleep(LOCK_WAIT)
+            value = cache.get(key)
+            if value is not None:
+                stats['waits'] += 1
+                return value
+        stats['lock_timeouts'] += 1
+        return compute()
+
+    try:
+        value = compute()
+        cache.set(key, value, timeout=timeout)
+        return value
+    finally:
+        cache.delete(lock_key)
+
+
+async def aget_or_compute(key, compute, timeout=LIST_CACHE_TIMEOUT):
+    """get_or_compute for async views: `compute` is a coroutine function, waits don't block the loop."""
+    value = await cache.aget(key)
+    if value is not None:
+        stats['hits'] += 1
+        return value
+    stats['misses'] += 1
+
+    lock_key = f'{key}:lock'
+    if not await cache.aadd(lock_key, 1, timeout=LOCK_TIMEOUT):
+        for _ in range(LOCK_RETRIES):
+            await asyncio.sleep(LOCK_WAIT)
+            value = await cache.aget(key)
+            if value is not None:
+                stats['waits'] += 1
+                return value
+        stats['lock_timeouts'] += 1
+        return await compute()
+
+    try:
+        value = await compute()
+        await cache.aset(key, value, timeout=timeout)
+        return value
+    finally:
+        await cache.adelete(lock_key)
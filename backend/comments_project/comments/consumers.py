@@ -1,57 +1,211 @@
-import json
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+import asyncio
 import logging
+import time
+from django.conf import settings
+from . import outbox
+from .logs import Truncated
+from .encoding import JSONDecodeError, dumps_text, loads
+from .events import FEED_GROUP, thread_group
+from .fanout import MAX_FRAME_SIZE, encode_frame, encode_frames
+from .metrics import ConsumerMetricsMixin, registry
+from .sockets import OVERLOAD_CLOSE_CODE, sockets
 
 logger = logging.getLogger(__name__)
 
-class CommentConsumer(AsyncWebsocketConsumer):
+MAX_THREAD_SUBSCRIPTIONS = 100
+PONG_FRAME = dumps_text({'type': 'pong'})
+# Heartbeats as the SPA (JSON.stringify) and json.dumps send them: answered without parsing.
+PING_TEXTS = frozenset({'{"type":"ping"}', '{"type": "ping"}'})
+RESYNC_FRAME = dumps_text({'type': 'resync_required'})
+
+class CommentConsumer(ConsumerMetricsMixin, AsyncWebsocketConsumer):
+    """
+    Clients start on the new-root-comments feed and opt into reply updates per thread:
+
+        {"type": "subscribe", "threads": [1, 2], "replace": true}
+        {"type": "unsubscribe", "threads": [2], "feed": false}
+
+    Every (un)subscribe is answered with the resulting state:
+    {"type": "subscribed", "feed": true, "threads": [1]}.
+
+    Broadcast frames carry a sequence number `seq`. After reconnecting and
+    subscribing again, a client sends the last one it saw to get the events
+    it missed for its current subscriptions, followed by where it now stands:
+
+        {"type": "resume", "seq": 41}
+        -> missed frames..., {"type": "resumed", "seq": 57, "replayed": 3}
+
+    Without `seq` only the current position is returned. When the gap cannot
+    be replayed the answer is {"type": "reload_required", "seq": 57}: refetch
+    over HTTP and resume from that seq.
+
+    Broadcast frames go through a queue of COMMENTS_WS_SEND_QUEUE frames per
+    socket. When a slow reader lets it fill up, the queued frames are dropped
+    and replaced by {"type": "resync_required"}, after which the client
+    resumes from its last seq. Connections beyond the per-process or total
+    caps are refused with code 1013, idle ones are closed (see sockets.py).
+    """
     async def connect(self):
-        logger.info(f"Attempting to add {self.channel_name} to group 'comments_group'")
+        self.feed = False
+        self.threads = set()
+        self.last_seen = time.monotonic()
+        self.pending = asyncio.Queue(settings.COMMENTS_WS_SEND_QUEUE)
+        self.writer = None
+        refused = sockets.admit(self)
+        if refused:
+            registry.record_ws_event(self.metrics_label, f'refused_{refused}')
+            logger.warning("WebSocket refused: %s connection limit reached", refused)
+            await self.close(code=OVERLOAD_CLOSE_CODE)
+            return
+        self.writer = asyncio.create_task(self.write_frames())
         try:
-            await self.channel_layer.group_add("comments_group", self.channel_name)
+            await self.set_feed(True)
             await self.accept()
-            logger.info(f"WebSocket connected: {self.channel_name} and added to group 'comments_group'")
+            logger.debug("WebSocket connected: %s", self.channel_name)
         except Exception as e:
-            logger.error(f"Failed to add {self.channel_name} to group: {e}")
+            logger.error("Failed to add %s to group: %s", self.channel_name, e)
             await self.close(code=1011, reason=f"Failed to add to group: {str(e)}")
 
     async def disconnect(self, close_code):
-        logger.info(f"Removing {self.channel_name} from group 'comments_group'")
+        sockets.release(self)
+        if self.writer is not None:
+            self.writer.cancel()
         try:
-            await self.channel_layer.group_discard("comments_group", self.channel_name)
-            logger.info(f"WebSocket disconnected: {self.channel_name}, code: {close_code}, reason: {self.close_reason or 'No reason provided'}")
+            for group in self.groups_joined():
+                await self.channel_layer.group_discard(group, self.channel_name)
+            logger.debug("WebSocket disconnected: %s, code: %s", self.channel_name, close_code)
         except Exception as e:
-            logger.error(f"Failed to remove {self.channel_name} from group: {e}")
+            logger.error("Failed to remove %s from group: %s", self.channel_name, e)
+
+    async def websocket_receive(self, message):
+        self.last_seen = time.monotonic()
+        await super().websocket_receive(message)
 
     async def receive(self, text_data):
+        if text_data in PING_TEXTS:
+            await self.send(text_data=PONG_FRAME)
+            return
         try:
-            data = json.loads(text_data)
-            if data.get('type') == 'ping':
-                await self.send(text_data=json.dumps({'type': 'pong'}))
-                logger.info(f"Received ping, sent pong to {self.channel_name}")
+            data = loads(text_data)
+            message_type = data.get('type')
+            if message_type == 'ping':
+                await self.send(text_data=PONG_FRAME)
+            elif message_type in ('subscribe', 'unsubscribe'):
+                await self.update_subscriptions(data, subscribe=message_type == 'subscribe')
+            elif message_type == 'resume':
+                await self.resume(data.get('seq'))
             else:
-                logger.warn(f"Unknown message received: {data}")
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse WebSocket message: {e}")
+                logger.warning("Unknown message received: %s", Truncated(data))
+        except JSONDecodeError as e:
+            logger.error("Failed to parse WebSocket message: %s", e)
             await self.close(code=1011, reason=f"Invalid JSON: {str(e)}")
 
+    def groups_joined(self):
+        groups = [thread_group(root_id) for root_id in self.threads]
+        return [FEED_GROUP] + groups if self.feed else groups
+
+    async def set_feed(self, enabled):
+        if enabled and not self.feed:
+            await self.channel_layer.group_add(FEED_GROUP, self.channel_name)
+        elif not enabled and self.feed:
+            await self.channel_layer.group_discard(FEED_GROUP, self.channel_name)
+        self.feed = enabled
+
+    async def update_subscriptions(self, data, subscribe):
+        threads = data.get('threads', [])
+        if not isinstance(threads, list) or not all(isinstance(t, int) and t > 0 for t in threads):
+            await self.send(text_data=dumps_text({'type': 'error', 'error': 'threads must be a list of comment ids'}))
+            return
+
+        requested = set(threads)
+        if subscribe:
+            added = requested - self.threads
+            removed = self.threads - requested if data.get('replace') else set()
+            added = set(sorted(added)[:MAX_THREAD_SUBSCRIPTIONS - len(self.threads - removed)])
+        else:
+            added, removed = set(), requested & self.threads
+
+        for root_id in removed:
+            await self.channel_layer.group_discard(thread_group(root_id), self.channel_name)
+        for root_id in added:
+            await self.channel_layer.group_add(thread_group(root_id), self.channel_name)
+        self.threads = (self.threads - removed) | added
+        if 'feed' in data:
+            await self.set_feed(bool(data['feed']))
+
+        await self.send(text_data=dumps_text({
+            'type': 'subscribed',
+            'feed': self.feed,
+            'threads': sorted(self.threads),
+        }))
+
+    async def resume(self, seq):
+        if seq is not None and (not isinstance(seq, int) or isinstance(seq, bool) or seq < 0):
+            await self.send(text_data=dumps_text({'type': 'error', 'error': 'seq must be a non-negative integer'}))
+            return
+        if seq is None:
+            await self.send(text_data=dumps_text({'type': 'resumed', 'seq': await sync_to_async(outbox.latest_sequence)()}))
+            return
+
+        events = await sync_to_async(outbox.replay)(self.groups_joined(), seq)
+        if events is None:
+            logger.debug("Replay after seq %s not possible for %s", seq, self.channel_name)
+            await self.send(text_data=dumps_text({
+                'type': 'reload_required', 'seq': await sync_to_async(outbox.latest_sequence)(),
+            }))
+            return
+        for frame in encode_frames(events):
+            await self.send_frame(frame['text'], frame['size'])
+        await self.send(text_data=dumps_text({
+            'type': 'resumed', 'seq': events[-1]['seq'] if events else seq, 'replayed': len(events),
+        }))
+
+    async def comments_frame(self, event):
+        # Кадр уже закодований публікатором один раз для всіх сокетів
+        try:
+            self.queue_frame(event['text'], event['size'])
+        except KeyError as e:
+            logger.error("Invalid event format: %s, event: %s", e, Truncated(event))
+            await self.close(code=1011, reason=f"Invalid event format: {str(e)}")
+
     async def new_comment(self, event):
         try:
-            message = event['comment']
-            message_size = len(json.dumps({'type': 'new_comment', 'comment': message}).encode('utf-8'))
-            logger.info(f"Sending WebSocket message to {self.channel_name}, size: {message_size} bytes")
-            if message_size > 1048576:  # 1MB ліміт
-                logger.error(f"Message too large for WebSocket: {message_size} bytes")
-                await self.close(code=1011, reason="Message too large")
-                return
-            await self.send(text_data=json.dumps({
-                'type': 'new_comment',
-                'comment': message
-            }))
-            logger.info(f"Successfully sent WebSocket message to {self.channel_name}")
+            frame = encode_frame({'type': 'new_comment', 'comment': event['comment']})
+            self.queue_frame(frame['text'], frame['size'])
         except KeyError as e:
-            logger.error(f"Invalid event format: {str(e)}, event: {event}")
+            logger.error("Invalid event format: %s, event: %s", e, Truncated(event))
             await self.close(code=1011, reason=f"Invalid event format: {str(e)}")
-        except Exception as e:
-            logger.error(f"Error sending WebSocket message: {str(e)}, event: {event}")
-            await self.close(code=1011, reason=f"Send error: {str(e)}")
+
+    def queue_frame(self, text, size):
+        # The handler returns at once, so a slow socket never backs up the channel layer.
+        try:
+            self.pending.put_nowait((text, size))
+        except asyncio.QueueFull:
+            dropped = 0
+            while not self.pending.empty():
+                self.pending.get_nowait()
+                dropped += 1
+            registry.record_ws_event(self.metrics_label, 'dropped', dropped + 1)
+            registry.record_ws_event(self.metrics_label, 'resync')
+            logger.debug("Slow WebSocket reader %s: dropped %d frame(s)", self.channel_name, dropped + 1)
+            self.pending.put_nowait((RESYNC_FRAME, len(RESYNC_FRAME)))
+
+    async def write_frames(self):
+        while True:
+            text, size = await self.pending.get()
+            try:
+                await self.send_frame(text, size)
+            except Exception as e:
+                logger.error("Error sending WebSocket message: %s", e)
+                await self.close(code=1011, reason=f"Send error: {str(e)}")
+                return
+
+    async def send_frame(self, text, size):
+        # Розмір перевіряється на вже закодованих байтах, без повторного json.dumps
+        if size > MAX_FRAME_SIZE:
+            logger.error("Message too large for WebSocket: %d bytes", size)
+            await self.close(code=1011, reason="Message too large")
+            return
+        await self.send(text_data=text)
@@ -0,0 +1,59 @@
+from .models import PATH_SEGMENT_WIDTH
+
+
+def iter_thread_counters(rows):
+    """
+    Recompute thread counters from rows streamed in materialized-path order.
+
+    `rows` yields tuples starting with (id, path, created_at). Path order is a
+    depth-first pre-order walk, so only the chain of open ancestors is held in
+    memory. Yields (row, reply_count, descendant_count, last_activity_at) for
+    every row once its whole subtree has been seen.
+    """
+    stack = []  # [row, path, reply_count, descendant_count, last_activity_at]
+
+    def close():
+        row, path, replies, descendants, last_activity = stack.pop()
+        if stack:
+            parent = stack[-1]
+            if len(path) - len(parent[1]) == PATH_SEGMENT_WIDTH:
+                parent[2] += 1
+            parent[3] += descendants + 1
+            parent[4] = max(parent[4], last_activity)
+        return row, replies, descendants, last_activity
+
+    for row in rows:
+        path = row[1]
+        while stack and not path.startswith(stack[-1][1]):
+            yield close()
+        stack.append([row, path, 0, 0, row[2]])
+    while stack:
+        yield close()
+
+
+def reconcile_thread_counters(comments, batch_size=1000, dry_run=False):
+    """
+    Repair drifted reply_count/descendant_count/last_activity_at in bulk.
+
+    `comments` is a Comment manager or queryset. Streams every row once in path order and
+    writes back only the rows whose stored counters differ, in batches.
+    Returns (rows_checked, rows_fixed).
+    """
+    fields = ['reply_count', 'descendant_count', 'last_activity_at']
+    rows = comments.order_by('path').values_list('id', 'path', 'created_at', *fields).iterator(chunk_size=batch_size)
+    checked, fixed, batch = 0, 0, []
+    for row, replies, descendants, last_activity in iter_thread_counters(rows):
+        checked += 1
+        if row[3:] == (replies, descendants, last_activity):
+            continue
+        fixed += 1
+        batch.append(comments.model(
+            pk=row[0], reply_count=replies, descendant_count=descendants, last_activity_at=last_activity
+        ))
+        if len(batch) >= batch_size:
+            if not dry_run:
+                comments.model.objects.using(comments.db).bulk_update(batch, fields)
+            batch = []
+    if batch and not dry_run:
+        comments.model.objects.using(comments.db).bulk_update(batch, fields)
+    return checked, fixed
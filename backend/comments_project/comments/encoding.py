@@ -0,0 +1,28 @@
+import orjson
+from rest_framework.utils.encoders import JSONEncoder
+
+# Options that keep orjson output identical to DRF's compact JSONRenderer:
+# 'Z' for UTC datetimes and non-string dict keys coerced to strings.
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+_fallback = JSONEncoder()
+
+
+def _default(obj):
+    # Types orjson does not handle natively (Decimal, lazy strings, querysets, ...)
+    # get DRF's representation.
+    return _fallback.default(obj)
+
+
+def dumps(data):
+    """Encode to compact UTF-8 JSON bytes, same output as rest_framework's JSONRenderer."""
+    return orjson.dumps(data, default=_default, option=ORJSON_OPTIONS)
+
+
+def dumps_text(data):
+    """dumps() as str, for WebSocket text frames."""
+    return dumps(data).decode()
+
+
+loads = orjson.loads
+JSONDecodeError = orjson.JSONDecodeError
@@ -0,0 +1,46 @@
+from . import outbox
+from .rendering import render_comment
+
+# New root comments go to the feed group; replies only to their thread's group.
+FEED_GROUP = 'comments_group'
+
+
+def thread_group(root_id):
+    return f'comments_thread_{root_id}'
+
+
+def comment_group(comment):
+    return FEED_GROUP if comment.parent_id is None else thread_group(comment.root_id)
+
+
+def new_comment_event(comment):
+    """
+    Compact channel-layer event for a freshly created comment.
+
+    A new comment cannot have replies yet, so the tree walk is skipped.
+    """
+    comment._reply_tree = []
+    return {
+        'type': 'new_comment',
+        'comment': render_comment(comment),
+    }
+
+
+def comment_updated_event(comment):
+    """
+    Message for a changed comment (e.g. a processed attachment).
+
+    Replies are left out so clients merge it into the comment they already have.
+    """
+    comment._reply_tree = []
+    data = render_comment(comment)
+    data.pop('replies', None)
+    return {'type': 'comment_updated', 'comment': data}
+
+
+def publish_new_comment(comment):
+    """
+    Store the new_comment event in the outbox, in the comment's own transaction;
+    the relay broadcasts it after commit, so the request never waits on the channel layer.
+    """
+    outbox.publish(comment_group(comment), new_comment_event(comment))
@@ -0,0 +1,63 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from .encoding import dumps
+
+logger = logging.getLogger(__name__)
+
+MAX_FRAME_SIZE = 1048576  # 1MB ліміт
+FRAME_EVENT_TYPE = 'comments.frame'
+
+
+def encode_frame(message):
+    """Encode a client-facing message once; consumers forward the text as-is."""
+    payload = dumps(message)
+    return {'type': FRAME_EVENT_TYPE, 'text': payload.decode(), 'size': len(payload)}
+
+
+def batch_messages(messages):
+    """
+    Merge each run of consecutive new_comment messages into one new_comments frame.
+
+    A lone message keeps its original shape so single events look the same as before.
+    Order is kept, and a merged frame carries the sequence number of its last message.
+    """
+    batched = []
+    run = []
+    for message in messages + [None]:
+        if message is not None and message.get('type') == 'new_comment':
+            run.append(message)
+            continue
+        if len(run) > 1:
+            merged = {'type': 'new_comments', 'comments': [m['comment'] for m in run]}
+            if 'seq' in run[-1]:
+                merged['seq'] = run[-1]['seq']
+            batched.append(merged)
+        else:
+            batched.extend(run)
+        run = []
+        if message is not None:
+            batched.append(message)
+    return batched
+
+
+def encode_frames(messages):
+    """Frames for messages merged by batch_messages, split into halves while a frame is too large."""
+    frames = [encode_frame(message) for message in batch_messages(messages)]
+    if all(frame['size'] <= MAX_FRAME_SIZE for frame in frames):
+        return frames
+    if len(messages) == 1:
+        logger.error("Message too large for WebSocket: %d bytes", frames[0]['size'])
+        return []
+    half = len(messages) // 2
+    return encode_frames(messages[:half]) + encode_frames(messages[half:])
+
+
+def send_messages(group, messages):
+    """Send messages to a group as the fewest pre-encoded frames, one group_send each."""
+    frames = 0
+    for frame in encode_frames(messages):
+        async_to_sync(get_channel_layer().group_send)(group, frame)
+        frames += 1
+    logger.debug("Fan-out of %d message(s) to %s in %d frame(s)", len(messages), group, frames)
+    return frames
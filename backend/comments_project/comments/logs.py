@@ -0,0 +1,148 @@
+import atexit
+import copy
+import logging
+import os
+import queue
+import sys
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+
+# Default cut-off for payloads (request bodies, events) embedded in log messages.
+PAYLOAD_LIMIT = 200
+
+# Attributes every LogRecord has; anything else was passed through `extra=`.
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message, `extra` fields and
+    traceback. Extra values other than numbers are cut to `payload_limit`
+    characters, so a task's arguments or a request object never flood the log.
+    """
+
+    def __init__(self, *args, payload_limit=PAYLOAD_LIMIT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.payload_limit = payload_limit
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = self.compact(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+    def compact(self, value):
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, dict):
+            return {str(key): self.compact(item) for key, item in value.items()}
+        return str(Truncated(value, self.payload_limit))
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hand records to a QueueListener thread that formats and writes them.
+
+    The logging call only interpolates the message and enqueues it; the
+    formatter and the (possibly blocking) stream write run in the background.
+    When the queue is full, records are dropped and counted in `dropped`
+    instead of stalling the request.
+
+    A forked child (Celery prefork workers fork after django.setup()) inherits
+    the handler but not the listener thread, so it gets a fresh queue and
+    listener of its own.
+    """
+
+    def __init__(self, stream=None, max_queue=10000):
+        super().__init__(queue.Queue(max_queue))
+        self.dropped = 0
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.close)
+        after_fork = weakref.WeakMethod(self.restart_after_fork)
+        os.register_at_fork(after_in_child=lambda: after_fork() and after_fork()())
+
+    def restart_after_fork(self):
+        if self.listener._thread is None:
+            return  # closed before the fork
+        # The parent's queue may hold its records, or a lock taken by a thread that does not exist here.
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # dictConfig sets the formatter on this handler; it is applied in the listener thread.
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Interpolate now: args may be mutated by the caller before the listener gets to them.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.target.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        # Wait until the listener has written everything queued so far.
+        if self.listener._thread is not None:
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+
+class Truncated:
+    """
+    Lazy, shortened str() of a payload for log arguments.
+
+    `logger.debug('Received data: %s', Truncated(request.data))` only builds this
+    wrapper unless DEBUG is enabled, and never writes more than `limit` characters.
+    """
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=PAYLOAD_LIMIT):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f'{text[:self.limit]}... ({len(text)} chars)'
+
+    __repr__ = __str__
+
+
+def parse_levels(value):
+    """'comments=INFO,django.db.backends=DEBUG' -> {'comments': 'INFO', 'django.db.backends': 'DEBUG'}"""
+    levels = {}
+    for item in value.split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import sys
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from comments.benchmarks import benchmark_database, measure_create, measure_fanout, measure_list
+from comments.bulk import CommentImporter, synthetic_rows
+from comments.counters import reconcile_thread_counters
+from comments.models import Comment, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the HTTP and WebSocket benchmark suite on a throwaway test database '
+        '(SQLite or PostgreSQL, whichever DATABASE_URL points at) and write the results as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="JSON results file ('-' for stdout)")
+        parser.add_argument('--roots', type=int, default=500, help='Synthetic root comments')
+        parser.add_argument('--breadth', type=int, default=3, help='Replies per comment')
+        parser.add_argument('--depth', type=int, default=2, help='Reply levels below each root')
+        parser.add_argument('--pages', default='1,5,20', help='Comma-separated page depths to measure')
+        parser.add_argument('--orderings', default='-created_at,user__username,-last_activity_at',
+                            help='Comma-separated list orderings to measure')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed GETs per page/ordering')
+        parser.add_argument('--posts', type=int, default=50, help='POSTs per create benchmark')
+        parser.add_argument('--sockets', default='1,10,100', help='Comma-separated simulated socket counts')
+        parser.add_argument('--messages', type=int, default=20, help='Comments broadcast per fan-out run')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options['keepdb']):
+            results = self.run(options)
+
+        text = json.dumps(results, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(text)
+        else:
+            with open(options['output'], 'w') as stream:
+                stream.write(text + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def run(self, options):
+        Comment.objects.all().delete()
+        rows = synthetic_rows(options['roots'], breadth=options['breadth'], depth=options['depth'])
+        CommentImporter(clean_text=False).run(rows)
+        reconcile_thread_counters(Comment.objects.all())
+
+        client = Client()
+        self.stderr.write('Measuring GET /api/comments/ ...')
+        listing = [
+            result
+            for ordering in options['orderings'].split(',')
+            for page in map(int, options['pages'].split(','))
+            for result in measure_list(client, ordering.strip(), page, options['repeat'])
+        ]
+        self.stderr.write('Measuring POST /api/comments/ ...')
+        create = [measure_create(client, options['posts'], attachment) for attachment in (False, True)]
+        self.stderr.write('Measuring WebSocket fan-out ...')
+        user = User.objects.first()
+        fanout = [
+            asyncio.run(measure_fanout(int(sockets), options['messages'], user))
+            for sockets in options['sockets'].split(',')
+        ]
+        return {
+            'database': connection.vendor,
+            'python': sys.version.split()[0],
+            'dataset': {
+                'roots': options['roots'], 'breadth': options['breadth'], 'depth': options['depth'],
+                'comments': Comment.objects.count(),
+            },
+            'list': listing,
+            'create': create,
+            'fanout': fanout,
+        }
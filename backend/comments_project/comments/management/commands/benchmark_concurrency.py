@@ -0,0 +1,67 @@
+import asyncio
+import gc
+import json
+import sys
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from comments.benchmarks import benchmark_database, measure_concurrency
+from comments.bulk import CommentImporter, synthetic_rows
+from comments.counters import reconcile_thread_counters
+from comments.models import Comment
+
+UNCACHED = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare sustained GET throughput of the sync comment list (/api/comments/) and the native '
+        'async one (/api/async/comments/) under many concurrent clients, driven through the ASGI '
+        'application on a throwaway test database; results as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="JSON results file ('-' for stdout)")
+        parser.add_argument('--roots', type=int, default=500, help='Synthetic root comments')
+        parser.add_argument('--clients', default='10,100,200', help='Comma-separated concurrent client counts')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per run')
+        parser.add_argument('--modes', default='cached,uncached',
+                            help='cached (list cache on) and/or uncached (every request hits the database)')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options['keepdb']):
+            results = self.run(options)
+            # Connections of the finished request threads, so the test database can be dropped.
+            gc.collect()
+
+        text = json.dumps(results, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(text)
+        else:
+            with open(options['output'], 'w') as stream:
+                stream.write(text + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def run(self, options):
+        Comment.objects.all().delete()
+        CommentImporter(clean_text=False).run(synthetic_rows(options['roots'], breadth=3, depth=2))
+        reconcile_thread_counters(Comment.objects.all())
+
+        app = get_asgi_application()
+        runs = []
+        for mode in options['modes'].split(','):
+            with override_settings(**({'CACHES': UNCACHED} if mode == 'uncached' else {})):
+                for clients in map(int, options['clients'].split(',')):
+                    for view in ('comment-list', 'comment-list-async'):
+                        self.stderr.write(f'{mode} {view}, {clients} clients ...')
+                        result = asyncio.run(measure_concurrency(app, reverse(view), clients, options['duration']))
+                        runs.append({'mode': mode, 'view': 'async' if view.endswith('async') else 'sync', **result})
+        return {
+            'database': connection.vendor,
+            'python': sys.version.split()[0],
+            'roots': options['roots'],
+            'runs': runs,
+        }
@@ -0,0 +1,84 @@
+import logging
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from comments.benchmarks import timed
+from comments.logs import BackgroundHandler, JSONFormatter, Truncated
+
+# Roughly what POST /api/comments/ receives and what it used to log back.
+PAYLOAD = {
+    'username': 'benchmark', 'email': 'benchmark@example.com', 'homepage': 'https://example.com',
+    'text': 'Nice <strong>post</strong>, see <a href="https://example.com">this</a>. ' * 15,
+    'captcha_key': '0' * 40, 'captcha_value': 'ABCD',
+}
+COMMENT = {'id': 1, 'user': PAYLOAD, 'text': PAYLOAD['text'], 'parent': None, 'file': None, 'replies': []}
+
+
+def legacy_request(logger):
+    # The create path before: eager f-strings with whole payloads at INFO.
+    logger.info(f"Received data: {PAYLOAD}")
+    logger.info(f"Comment saved with id: {COMMENT['id']}")
+    logger.info(f"Serialized comment ID {COMMENT['id']}: {COMMENT}")
+
+
+def current_request(logger):
+    logger.debug('Received data: %s', Truncated(PAYLOAD))
+    logger.info('Comment saved with id: %s', COMMENT['id'])
+
+
+class SlowStream:
+    """File wrapper whose writes block for `delay` seconds, like a congested log pipe."""
+
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the logging done on the comment create path: the legacy synchronous DEBUG setup '
+        'against the queued JSON handler at INFO and DEBUG.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Simulated requests per timed run')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per setup')
+        parser.add_argument('--write-delay', type=float, default=0,
+                            help='Milliseconds every write to the log stream blocks for')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        logger = logging.getLogger('comments.benchmark')
+        logger.propagate = False
+        with tempfile.TemporaryFile('w') as stream:
+            sink = SlowStream(stream, options['write_delay'] / 1000)
+            setups = [
+                ('legacy: sync StreamHandler, DEBUG', logging.StreamHandler(sink), None, logging.DEBUG,
+                 legacy_request),
+                ('queued JSON, INFO', BackgroundHandler(sink), JSONFormatter(), logging.INFO, current_request),
+                ('queued JSON, DEBUG', BackgroundHandler(sink), JSONFormatter(), logging.DEBUG, current_request),
+            ]
+            for name, handler, formatter, level, request in setups:
+                if formatter is not None:
+                    handler.setFormatter(formatter)
+                logger.handlers = [handler]
+                logger.setLevel(level)
+                start = stream.tell()
+                result = timed(lambda: [request(logger) for _ in range(count)], options['repeat'])
+                handler.flush()
+                written = stream.tell() - start
+                handler.close()
+                self.stdout.write(
+                    f"{name:36} {result['median'] * 1000 / count:7.1f}us/request "
+                    f"(p95 {result['p95'] * 1000 / count:.1f}us), "
+                    f"{written / (count * options['repeat']):.0f} bytes/request written"
+                )
+        logger.handlers = []
@@ -0,0 +1,39 @@
+import json
+import sys
+from django.core.management.base import BaseCommand
+from django.db import connection
+from comments.benchmarks import benchmark_database, measure_outbox
+from comments.bulk import CommentImporter, synthetic_rows
+from comments.models import Comment
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure how fast the outbox relay drains bursts of new-comment events to the channel layer, '
+        'per relay batch size, on a throwaway test database; results as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="JSON results file ('-' for stdout)")
+        parser.add_argument('--bursts', default='1000,5000', help='Comma-separated burst sizes (events)')
+        parser.add_argument('--batch-sizes', default='1,100,500', help='Comma-separated relay batch sizes')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+
+    def handle(self, *args, **options):
+        with benchmark_database(keepdb=options['keepdb']):
+            Comment.objects.all().delete()
+            CommentImporter(clean_text=False).run(synthetic_rows(1, breadth=0, depth=0))
+            runs = []
+            for burst in map(int, options['bursts'].split(',')):
+                for batch_size in map(int, options['batch_sizes'].split(',')):
+                    self.stderr.write(f'{burst} events, batches of {batch_size} ...')
+                    runs.append(measure_outbox(burst, batch_size))
+            results = {'database': connection.vendor, 'python': sys.version.split()[0], 'runs': runs}
+
+        text = json.dumps(results, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(text)
+        else:
+            with open(options['output'], 'w') as stream:
+                stream.write(text + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from comments.benchmarks import run_in_rollback, synthetic_threads, timed
+from comments.models import Comment
+from comments.renderers import ORJSONRenderer
+from comments.rendering import render_comments
+from comments.serializers import CommentSerializer
+from comments.tree import attach_first_replies, attach_reply_trees
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare CommentSerializer(many=True) with the read-only fast path, and the stdlib '
+        'JSON renderer with the orjson one, on a synthetic page.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roots', type=int, default=25, help='Root comments on the page')
+        parser.add_argument('--breadth', type=int, default=3, help='Replies per comment')
+        parser.add_argument('--depth', type=int, default=3, help='Reply levels below each root')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per variant')
+
+    def handle(self, *args, **options):
+        # Synthetic rows live in a transaction that is rolled back afterwards.
+        run_in_rollback(lambda: self.run(options))
+
+    def run(self, options):
+        synthetic_threads(options['roots'], options['breadth'], options['depth'])
+        roots = list(Comment.objects.filter(parent__isnull=True).select_related('user').order_by('-created_at')[:options['roots']])
+
+        for mode, attach in (('full', attach_reply_trees), ('shallow', attach_first_replies)):
+            page = attach(roots)
+            serializer = timed(lambda: CommentSerializer(page, many=True, context={'request': None}).data, options['repeat'])
+            fast = timed(lambda: render_comments(page), options['repeat'])
+            self.report(mode, 'serializer', serializer, 'fast path', fast)
+
+            data = {'next': None, 'previous': None, 'results': render_comments(page)}
+            stdlib = timed(lambda: JSONRenderer().render(data), options['repeat'])
+            fast_json = timed(lambda: ORJSONRenderer().render(data), options['repeat'])
+            size = len(ORJSONRenderer().render(data))
+            self.report(f'{mode} json', 'json', stdlib, f'orjson ({size} bytes)', fast_json)
+
+    def report(self, label, base_name, base, fast_name, fast):
+        self.stdout.write(
+            f"{label:14} {base_name} median {base['median']:.2f}ms, "
+            f"{fast_name} median {fast['median']:.2f}ms "
+            f"({base['median'] / max(fast['median'], 0.001):.1f}x)"
+        )
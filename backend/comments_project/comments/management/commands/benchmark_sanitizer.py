@@ -0,0 +1,41 @@
+import re
+import bleach
+from django.core.management.base import BaseCommand
+from comments.benchmarks import timed
+from comments.sanitizer import ALLOWED_ATTRIBUTES, ALLOWED_TAGS, get_cleaner, sanitize, tags_balanced
+
+# The tag check CommentSerializer.validate used before the sanitizer module.
+LEGACY_HTML_PATTERN = re.compile(r'^(?:(?!<[^>]+>\s*<\w+\b[^>]*>).)*$')
+
+MAX_TEXT = 5000
+INPUTS = {
+    # Unclosed '<' runs: every position rescans to the end of the text.
+    'open brackets': '<a' * (MAX_TEXT // 2),
+    'spaced tags': ('<i>' + ' ' * 40) * (MAX_TEXT // 43),
+    'long attribute': '<a title="' + 'x' * (MAX_TEXT - 20) + '">y</a>',
+    'typical': 'Nice <strong>post</strong>, see <a href="https://example.com">this</a>. ' * 60,
+}
+
+
+class Command(BaseCommand):
+    help = 'Time the legacy clean+regex validation against the cached sanitizer on adversarial inputs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per input')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        for name, text in INPUTS.items():
+            text = text[:MAX_TEXT]
+            regex = timed(lambda: LEGACY_HTML_PATTERN.match(text), repeat)
+            balance = timed(lambda: tags_balanced(text), repeat)
+            legacy = timed(lambda: LEGACY_HTML_PATTERN.match(
+                bleach.clean(text, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES)), repeat)
+            uncached = timed(lambda: tags_balanced(get_cleaner().clean(text)), repeat)
+            sanitize(text)
+            cached = timed(lambda: tags_balanced(sanitize(text)), repeat)
+            self.stdout.write(
+                f"{name:15} check: regex {regex['median']:.3f}ms / balance {balance['median']:.3f}ms; "
+                f"validate: legacy {legacy['median']:.3f}ms / prebuilt cleaner {uncached['median']:.3f}ms / "
+                f"cached {cached['median']:.3f}ms"
+            )
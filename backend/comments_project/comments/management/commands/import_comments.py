@@ -0,0 +1,50 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from comments.bulk import FORMATS, CommentImporter, guess_format, read_rows
+from comments.caching import invalidate_comment_lists
+from comments.counters import reconcile_thread_counters
+from comments.models import Comment
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-load comments exported by export_comments (JSONL or CSV), keeping their ids. '
+        'Parents must come before their replies.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-', help="Input file ('-' for stdin)")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to csv for *.csv, jsonl otherwise')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per insert batch')
+        parser.add_argument('--copy', action='store_true', help='Load with PostgreSQL COPY instead of bulk_create')
+        parser.add_argument('--no-sanitize', action='store_true', help='Trust the text as already sanitized')
+        parser.add_argument('--skip-counters', action='store_true', help='Do not reconcile thread counters afterwards')
+
+    def handle(self, *args, **options):
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy requires PostgreSQL')
+        fmt = options['format'] or guess_format(options['input'])
+        importer = CommentImporter(
+            batch_size=options['batch_size'], use_copy=options['copy'], clean_text=not options['no_sanitize']
+        )
+
+        started = time.monotonic()
+        try:
+            if options['input'] == '-':
+                importer.run(read_rows(sys.stdin, fmt))
+            else:
+                with open(options['input'], encoding='utf-8', newline='') as stream:
+                    importer.run(read_rows(stream, fmt))
+        except ValueError as e:
+            raise CommandError(f'{e} ({importer.imported} comments imported before the error)')
+        elapsed = time.monotonic() - started
+
+        if not options['skip_counters']:
+            reconcile_thread_counters(Comment.objects.all(), batch_size=options['batch_size'])
+        invalidate_comment_lists()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.imported} comments ({importer.users_created} new users) in {elapsed:.2f}s "
+            f"({importer.imported / max(elapsed, 1e-6):.0f} rows/s)"
+        ))
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from comments.caching import invalidate_comment_lists
+from comments.counters import reconcile_thread_counters
+from comments.models import Comment
+
+
+class Command(BaseCommand):
+    help = 'Recompute reply_count, descendant_count and last_activity_at for every comment and fix drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per read chunk and per bulk update')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows have drifted')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        checked, fixed = reconcile_thread_counters(
+            Comment.objects.all(), batch_size=options['batch_size'], dry_run=options['dry_run']
+        )
+        if fixed and not options['dry_run']:
+            invalidate_comment_lists()
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} comments, {verb} {fixed} in {time.monotonic() - started:.2f}s"
+        ))
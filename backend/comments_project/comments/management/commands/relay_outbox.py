@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from comments import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Send undelivered comment events from the outbox to the channel layer in batches; '
+        'runs until interrupted unless --once is given (an alternative to the Celery relay task).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Events per batch (default COMMENTS_OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--interval', type=float, default=0.5, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"Sent {outbox.relay(options['batch_size'])} event(s)")
+            return
+        try:
+            while True:
+                if not outbox.relay(options['batch_size']):
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,37 @@
+from io import BytesIO
+from PIL import Image
+from django.core.files.base import ContentFile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.gif', '.png')
+IMAGE_FORMATS = ('JPEG', 'GIF', 'PNG')
+THUMBNAIL_SIZE = (320, 240)
+MAX_IMAGE_UPLOAD_SIZE = 5 * 1024 * 1024
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def make_thumbnail(source, name):
+    """
+    Validate an uploaded image and shrink it to fit THUMBNAIL_SIZE.
+
+    Returns a ContentFile with the thumbnail, or None when the image already
+    fits. For JPEG, draft() makes the decoder scale down by a power of two
+    while decoding, so a large photo is never fully decompressed.
+    """
+    try:
+        img = Image.open(source)
+        image_format = img.format
+        if image_format not in IMAGE_FORMATS:
+            raise InvalidImage("Only JPG, GIF, PNG allowed")
+        if img.size[0] <= THUMBNAIL_SIZE[0] and img.size[1] <= THUMBNAIL_SIZE[1]:
+            return None
+        if image_format == 'JPEG':
+            img.draft('RGB', THUMBNAIL_SIZE)
+        img.thumbnail(THUMBNAIL_SIZE, reducing_gap=2.0)
+        output = BytesIO()
+        img.save(output, format=image_format)
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e))
+    return ContentFile(output.getvalue(), name)
@@ -0,0 +1,300 @@
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .caching import stats
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+SLOW_QUERY_DUMP_LIMIT = 20
+
+
+class Histogram:
+    """Cumulative-bucket histogram in Prometheus layout, one series per label tuple."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            # [count per bucket..., +Inf count, sum]
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for label_values, series in sorted(self.series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}'
+            yield f'{self.name}_sum{{{labels}}} {series[-1]:.6f}'
+            yield f'{self.name}_count{{{labels}}} {cumulative}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels, kind='counter'):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.kind = kind
+        self.series = {}
+
+    def inc(self, label_values, value=1):
+        self.series[label_values] = self.series.get(label_values, 0) + value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for label_values, value in sorted(self.series.items()):
+            yield f'{self.name}{{{format_labels(self.labels, label_values)}}} {value}'
+
+
+def format_labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+class Registry:
+    """
+    In-process metrics aggregation: a few dict updates under one lock per
+    request or frame, rendered only when /metrics is scraped. Every worker
+    process keeps its own numbers, so scrape each worker (or sum them).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        endpoint = ('endpoint', 'method')
+        self.http_latency = Histogram(
+            'comments_http_request_duration_seconds', 'HTTP request latency.', endpoint, LATENCY_BUCKETS)
+        self.http_requests = Counter(
+            'comments_http_requests_total', 'HTTP responses by status.', endpoint + ('status',))
+        self.db_queries = Histogram(
+            'comments_http_db_queries', 'Database queries per HTTP request.', endpoint, QUERY_COUNT_BUCKETS)
+        self.db_time = Histogram(
+            'comments_http_db_duration_seconds', 'Database time per HTTP request.', endpoint, LATENCY_BUCKETS)
+        self.http_bytes = Histogram(
+            'comments_http_response_bytes', 'HTTP response payload size.', endpoint, SIZE_BUCKETS)
+        self.ws_connections = Counter(
+            'comments_ws_connections', 'Open WebSocket connections.', ('consumer',), kind='gauge')
+        self.ws_messages = Counter(
+            'comments_ws_messages_total', 'WebSocket frames by direction.', ('consumer', 'direction'))
+        self.ws_bytes = Counter(
+            'comments_ws_bytes_total', 'WebSocket payload bytes by direction.', ('consumer', 'direction'))
+        self.ws_send_latency = Histogram(
+            'comments_ws_send_duration_seconds', 'Time to hand one frame to the WebSocket.', ('consumer',),
+            LATENCY_BUCKETS)
+        self.ws_events = Counter(
+            'comments_ws_events_total',
+            'WebSocket connections refused or reaped, frames dropped for slow readers, resyncs requested.',
+            ('consumer', 'event'))
+        self.db_routes = Counter(
+            'comments_db_reads_total', 'Routed read requests by database choice.', ('endpoint', 'route'))
+        self.metrics = [
+            self.http_latency, self.http_requests, self.db_queries, self.db_time, self.http_bytes,
+            self.ws_connections, self.ws_messages, self.ws_bytes, self.ws_send_latency, self.ws_events,
+            self.db_routes,
+        ]
+
+    def record_request(self, endpoint, method, status, duration, queries, db_time, size):
+        labels = (endpoint, method)
+        with self.lock:
+            self.http_latency.observe(labels, duration)
+            self.http_requests.inc(labels + (status,))
+            self.db_queries.observe(labels, queries)
+            self.db_time.observe(labels, db_time)
+            if size is not None:
+                self.http_bytes.observe(labels, size)
+
+    def record_ws(self, consumer, direction, size, duration=None):
+        with self.lock:
+            self.ws_messages.inc((consumer, direction))
+            self.ws_bytes.inc((consumer, direction), size)
+            if duration is not None:
+                self.ws_send_latency.observe((consumer,), duration)
+
+    def record_connection(self, consumer, delta):
+        with self.lock:
+            self.ws_connections.inc((consumer,), delta)
+
+    def record_ws_event(self, consumer, event, count=1):
+        with self.lock:
+            self.ws_events.inc((consumer, event), count)
+
+    def record_db_route(self, endpoint, route):
+        with self.lock:
+            self.db_routes.inc((endpoint, route))
+
+    def render(self):
+        with self.lock:
+            lines = [line for metric in self.metrics for line in metric.render()]
+        lines.append('# HELP comments_cache_events_total Comment cache and sanitizer cache events.')
+        lines.append('# TYPE comments_cache_events_total counter')
+        lines.extend(f'comments_cache_events_total{{event="{event}"}} {count}' for event, count in sorted(stats.items()))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+# Recorder of the request being handled. A context variable rather than a
+# per-request execute_wrapper: async views run their queries on executor
+# threads, which sync_to_async gives a copy of the request's context.
+current_recorder = ContextVar('comments_query_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver: route every connection's queries through record_query."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryRecorder:
+    """Counts and times one request's queries, keeps SQL for slow-request dumps."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if len(self.queries) < SLOW_QUERY_DUMP_LIMIT:
+                self.queries.append((elapsed, sql))
+
+
+def endpoint_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.route or match.view_name
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status, DB query count/time and payload size per endpoint
+    (the URL route, so label cardinality stays bounded).
+
+    Requests slower than settings.COMMENTS_SLOW_REQUEST_MS are logged with their
+    queries for a COMMENTS_SLOW_REQUEST_SAMPLE_RATE fraction of them.
+
+    Works in both sync and async stacks, so async views are not pushed onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.record(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.record(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    def record(self, request, response, duration, recorder):
+        endpoint = endpoint_label(request)
+        size = None if response.streaming else len(response.content)
+        registry.record_request(
+            endpoint, request.method, response.status_code, duration, recorder.count, recorder.duration, size
+        )
+        self.dump_if_slow(request, endpoint, duration, recorder)
+
+    def dump_if_slow(self, request, endpoint, duration, recorder):
+        threshold = getattr(settings, 'COMMENTS_SLOW_REQUEST_MS', 0)
+        if not threshold or duration * 1000 < threshold:
+            return
+        if random.random() >= getattr(settings, 'COMMENTS_SLOW_REQUEST_SAMPLE_RATE', 1.0):
+            return
+        queries = '\n'.join(f'  {elapsed * 1000:.1f}ms {sql}' for elapsed, sql in recorder.queries)
+        logger.warning(
+            'Slow request %s %s (%s): %.0fms, %d queries in %.0fms\n%s',
+            request.method, request.path, endpoint, duration * 1000,
+            recorder.count, recorder.duration * 1000, queries,
+        )
+
+
+class ConsumerMetricsMixin:
+    """
+    WebSocket counterpart of MetricsMiddleware for AsyncWebsocketConsumer:
+    open connections, frames and bytes in each direction, and send latency.
+    """
+
+    @property
+    def metrics_label(self):
+        return type(self).__name__
+
+    async def websocket_connect(self, message):
+        registry.record_connection(self.metrics_label, 1)
+        await super().websocket_connect(message)
+
+    async def websocket_disconnect(self, message):
+        registry.record_connection(self.metrics_label, -1)
+        await super().websocket_disconnect(message)
+
+    async def websocket_receive(self, message):
+        payload = message.get('text') or message.get('bytes') or ''
+        registry.record_ws(self.metrics_label, 'in', payload_size(payload))
+        await super().websocket_receive(message)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        started = time.perf_counter()
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        payload = text_data if text_data is not None else bytes_data
+        if payload is not None:
+            registry.record_ws(self.metrics_label, 'out', payload_size(payload), time.perf_counter() - started)
+
+
+def payload_size(payload):
+    # ASCII strings (most JSON frames) know their byte length without encoding.
+    if isinstance(payload, str) and not payload.isascii():
+        return len(payload.encode('utf-8'))
+    return len(payload)
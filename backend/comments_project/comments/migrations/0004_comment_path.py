@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:18
+
+from django.db import migrations, models
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def backfill_paths(apps, schema_editor):
+    """Fill paths level by level: roots first, then children of rows that already have one."""
+    Comment = apps.get_model('comments', 'Comment')
+    comments = Comment.objects.using(schema_editor.connection.alias)
+    segment = LPad(Cast('id', CharField()), 10, Value('0'))
+
+    comments.filter(parent__isnull=True).update(path=segment)
+    parent_path = Subquery(Comment.objects.filter(pk=OuterRef('parent_id')).values('path')[:1])
+    while comments.filter(path='', parent__path__gt='').update(
+        path=Concat(parent_path, segment, output_field=CharField())
+    ):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0003_remove_comment_email_remove_comment_home_page_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, help_text='Materialized path of zero-padded ancestor ids (maintained on insert)', max_length=1000),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['path'], name='comments_path_idx'),
+        ),
+    ]
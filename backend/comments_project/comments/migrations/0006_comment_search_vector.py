@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:24
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The vector is built from the comment text with HTML tags stripped. Only
+# PostgreSQL has tsvector/GIN; other backends search with LIKE instead.
+CREATE_SEARCH_SQL = '''
+CREATE FUNCTION comments_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('simple', regexp_replace(NEW.text, '<[^>]*>', ' ', 'g'));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER comments_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF text ON comments
+    FOR EACH ROW EXECUTE FUNCTION comments_search_vector_update();
+
+UPDATE comments SET search_vector = to_tsvector('simple', regexp_replace(text, '<[^>]*>', ' ', 'g'));
+
+CREATE INDEX comments_search_vector_gin ON comments USING gin (search_vector);
+'''
+
+DROP_SEARCH_SQL = '''
+DROP INDEX IF EXISTS comments_search_vector_gin;
+DROP TRIGGER IF EXISTS comments_search_vector_trigger ON comments;
+DROP FUNCTION IF EXISTS comments_search_vector_update();
+'''
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_SQL)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0005_root_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:26
+
+from django.db import migrations, models
+
+# Frozen copy of the path layout at this migration (comments.models.PATH_SEGMENT_WIDTH).
+PATH_SEGMENT_WIDTH = 10
+BATCH_SIZE = 1000
+
+
+def backfill_thread_counters(apps, schema_editor):
+    """
+    Fill the new counters with one pass over the comments in path order.
+
+    Self-contained on purpose: the historical model and this function only,
+    so later changes to comments.counters cannot change what the migration does.
+    """
+    Comment = apps.get_model('comments', 'Comment')
+    comments = Comment.objects.using(schema_editor.connection.alias)
+    fields = ['reply_count', 'descendant_count', 'last_activity_at']
+    batch = []
+    stack = []  # [id, path, reply_count, descendant_count, last_activity_at]
+
+    def close():
+        pk, path, replies, descendants, last_activity = stack.pop()
+        if stack:
+            parent = stack[-1]
+            if len(path) - len(parent[1]) == PATH_SEGMENT_WIDTH:
+                parent[2] += 1
+            parent[3] += descendants + 1
+            parent[4] = max(parent[4], last_activity)
+        batch.append(Comment(pk=pk, reply_count=replies, descendant_count=descendants, last_activity_at=last_activity))
+        if len(batch) >= BATCH_SIZE:
+            comments.bulk_update(batch, fields)
+            batch.clear()
+
+    rows = comments.order_by('path').values_list('id', 'path', 'created_at').iterator(chunk_size=BATCH_SIZE)
+    for pk, path, created_at in rows:
+        while stack and not path.startswith(stack[-1][1]):
+            close()
+        stack.append([pk, path, 0, 0, created_at])
+    while stack:
+        close()
+    if batch:
+        comments.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0006_comment_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='descendant_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Replies at any depth'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='last_activity_at',
+            field=models.DateTimeField(editable=False, help_text="Newest created_at in this comment's subtree", null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Direct replies'),
+        ),
+        migrations.RunPython(backfill_thread_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('parent__isnull', True)), fields=['last_activity_at', 'id'], name='comments_root_activity_idx'),
+        ),
+    ]
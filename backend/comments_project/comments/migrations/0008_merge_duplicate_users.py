@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:57
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_users(apps, schema_editor):
+    """
+    Fold users sharing a username into the oldest one before username becomes unique.
+
+    Their comments move to the kept user, which takes the profile of the newest
+    duplicate (the one update_or_create would have written last).
+    """
+    alias = schema_editor.connection.alias
+    User = apps.get_model('comments', 'User')
+    Comment = apps.get_model('comments', 'Comment')
+    duplicated = (
+        User.objects.using(alias).order_by().values('username')
+        .annotate(users=Count('id')).filter(users__gt=1).values_list('username', flat=True)
+    )
+    for username in list(duplicated):
+        users = list(User.objects.using(alias).filter(username=username).order_by('id'))
+        keeper, newest, others = users[0], users[-1], [user.pk for user in users[1:]]
+        Comment.objects.using(alias).filter(user_id__in=others).update(user_id=keeper.pk)
+        User.objects.using(alias).filter(pk=keeper.pk).update(email=newest.email, homepage=newest.homepage)
+        User.objects.using(alias).filter(pk__in=others).delete()
+
+
+class Migration(migrations.Migration):
+    # Separate from 0009: PostgreSQL will not ALTER a table with pending deferred FK checks.
+
+    dependencies = [
+        ('comments', '0007_comment_thread_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_users, migrations.RunPython.noop),
+    ]
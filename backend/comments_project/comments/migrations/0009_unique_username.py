@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:57
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0008_merge_duplicate_users'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='users_usernam_71eb2e_idx',
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='username',
+            field=models.CharField(help_text='Letters and digits only (required)', max_length=50, unique=True, validators=[django.core.validators.RegexValidator('^[a-zA-Z0-9]+$', 'Only letters and digits allowed')]),
+        ),
+    ]
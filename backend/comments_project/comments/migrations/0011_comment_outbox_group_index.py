@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0010_comment_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['group', 'id'], name='comment_outbox_group_idx'),
+        ),
+    ]
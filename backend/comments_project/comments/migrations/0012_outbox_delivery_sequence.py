@@ -0,0 +1,54 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:34
+
+from django.db import migrations, models
+from django.db.models import F, Max, Min
+
+
+def number_delivered_events(apps, schema_editor):
+    """
+    Until now the id was the seq clients saw: keep it for delivered rows and
+    continue the counter after the highest id, so their resume points stay valid.
+    """
+    alias = schema_editor.connection.alias
+    OutboxEvent = apps.get_model('comments', 'OutboxEvent')
+    OutboxSequence = apps.get_model('comments', 'OutboxSequence')
+    events = OutboxEvent.objects.using(alias)
+    events.filter(delivered_at__isnull=False).update(seq=F('id'))
+    last = events.aggregate(last=Max('id'))['last'] or 0
+    first = events.filter(seq__isnull=False).aggregate(first=Min('seq'))['first']
+    OutboxSequence.objects.using(alias).create(pk=1, last=last, purged=first - 1 if first is not None else last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0011_comment_outbox_group_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.BigIntegerField(default=0)),
+                ('purged', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'comment_outbox_sequence',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='outboxevent',
+            name='comment_outbox_group_idx',
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='seq',
+            field=models.BigIntegerField(blank=True, help_text='Delivery order, set by the relay', null=True, unique=True),
+        ),
+        migrations.RunPython(number_delivered_events, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['group', 'seq'], name='comment_outbox_group_seq_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:52
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_missing_activity(apps, schema_editor):
+    # Rows without a value get their own time; reconcile_comment_counters can raise it to their replies'.
+    Comment = apps.get_model('comments', 'Comment')
+    Comment.objects.using(schema_editor.connection.alias).filter(last_activity_at__isnull=True).update(
+        last_activity_at=F('created_at')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0012_outbox_delivery_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_activity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='comment',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text="Newest created_at in this comment's subtree"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:55
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0013_comment_last_activity_not_null'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comments_root_user_idx',
+        ),
+    ]
@@ -1,11 +1,40 @@
-from django.db import models
+from django.db import models, transaction
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import RegexValidator, URLValidator, EmailValidator, MaxLengthValidator
+from django.db.models.functions import Greatest, Length
+from django.dispatch import Signal
 from django.utils import timezone
 
+# Materialized path: the zero-padded ids of every ancestor and of the comment
+# itself, e.g. '00000000070000000042' for reply 42 under root 7. Digits only,
+# so lexicographic order matches tree order under any collation.
+PATH_SEGMENT_WIDTH = 10
+PATH_MAX_LENGTH = 1000
+
+
+def path_segment(pk):
+    return str(pk).zfill(PATH_SEGMENT_WIDTH)
+
+
+def path_upper_bound(path):
+    """First path after the subtree rooted at `path` (the next sibling's path)."""
+    head, last = path[:-PATH_SEGMENT_WIDTH], path[-PATH_SEGMENT_WIDTH:]
+    return head + path_segment(int(last) + 1)
+
+# Sent by Comment.save() for a new comment once its path and thread counters are set
+# (post_save comes before that), inside the same transaction.
+comment_inserted = Signal()
+
+TEXT_MAX_LENGTH = 5000
+
+USERNAME_VALIDATOR = RegexValidator(r'^[a-zA-Z0-9]+$', 'Only letters and digits allowed')
+
+
 class User(models.Model):
+    # Unique: a commenter is identified by username (see identity.resolve_user)
     username = models.CharField(
-        max_length=50,
-        validators=[RegexValidator(r'^[a-zA-Z0-9]+$', 'Only letters and digits allowed')],
+        max_length=50, unique=True,
+        validators=[USERNAME_VALIDATOR],
         help_text='Letters and digits only (required)'
     )
     email = models.EmailField(validators=[EmailValidator()], help_text='Valid email format (required)')
@@ -23,16 +52,35 @@ class User(models.Model):
         ordering = ['username']
         db_table = 'users'
         indexes = [
-            models.Index(fields=['username', 'email']),
+            models.Index(fields=['username', 'id'], name='users_username_id_idx'),
+            models.Index(fields=['email', 'id'], name='users_email_id_idx'),
         ]
 
+class CommentQuerySet(models.QuerySet):
+    def subtree(self, comment):
+        """The comment and all of its descendants as one indexed range scan."""
+        return self.filter(path__gte=comment.path, path__lt=path_upper_bound(comment.path))
+
+    def descendants(self, comments, max_depth=None):
+        """Descendants of the given comments, optionally at most max_depth levels down."""
+        condition = models.Q()
+        for comment in comments:
+            branch = models.Q(path__gt=comment.path, path__lt=path_upper_bound(comment.path))
+            if max_depth is not None:
+                branch &= models.Q(path_length__lte=len(comment.path) + max_depth * PATH_SEGMENT_WIDTH)
+            condition |= branch
+        if not condition:
+            return self.none()
+        return self.alias(path_length=Length('path')).filter(condition)
+
+
 class Comment(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='comments',
         help_text='Associated user (required)'
     )
     text = models.TextField(
-        validators=[MaxLengthValidator(5000)],
+        validators=[MaxLengthValidator(TEXT_MAX_LENGTH)],
         help_text='Text with allowed HTML tags (<a>, <code>, <i>, <strong>)'
     )
     parent = models.ForeignKey(
@@ -44,6 +92,25 @@ class Comment(models.Model):
         help_text='Image (JPG/GIF/PNG <=320x240) or TXT (<=100KB)'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    path = models.CharField(
+        max_length=PATH_MAX_LENGTH, editable=False, default='',
+        help_text='Materialized path of zero-padded ancestor ids (maintained on insert)'
+    )
+
+    # Maintained by a PostgreSQL trigger from the tag-stripped text (see migration 0006)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Denormalized thread statistics, kept in step with F() updates on insert/delete
+    # and repairable with `manage.py reconcile_comment_counters`.
+    reply_count = models.PositiveIntegerField(default=0, editable=False, help_text='Direct replies')
+    descendant_count = models.PositiveIntegerField(default=0, editable=False, help_text='Replies at any depth')
+    # Never NULL, so keyset cursors on it always have a value; save() replaces the
+    # insert-time default with the comment's own created_at.
+    last_activity_at = models.DateTimeField(
+        default=timezone.now, editable=False, help_text='Newest created_at in this comment\'s subtree'
+    )
+
+    objects = CommentQuerySet.as_manager()
 
     def __str__(self):
         return f"Comment by {self.user.username}: {self.text[:50]}..."
@@ -54,10 +121,126 @@ class Comment(models.Model):
     def is_root_comment(self):
         return self.parent is None
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            if adding and not self.path:
+                parent_path = self.parent.path if self.parent_id else ''
+                self.path = parent_path + path_segment(self.pk)
+                self.last_activity_at = self.created_at
+                Comment.objects.filter(pk=self.pk).update(path=self.path, last_activity_at=self.last_activity_at)
+                self.count_in_ancestors(1)
+                comment_inserted.send(sender=Comment, instance=self)
+
+    def count_in_ancestors(self, delta):
+        """
+        Add delta to the counters of every ancestor in one UPDATE.
+
+        On removal (delta < 0) last_activity_at is recomputed from what is left
+        of each ancestor's subtree, since the removed comment may have been its newest.
+        """
+        if not self.parent_id:
+            return
+        updates = {
+            'reply_count': models.F('reply_count') + models.Case(
+                models.When(pk=self.parent_id, then=models.Value(delta)), default=models.Value(0)
+            ),
+            'descendant_count': models.F('descendant_count') + delta,
+        }
+        if delta > 0:
+            updates['last_activity_at'] = Greatest('last_activity_at', models.Value(self.created_at))
+        else:
+            updates['last_activity_at'] = models.Subquery(
+                Comment.objects.filter(path__startswith=models.OuterRef('path'))
+                .order_by('-created_at').values('created_at')[:1]
+            )
+        Comment.objects.filter(pk__in=self.ancestor_ids).update(**updates)
+
+    @property
+    def ancestor_ids(self):
+        return [
+            int(self.path[start:start + PATH_SEGMENT_WIDTH])
+            for start in range(0, len(self.path) - PATH_SEGMENT_WIDTH, PATH_SEGMENT_WIDTH)
+        ]
+
+    @property
+    def depth(self):
+        return len(self.path) // PATH_SEGMENT_WIDTH - 1
+
+    @property
+    def root_id(self):
+        return int(self.path[:PATH_SEGMENT_WIDTH])
+
+    def get_descendants(self):
+        return Comment.objects.descendants([self])
+
+    def get_descendant_count(self):
+        return self.get_descendants().count()
+
+    def get_last_activity(self):
+        return Comment.objects.subtree(self).aggregate(last=models.Max('created_at'))['last']
+
     class Meta:
         ordering = ['-created_at']
         db_table = 'comments'
         indexes = [
             models.Index(fields=['created_at', 'user']),
             models.Index(fields=['parent']),
-        ]
\ No newline at end of file
+            models.Index(fields=['path'], name='comments_path_idx'),
+            # Keyset pagination of root comments (parent IS NULL) by created_at and
+            # last_activity_at. user__username/user__email sort on the joined users
+            # table, which no index on comments can serve.
+            models.Index(
+                fields=['created_at', 'id'], name='comments_root_created_idx',
+                condition=models.Q(parent__isnull=True),
+            ),
+            models.Index(
+                fields=['last_activity_at', 'id'], name='comments_root_activity_idx',
+                condition=models.Q(parent__isnull=True),
+            ),
+        ]
+
+class OutboxEvent(models.Model):
+    """
+    Channel-layer message stored in the transaction that produced it.
+
+    comments/outbox.py sends committed rows in batches and stamps delivered_at,
+    so an event is never sent for a rolled-back write and never lost to a
+    broker or worker failure (at-least-once). `seq`, sent to clients, is given
+    at delivery: ids follow INSERT order, but transactions commit (and so get
+    relayed) in another order.
+    """
+    group = models.CharField(max_length=100)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    seq = models.BigIntegerField(null=True, blank=True, unique=True, help_text='Delivery order, set by the relay')
+
+    def __str__(self):
+        return f"{self.payload.get('type')} -> {self.group}"
+
+    class Meta:
+        ordering = ['id']
+        db_table = 'comment_outbox'
+        indexes = [
+            # The relay's scan: undelivered rows in id order.
+            models.Index(fields=['id'], name='comment_outbox_pending_idx', condition=models.Q(delivered_at__isnull=True)),
+            models.Index(fields=['delivered_at'], name='comment_outbox_delivered_idx'),
+            # Replay of one thread's (or the feed's) events after a sequence number.
+            models.Index(fields=['group', 'seq'], name='comment_outbox_group_seq_idx'),
+        ]
+
+
+class OutboxSequence(models.Model):
+    """
+    Single row: the last `seq` handed out and the highest one purged.
+
+    The relay holds it locked while it sends a batch, so relays run one at a
+    time and events go out in `seq` order.
+    """
+    last = models.BigIntegerField(default=0)
+    purged = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'comment_outbox_sequence'
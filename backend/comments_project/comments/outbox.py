@@ -0,0 +1,171 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Max, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .fanout import send_messages
+from .models import OutboxEvent, OutboxSequence
+
+logger = logging.getLogger(__name__)
+
+# Set while a relay task is queued or running, so a burst of commits schedules one task.
+RELAY_KEY = 'comments:outbox:relay'
+RELAY_KEY_TIMEOUT = 60
+# Primary key of the single OutboxSequence row.
+SEQUENCE_ID = 1
+
+
+def publish(group, message, using='default'):
+    """
+    Queue a channel-layer message in the current transaction.
+
+    The row commits or rolls back with the change it describes; once
+    committed, a relay task is scheduled to send it.
+    """
+    OutboxEvent.objects.using(using).create(group=group, payload=message)
+    transaction.on_commit(schedule_relay, using=using)
+
+
+def schedule_relay():
+    if not cache.add(RELAY_KEY, 1, timeout=RELAY_KEY_TIMEOUT):
+        return
+    from .tasks import relay_outbox
+    try:
+        relay_outbox.delay()
+    except Exception as e:
+        # The event is safely stored: the periodic relay sends it.
+        logger.warning("Could not schedule the outbox relay: %s", e)
+        cache.delete(RELAY_KEY)
+
+
+def relay_batch(batch_size=None, using='default'):
+    """
+    Send up to batch_size undelivered events, oldest first; returns how many.
+
+    Every message carries the next number of the OutboxSequence counter as
+    `seq` (see replay()). The counter row stays locked until the batch is
+    marked delivered, so relays run one at a time: a client that has seen
+    seq N has been sent every event up to N. Events are grouped per
+    channel-layer group and sent as few frames as fit (see
+    fanout.send_messages). If a send fails the transaction rolls back and the
+    batch is retried later, which may repeat groups already sent: delivery is
+    at-least-once.
+    """
+    batch_size = batch_size or settings.COMMENTS_OUTBOX_BATCH_SIZE
+    with transaction.atomic(using=using):
+        sequence, _ = OutboxSequence.objects.using(using).select_for_update().get_or_create(pk=SEQUENCE_ID)
+        events = list(
+            OutboxEvent.objects.using(using)
+            .filter(delivered_at__isnull=True)
+            .order_by('id')
+            .values_list('id', 'group', 'payload')[:batch_size]
+        )
+        if not events:
+            return 0
+        groups = {}
+        for seq, (pk, group, payload) in enumerate(events, start=sequence.last + 1):
+            groups.setdefault(group, []).append({**payload, 'seq': seq})
+        for group, messages in groups.items():
+            send_messages(group, messages)
+        ids = [pk for pk, _, _ in events]
+        OutboxEvent.objects.using(using).filter(pk__in=ids).update(
+            delivered_at=timezone.now(), seq=sequence_numbers(ids, sequence.last + 1)
+        )
+        sequence.last += len(events)
+        sequence.save(update_fields=['last'])
+    return len(events)
+
+
+def sequence_numbers(ids, first):
+    """
+    SQL expression numbering the rows `ids` (ascending) from `first`.
+
+    One WHEN per run of consecutive ids, each an offset from the id: a burst
+    is usually a single run, so this stays small whatever the batch size.
+    """
+    whens = []
+    start = 0
+    for index in range(1, len(ids) + 1):
+        if index == len(ids) or ids[index] != ids[index - 1] + 1:
+            whens.append(When(pk__range=(ids[start], ids[index - 1]), then=F('id') + (first + start - ids[start])))
+            start = index
+    return Case(*whens)
+
+
+def relay(batch_size=None, using='default'):
+    """Send batches until the outbox is empty; returns the number of events sent."""
+    batch_size = batch_size or settings.COMMENTS_OUTBOX_BATCH_SIZE
+    sent = 0
+    while True:
+        count = relay_batch(batch_size, using)
+        sent += count
+        if count < batch_size:
+            return sent
+
+
+def drain(batch_size=None):
+    """
+    relay() as a scheduled task: clear the schedule flag, then look once more
+    for events whose commit saw the flag still set and scheduled nothing.
+    """
+    try:
+        sent = relay(batch_size)
+    finally:
+        cache.delete(RELAY_KEY)
+    return sent + relay(batch_size)
+
+
+def replay(groups, after, limit=None, using='default'):
+    """
+    Delivered events of `groups` with a sequence number above `after`, oldest
+    first, in the same shape the relay sent them.
+
+    Delivered rows stay in the outbox for COMMENTS_OUTBOX_RETENTION, which makes
+    it the replay buffer. None means the gap cannot be filled: some of the events
+    were purged, there are more than `limit` (COMMENTS_REPLAY_LIMIT) of them, or
+    `after` was never handed out by this outbox.
+
+    relay_batch() sends a batch before its numbers commit, so a client may hold
+    a seq up to one batch past the committed counter; that gap is empty.
+    """
+    limit = limit or settings.COMMENTS_REPLAY_LIMIT
+    last, purged = sequence_bounds(using)
+    # Further past the counter: a seq from before the outbox was reset.
+    if after < purged or after > last + settings.COMMENTS_OUTBOX_BATCH_SIZE:
+        return None
+    events = list(
+        OutboxEvent.objects.using(using)
+        .filter(seq__gt=after, group__in=groups)
+        .order_by('seq')
+        .values_list('seq', 'payload')[:limit + 1]
+    )
+    if len(events) > limit:
+        return None
+    return [{**payload, 'seq': seq} for seq, payload in events]
+
+
+def sequence_bounds(using='default'):
+    """(last seq handed out, highest seq purged), both 0 before the first delivery."""
+    bounds = OutboxSequence.objects.using(using).filter(pk=SEQUENCE_ID).values_list('last', 'purged').first()
+    return bounds or (0, 0)
+
+
+def latest_sequence(using='default'):
+    """Sequence number of the newest delivered event (0 when there is none)."""
+    return sequence_bounds(using)[0]
+
+
+def purge_delivered(age=None, using='default'):
+    """Delete events delivered more than `age` seconds ago (COMMENTS_OUTBOX_RETENTION)."""
+    age = settings.COMMENTS_OUTBOX_RETENTION if age is None else age
+    cutoff = timezone.now() - timedelta(seconds=age)
+    last = OutboxEvent.objects.using(using).filter(delivered_at__lt=cutoff).aggregate(last=Max('seq'))['last']
+    if last is None:
+        return 0
+    # Everything up to the watermark goes, so replay can tell from it alone what is missing.
+    deleted, _ = OutboxEvent.objects.using(using).filter(seq__lte=last).delete()
+    OutboxSequence.objects.using(using).filter(pk=SEQUENCE_ID).update(purged=Greatest('purged', Value(last)))
+    return deleted
@@ -0,0 +1,187 @@
+import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CommentPagination(PageNumberPagination):
+    page_size = 25
+
+
+class CommentCursorPagination(BasePagination):
+    """
+    Keyset pagination over one of the allowed ordering fields with `id` as tie-breaker.
+
+    Each page is an indexed range scan starting after the previous page's last
+    row, so deep pages cost the same as the first one and no COUNT(*) is run.
+    Requests that pass ?page= fall back to page-number pagination (admin UI).
+    """
+    page_size = 25
+    cursor_query_param = 'cursor'
+    ordering_param = 'ordering'
+    ordering_fields = ('created_at', 'user__username', 'user__email', 'last_activity_at')
+    datetime_fields = ('created_at', 'last_activity_at')
+    # Cursor values of any other ordering field are strings.
+    numeric_fields = ()
+    default_ordering = '-created_at'
+    invalid_cursor_message = 'Invalid cursor'
+    fallback_class = CommentPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if self.uses_fallback(request):
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """Cursor mode of paginate_queryset on the async ORM (callers handle ?page= themselves)."""
+        self.fallback = None
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def uses_fallback(self, request):
+        return self.fallback_class.page_query_param in request.query_params
+
+    def page_queryset(self, queryset, request):
+        """The ordered, cursor-filtered queryset of one page plus a look-ahead row."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request)
+        field, descending = self.ordering.lstrip('-'), self.ordering.startswith('-')
+        cursor = self.decode_cursor(request)
+        self.has_cursor = cursor is not None
+        self.reverse = cursor is not None and cursor[2]
+
+        # A "previous" cursor walks backwards: flip the order, then flip the page back.
+        backwards = descending != self.reverse
+        prefix = '-' if backwards else ''
+        queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}id')
+        if cursor is not None:
+            value, pk = cursor[0], cursor[1]
+            lookup = 'lt' if backwards else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': pk})
+            )
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+
+        self.has_next = has_more if not self.reverse else self.has_cursor
+        self.has_previous = has_more if self.reverse else self.has_cursor
+        return self.page
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_param, self.default_ordering).split(',')[0].strip()
+        if ordering.lstrip('-') not in self.ordering_fields:
+            return self.default_ordering
+        return ordering
+
+    def get_position(self, comment):
+        value = comment
+        for part in self.ordering.lstrip('-').split('__'):
+            value = getattr(value, part)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        return value, comment.pk
+
+    def encode_cursor(self, comment, reverse):
+        value, pk = self.get_position(comment)
+        token = urlsafe_b64encode(json.dumps([value, pk, reverse]).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            value, pk, reverse = json.loads(urlsafe_b64decode(token.encode()))
+            field = self.ordering.lstrip('-')
+            if field in self.datetime_fields:
+                value = parse_datetime(value)
+            elif field in self.numeric_fields:
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    raise ValueError
+            elif not isinstance(value, str):
+                raise ValueError
+            if value is None or isinstance(pk, bool) or not isinstance(pk, int):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk, bool(reverse)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.fallback_class.page_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Page number (switches to page-number pagination).',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class ReplyCursorPagination(CommentCursorPagination):
+    """Keyset pagination of a comment's direct replies, oldest first by default."""
+    default_ordering = 'created_at'
+
+
+class SearchCursorPagination(CommentCursorPagination):
+    """Keyset pagination of search results by rank (best first), then id."""
+    ordering_fields = ('rank',)
+    numeric_fields = ('rank',)
+    default_ordering = '-rank'
+
+    def get_ordering(self, request):
+        return self.default_ordering
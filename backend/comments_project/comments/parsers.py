@@ -0,0 +1,20 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from .encoding import JSONDecodeError, loads
+from .renderers import ORJSONRenderer
+
+
+class ORJSONParser(JSONParser):
+    """Drop-in JSONParser backed by orjson (UTF-8 bodies; other charsets use the stdlib parser)."""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return loads(stream.read())
+        except JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
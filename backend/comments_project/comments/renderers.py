@@ -0,0 +1,19 @@
+from rest_framework.renderers import JSONRenderer
+from .encoding import dumps
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Drop-in JSONRenderer backed by orjson.
+
+    Pretty-printed responses (`; indent=N`, the browsable API) still go through
+    the stdlib renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer, so the output stays a valid JavaScript literal.
+        return dumps(data).replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
@@ -0,0 +1,49 @@
+from rest_framework import serializers
+from .tree import attach_reply_trees, reply_ordering
+
+# One shared field instance: formats datetimes exactly like CommentSerializer
+# (current timezone, ISO 8601 with 'Z' for UTC) without building a field per row.
+_datetime = serializers.DateTimeField()
+
+
+def render_comment(comment, request=None):
+    """
+    Read-only fast path equivalent to CommentSerializer(comment).data.
+
+    Reads attributes of an already loaded comment (user selected, replies
+    attached as `_reply_tree`) straight into a dict: no per-instance field
+    binding, nested serializers or method fields. Keys, order and values
+    match CommentSerializer, so the JSON output is the same.
+    """
+    if not hasattr(comment, '_reply_tree'):
+        attach_reply_trees([comment], ordering=reply_ordering(request))
+    user = comment.user
+    parent_id = comment.parent_id
+    return {
+        'id': comment.pk,
+        'user': {'username': user.username, 'email': user.email, 'homepage': user.homepage},
+        'text': comment.text,
+        'parent': parent_id,
+        'file': render_file(comment.file, request),
+        'created_at': _datetime.to_representation(comment.created_at),
+        'replies': [render_comment(reply, request) for reply in comment._reply_tree],
+        'parent_username': comment.parent.user.username if parent_id is not None else '',
+        'reply_count': comment.reply_count,
+        'descendant_count': comment.descendant_count,
+        'last_activity_at': _datetime.to_representation(comment.last_activity_at),
+    }
+
+
+def render_comments(comments, request=None):
+    """Fast-path equivalent of CommentSerializer(comments, many=True).data."""
+    return [render_comment(comment, request) for comment in comments]
+
+
+def render_file(file, request=None):
+    # Same rules as serializers.FileField: None when empty, absolute URL with a request.
+    if not file:
+        return None
+    url = file.url
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
@@ -0,0 +1,120 @@
+import logging
+import random
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import endpoint_label, registry
+
+logger = logging.getLogger(__name__)
+
+# Set on a client's successful write; while present its reads stay on the primary.
+PIN_COOKIE = 'comments_db_pin'
+UNSAFE_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+
+
+class ReadRoute:
+    """Where one request's reads go: `alias` None means the primary, `reason` says why."""
+
+    def __init__(self):
+        self.alias = None
+        self.reason = None
+
+
+# Route of the request being handled. A mutable object rather than the alias
+# itself: sync_to_async hands the ORM a copy of the context, which shares it.
+current_route = ContextVar('comments_read_route', default=None)
+
+
+def route_reads(request, modified=None):
+    """
+    Send the rest of this request's reads to a replica (settings.COMMENTS_DB_REPLICAS).
+
+    Views call it for list, thread and search GETs. Reads stay on the primary
+    while the client holds the pin cookie of its own recent write, or - for
+    cached lists, given their last `modified` time - within
+    COMMENTS_DB_PIN_SECONDS of any write: a lagging replica must not fill the
+    freshly invalidated list cache with the old list.
+    """
+    route = current_route.get()
+    replicas = settings.COMMENTS_DB_REPLICAS
+    if route is None or not replicas:
+        return
+    if request.COOKIES.get(PIN_COOKIE):
+        route.reason = 'pinned'
+    elif modified is not None and time.time() - modified < settings.COMMENTS_DB_PIN_SECONDS:
+        route.reason = 'recent_write'
+    else:
+        route.alias = random.choice(replicas)
+        route.reason = 'replica'
+
+
+class ReplicaRouter:
+    """Reads go where route_reads() sent them; writes, migrations and everything outside a routed request use the primary."""
+
+    def db_for_read(self, model, **hints):
+        route = current_route.get()
+        return route.alias if route is not None else None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.COMMENTS_DB_REPLICAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Scopes route_reads() to one request, reports its decision and pins the
+    client to the primary for COMMENTS_DB_PIN_SECONDS after a successful write.
+
+    Decisions are counted per endpoint in comments_db_reads_total and logged
+    at DEBUG. Does nothing unless replicas are configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.COMMENTS_DB_REPLICAS:
+            return self.get_response(request)
+        route = ReadRoute()
+        token = current_route.set(route)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_route.reset(token)
+        return self.finish(request, response, route)
+
+    async def __acall__(self, request):
+        if not settings.COMMENTS_DB_REPLICAS:
+            return await self.get_response(request)
+        route = ReadRoute()
+        token = current_route.set(route)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_route.reset(token)
+        return self.finish(request, response, route)
+
+    def finish(self, request, response, route):
+        if route.reason is not None:
+            endpoint = endpoint_label(request)
+            registry.record_db_route(endpoint, route.reason)
+            logger.debug('%s %s reads from %s (%s)', request.method, endpoint, route.alias or 'default', route.reason)
+        if request.method in UNSAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.COMMENTS_DB_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
@@ -0,0 +1,24 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import Cast
+
+
+def search_comments(queryset, query):
+    """
+    Filter and rank comments whose text matches `query`.
+
+    On PostgreSQL this uses the trigger-maintained, GIN-indexed search_vector.
+    Elsewhere (the SQLite test setup) every word must occur in the text, with
+    a constant rank.
+    """
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config='simple', search_type='websearch')
+        # Cast to double precision so the rank survives a round trip through the cursor
+        rank = Cast(SearchRank(F('search_vector'), search_query), FloatField())
+        return queryset.filter(search_vector=search_query).annotate(rank=rank)
+
+    condition = Q()
+    for word in query.split():
+        condition &= Q(text__icontains=word)
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
@@ -1,19 +1,20 @@
 # serializers.py
 from rest_framework import serializers
-from .models import Comment, User
-import bleach
-from PIL import Image
-from django.core.files.base import ContentFile
-from io import BytesIO
+from .identity import resolve_user
+from .models import USERNAME_VALIDATOR, Comment, User
+from .tree import attach_reply_trees, reply_ordering
+from .media import IMAGE_EXTENSIONS, MAX_IMAGE_UPLOAD_SIZE
+from .sanitizer import sanitize, tags_balanced
 from django.core.exceptions import ValidationError
 from captcha.models import CaptchaStore
-import re
 import json
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'email', 'homepage']
+        # Returning commenters reuse their username; resolve_user upserts by it.
+        extra_kwargs = {'username': {'validators': [USERNAME_VALIDATOR]}}
 
     def create(self, validated_data):
         username = validated_data.get('username')
@@ -27,8 +28,11 @@ class UserSerializer(serializers.ModelSerializer):
 class CommentSerializer(serializers.ModelSerializer):
     user = UserSerializer(required=False)
     user_name = serializers.CharField(write_only=True)
-    email = serializers.EmailField(write_only=True)
-    home_page = serializers.URLField(write_only=True, allow_blank=True)
+    # Model lengths: the identity upsert writes these without a model-level check
+    email = serializers.EmailField(write_only=True, max_length=User._meta.get_field('email').max_length)
+    home_page = serializers.URLField(
+        write_only=True, allow_blank=True, max_length=User._meta.get_field('homepage').max_length
+    )
     replies = serializers.SerializerMethodField()
     captcha_0 = serializers.CharField(write_only=True, required=False)
     captcha_1 = serializers.CharField(write_only=True, required=False)
@@ -39,9 +43,13 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'text', 'parent', 'file', 'created_at',
             'replies', 'captcha_0', 'captcha_1', 'parent_username',
-            'user_name', 'email', 'home_page'
+            'user_name', 'email', 'home_page',
+            'reply_count', 'descendant_count', 'last_activity_at',
+        ]
+        read_only_fields = [
+            'created_at', 'replies', 'parent_username',
+            'reply_count', 'descendant_count', 'last_activity_at',
         ]
-        read_only_fields = ['created_at', 'replies', 'parent_username']
         extra_kwargs = {
             'captcha_0': {'write_only': True},
             'captcha_1': {'write_only': True},
@@ -57,14 +65,11 @@ class CommentSerializer(serializers.ModelSerializer):
         return super().to_internal_value(data)
 
     def validate(self, data):
-        # Clean text with bleach
-        ALLOWED_TAGS = ['a', 'code', 'i', 'strong']
-        ALLOWED_ATTRIBUTES = {'a': ['href', 'title']}
-        data['text'] = bleach.clean(data['text'], tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES)
+        # Clean text with bleach (cached, so a previewed text is not cleaned again)
+        data['text'] = sanitize(data['text'])
 
         # Validate HTML tags
-        html_pattern = r'^(?:(?!<[^>]+>\s*<\w+\b[^>]*>).)*$'
-        if not re.match(html_pattern, data['text']):
+        if not tags_balanced(data['text']):
             raise serializers.ValidationError({"text": "Invalid HTML: unbalanced tags"})
 
         # Handle empty parent
@@ -94,26 +99,33 @@ class CommentSerializer(serializers.ModelSerializer):
             'homepage': data.pop('home_page', '')
         }
         if user_data['username'] and user_data['email']:
-            user_serializer = UserSerializer(data=user_data)
-            user_serializer.is_valid(raise_exception=True)
-            data['user'] = user_serializer.validated_data
+            # email and home_page are already validated by their fields; only the username rules remain
+            self.validate_username(user_data['username'])
+            data['user'] = user_data
         else:
             raise serializers.ValidationError({"user": "Username and email are required"})
 
         return data
 
+    def validate_username(self, username):
+        max_length = User._meta.get_field('username').max_length
+        if len(username) > max_length:
+            raise serializers.ValidationError(
+                {'username': [f'Ensure this field has no more than {max_length} characters.']}
+            )
+        try:
+            USERNAME_VALIDATOR(username)
+        except ValidationError as e:
+            raise serializers.ValidationError({'username': e.messages})
+
     def validate_file(self, value):
+        # Only cheap checks here: decoding and thumbnailing images happens in
+        # tasks.process_attachment after the comment is committed.
         if not value:
             return value
-        if value.name.lower().endswith(('.jpg', '.jpeg', '.gif', '.png')):
-            img = Image.open(value)
-            if img.format not in ['JPEG', 'GIF', 'PNG']:
-                raise ValidationError("Only JPG, GIF, PNG allowed")
-            if img.size[0] > 320 or img.size[1] > 240:
-                img.thumbnail((320, 240))
-                output = BytesIO()
-                img.save(output, format=img.format)
-                value = ContentFile(output.getvalue(), value.name)
+        if value.name.lower().endswith(IMAGE_EXTENSIONS):
+            if value.size > MAX_IMAGE_UPLOAD_SIZE:
+                raise ValidationError("Image must be <= 5MB")
             return value
         elif value.name.lower().endswith('.txt'):
             if value.size > 100 * 1024:
@@ -123,31 +135,35 @@ class CommentSerializer(serializers.ModelSerializer):
             raise ValidationError("Only JPG, GIF, PNG or TXT allowed")
 
     def create(self, validated_data):
-        user_data = validated_data.pop('user')
-        user, _ = User.objects.update_or_create(
-            username=user_data['username'],
-            defaults={'email': user_data['email'], 'homepage': user_data.get('homepage', '')}
-        )
-        validated_data['user'] = user
+        validated_data['user'] = resolve_user(**validated_data.pop('user'))
         instance = super().create(validated_data)
+        instance._reply_tree = []  # a new comment has no replies to load
         return instance
 
     def get_replies(self, obj):
-        def serialize_replies(comment, depth=0, max_depth=5):
-            if depth >= max_depth:
-                return []
+        # Reply trees are loaded in bulk by attach_reply_trees; a lone instance
+        # (e.g. a freshly created comment) loads its own subtree the same way.
+        if not hasattr(obj, '_reply_tree'):
+            attach_reply_trees([obj], ordering=reply_ordering(self.context.get('request')))
+        serializer = CommentSerializer(obj._reply_tree, many=True, context=self.context)
+        return serializer.data
+
+    def get_parent_username(self, obj):
+        if obj.parent:
+            return obj.parent.user.username
+        return ''
 
-            request = self.context.get('request', None)
-            if request and hasattr(request, 'query_params'):
-                ordering = request.query_params.get('ordering', 'created_at')
-            else:
-                ordering = 'created_at'
 
-            children = Comment.objects.filter(parent=comment).order_by(ordering)
-            serializer = CommentSerializer(children, many=True, context=self.context)
-            return serializer.data
+class CommentSearchSerializer(serializers.ModelSerializer):
+    """Flat, read-only representation of a search hit (no nested replies)."""
+    user = UserSerializer(read_only=True)
+    parent_username = serializers.SerializerMethodField()
+    rank = serializers.FloatField(read_only=True)
 
-        return serialize_replies(obj)
+    class Meta:
+        model = Comment
+        fields = ['id', 'user', 'text', 'parent', 'file', 'created_at', 'parent_username', 'rank']
+        read_only_fields = fields
 
     def get_parent_username(self, obj):
         if obj.parent:
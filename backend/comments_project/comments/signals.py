@@ -1,30 +1,46 @@
-from django.db.models.signals import post_save
+import logging
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.db import transaction
-from .models import Comment
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-import logging
-from .tasks import save_comment
-from .serializers import CommentSerializer
+from .models import Comment, User, comment_inserted
+from .caching import invalidate_comment_lists
+from .identity import forget_user
+from .events import publish_new_comment
+from .tasks import process_attachment
 
 logger = logging.getLogger(__name__)
 
+
+def schedule_attachment(comment_id):
+    try:
+        process_attachment.delay(comment_id)
+    except Exception as e:
+        # The comment is already committed; it keeps the original file as uploaded.
+        logger.warning("Could not schedule attachment processing for comment ID %s: %s", comment_id, e)
+
+
 @receiver(post_save, sender=Comment)
 def comment_created(sender, instance, created, **kwargs):
-    if created:
-        try:
-            with transaction.atomic():
-                channel_layer = get_channel_layer()
-                # Fix: Serialize here if keeping this, or remove entirely since task does it
-                serialized_comment = CommentSerializer(instance).data  # Add this
-                async_to_sync(channel_layer.group_send)(
-                    'comments_group',
-                    {
-                        'type': 'new_comment',
-                        'comment': serialized_comment  # Change to 'comment'
-                    }
-                )
-                logger.info(f"Signal sent for new comment ID: {instance.id}")
-        except Exception as e:
-            logger.error(f"Error in comment_created signal for comment ID {instance.id}: {str(e)}")
\ No newline at end of file
+    transaction.on_commit(invalidate_comment_lists)
+    if created and instance.file:
+        transaction.on_commit(lambda: schedule_attachment(instance.pk))
+
+
+@receiver(comment_inserted)
+def comment_inserted_event(sender, instance, **kwargs):
+    publish_new_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    # Each deleted comment (a cascade sends one signal per row) leaves its
+    # surviving ancestors' counters; ancestors deleted with it are already gone.
+    instance.count_in_ancestors(-1)
+    transaction.on_commit(invalidate_comment_lists)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Edits outside the comment form (admin, shell) must not be hidden by a cached identity.
+    transaction.on_commit(lambda: forget_user(instance.username))
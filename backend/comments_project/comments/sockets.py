@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import weakref
+from django.conf import settings
+from django.core.cache import cache
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# How often each process closes idle sockets and exchanges connection counts.
+SWEEP_INTERVAL = 10
+# Cache entries of processes that stopped reporting expire after this many seconds.
+LOAD_TTL = SWEEP_INTERVAL * 3
+PROCESSES_KEY = 'comments:ws:processes'
+IDLE_CLOSE_CODE = 4408
+OVERLOAD_CLOSE_CODE = 1013  # Try Again Later
+
+
+class SocketRegistry:
+    """
+    Open WebSocket consumers of this process.
+
+    Admission is checked against COMMENTS_WS_MAX_CONNECTIONS (this process) and
+    COMMENTS_WS_MAX_TOTAL_CONNECTIONS (all processes) without any I/O: the other
+    processes' counts are read from the cache by the periodic sweep, which also
+    publishes this process's count and closes sockets that sent nothing for
+    COMMENTS_WS_IDLE_TIMEOUT seconds.
+    """
+
+    def __init__(self):
+        self.consumers = set()
+        self.others = 0
+        self.process_key = f'comments:ws:load:{socket.gethostname()}:{os.getpid()}'
+        # One sweeper per event loop (Daphne runs one per process).
+        self.sweepers = weakref.WeakKeyDictionary()
+
+    def admit(self, consumer):
+        """Register the consumer; returns why it is refused ('process' or 'total'), or None."""
+        if len(self.consumers) >= settings.COMMENTS_WS_MAX_CONNECTIONS:
+            return 'process'
+        total_limit = settings.COMMENTS_WS_MAX_TOTAL_CONNECTIONS
+        if total_limit and self.others + len(self.consumers) >= total_limit:
+            return 'total'
+        self.consumers.add(consumer)
+        loop = asyncio.get_running_loop()
+        if loop not in self.sweepers:
+            self.sweepers[loop] = loop.create_task(self.sweep_forever())
+        return None
+
+    def release(self, consumer):
+        self.consumers.discard(consumer)
+        if not self.consumers:
+            for sweeper in self.sweepers.values():
+                sweeper.cancel()
+            self.sweepers.clear()
+
+    async def sweep_forever(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error("WebSocket sweep failed: %s", e)
+
+    async def sweep(self, now=None):
+        await self.reap(now)
+        if settings.COMMENTS_WS_MAX_TOTAL_CONNECTIONS:
+            await self.exchange_load()
+
+    async def reap(self, now=None):
+        """Close sockets idle for longer than COMMENTS_WS_IDLE_TIMEOUT; returns how many."""
+        timeout = settings.COMMENTS_WS_IDLE_TIMEOUT
+        if not timeout:
+            return 0
+        cutoff = (now or time.monotonic()) - timeout
+        idle = [consumer for consumer in self.consumers if consumer.last_seen < cutoff]
+        for consumer in idle:
+            self.consumers.discard(consumer)
+            registry.record_ws_event(consumer.metrics_label, 'reaped')
+            await consumer.close(code=IDLE_CLOSE_CODE)
+        if idle:
+            logger.info("Closed %d idle WebSocket connection(s)", len(idle))
+        return len(idle)
+
+    async def exchange_load(self):
+        # The process index is rewritten without a lock: a lost update is repaired by the next sweep.
+        now = time.time()
+        processes = await cache.aget(PROCESSES_KEY) or {}
+        processes = {key: seen for key, seen in processes.items() if now - seen < LOAD_TTL}
+        processes[self.process_key] = now
+        await cache.aset_many({PROCESSES_KEY: processes, self.process_key: len(self.consumers)}, timeout=LOAD_TTL)
+        loads = await cache.aget_many([key for key in processes if key != self.process_key])
+        self.others = sum(loads.values())
+
+
+sockets = SocketRegistry()
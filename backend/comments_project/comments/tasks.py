@@ -1,44 +1,62 @@
 from celery import shared_task
+import logging
+import os
 from django.db import transaction
+from . import outbox
+from .events import comment_group, comment_updated_event
+from .media import IMAGE_EXTENSIONS, InvalidImage, make_thumbnail
 from .models import Comment
-from .serializers import CommentSerializer
-import logging
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def save_comment(comment_id):
+@shared_task(ignore_result=True)
+def relay_outbox():
     """
-    Celery task для відправки вже збереженого коментаря через WebSocket.
+    Celery task: відправка накопичених подій outbox через WebSocket пакетами.
+    Запускається після commit та періодично через beat (COMMENTS_OUTBOX_RELAY_INTERVAL).
     """
-    try:
-        # Отримуємо коментар з бази з використанням транзакції
-        with transaction.atomic():
-            instance = Comment.objects.get(id=comment_id)
-            logger.info(f"Retrieved comment ID {comment_id} from database")
+    sent = outbox.drain()
+    if sent:
+        logger.debug("Outbox relay sent %d event(s)", sent)
 
-        # Серіалізуємо для WebSocket
-        serialized_comment = CommentSerializer(instance, context={'request': None}).data
-        logger.info(f"Serialized comment ID {comment_id}: {serialized_comment}")
+@shared_task(ignore_result=True)
+def purge_outbox():
+    """Celery task: видалення доставлених подій, старших за COMMENTS_OUTBOX_RETENTION."""
+    deleted = outbox.purge_delivered()
+    if deleted:
+        logger.info("Purged %d delivered outbox event(s)", deleted)
 
-        # Надсилаємо через WebSocket
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            'comments_group',
-            {
-                'type': 'new_comment',
-                'comment': serialized_comment,
-            }
-        )
+@shared_task(ignore_result=True)
+def process_attachment(comment_id):
+    """
+    Celery task: перевірка формату та зменшення зображення до 320x240 після збереження коментаря.
+    Клієнти отримують comment_updated з новим посиланням на файл.
+    """
+    try:
+        comment = Comment.objects.select_related('user', 'parent__user').get(id=comment_id)
+    except Comment.DoesNotExist:
+        logger.warning("Comment with id %s does not exist, skipping attachment", comment_id)
+        return
+    if not comment.file or not comment.file.name.lower().endswith(IMAGE_EXTENSIONS):
+        return
 
-        logger.info(f"Comment {comment_id} sent via WebSocket")
-        return {"id": instance.id, "message": "Comment sent via WebSocket"}
+    original = comment.file.name
+    try:
+        with comment.file.open('rb') as source:
+            thumbnail = make_thumbnail(source, os.path.basename(original))
+    except InvalidImage as e:
+        logger.warning("Rejected attachment of comment ID %s: %s", comment_id, e)
+        comment.file.delete(save=False)
+        thumbnail = None
+    else:
+        if thumbnail is None:
+            return
+        comment.file.save(os.path.basename(original), thumbnail, save=False)
 
-    except Comment.DoesNotExist:
-        logger.error(f"Comment with id {comment_id} does not exist")
-        raise
-    except Exception as e:
-        logger.error(f"Error in save_comment task for comment ID {comment_id}: {str(e)}")
-        raise
\ No newline at end of file
+    # Нове посилання на файл і подія comment_updated записуються однією транзакцією
+    with transaction.atomic():
+        comment.save(update_fields=['file'])
+        outbox.publish(comment_group(comment), comment_updated_event(comment))
+    if thumbnail is not None:
+        comment.file.storage.delete(original)
+        logger.info("Attachment of comment ID %s resized: %s", comment_id, comment.file.name)
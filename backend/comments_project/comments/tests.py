@@ -1,3 +1,1266 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from base64 import urlsafe_b64encode
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from uuid import UUID
+from PIL import Image
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.apps import apps as django_apps
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from comments_project.celery import app as celery_app
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from .benchmarks import measure_concurrency, measure_create, measure_list, measure_outbox
+from .caching import MODIFIED_KEY, stats
+from .consumers import CommentConsumer
+from .counters import reconcile_thread_counters
+from .sockets import sockets
+from .events import FEED_GROUP, new_comment_event, thread_group
+from . import outbox
+from .fanout import batch_messages, encode_frame, send_messages
+from .logs import BackgroundHandler, JSONFormatter, Truncated, parse_levels
+from .metrics import Histogram, registry
+from .tasks import process_attachment
+from .models import Comment, OutboxEvent, User
+from .parsers import ORJSONParser
+from .replicas import PIN_COOKIE, ReadRoute, ReplicaRouter, current_route
+from .renderers import ORJSONRenderer
+from .rendering import render_comments
+from .sanitizer import get_cleaner, local_cache, tags_balanced
+from .serializers import CommentSerializer
+from .tree import MAX_REPLY_DEPTH, attach_reply_trees
 
-# Create your tests here.
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+TEST_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CACHES=TEST_CACHES, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class CommentTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        self.user = User.objects.create(username='alice', email='alice@example.com')
+
+    def post_comment(self, text='hello', parent=None, username='alice', file=None):
+        data = {'user_name': username, 'email': f'{username}@example.com', 'home_page': '', 'text': text}
+        if parent is not None:
+            data['parent'] = parent.pk
+        if file is not None:
+            data['file'] = file
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('comment-list'), data)
+
+    def make_thread(self, breadth, depth, parent=None, text='reply'):
+        """Create `breadth` replies on every level down to `depth` levels below parent."""
+        if depth == 0:
+            return
+        for _ in range(breadth):
+            reply = Comment.objects.create(user=self.user, text=text, parent=parent)
+            self.make_thread(breadth, depth - 1, parent=reply, text=text)
+
+
+class CommentListQueryTests(CommentTestCase):
+    url = reverse('comment-list')
+
+    def test_query_count_does_not_grow_with_thread_size(self):
+        root = Comment.objects.create(user=self.user, text='small')
+        self.make_thread(1, 1, parent=root)
+        # The page of roots and all of their reply trees.
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            big_root = Comment.objects.create(user=self.user, text='big')
+            self.make_thread(3, 4, parent=big_root)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_nesting_honours_max_depth_and_ordering(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        self.make_thread(1, MAX_REPLY_DEPTH + 2, parent=root)
+        bob = User.objects.create(username='bob', email='bob@example.com')
+        Comment.objects.create(user=bob, text='from bob', parent=root)
+
+        response = self.client.get(self.url, {'ordering': '-user__username', 'shallow': '0'})
+        data = response.json()['results'][0]
+
+        self.assertEqual([r['user']['username'] for r in data['replies']], ['bob', 'alice'])
+        depth, node = 0, data['replies'][1]
+        while node['replies']:
+            self.assertEqual(node['replies'][0]['parent_username'], 'alice')
+            depth, node = depth + 1, node['replies'][0]
+        self.assertEqual(depth + 1, MAX_REPLY_DEPTH)
+
+
+class CommentShallowRepliesTests(CommentTestCase):
+    def test_list_inlines_only_first_direct_replies(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        self.make_thread(5, 2, parent=root)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('comment-list'))
+        data = response.json()['results'][0]
+        self.assertEqual((data['reply_count'], data['descendant_count']), (5, 30))
+        self.assertEqual(len(data['replies']), 3)
+        self.assertEqual([r['replies'] for r in data['replies']], [[], [], []])
+        self.assertEqual(data['replies'][0]['reply_count'], 5)
+
+        response = self.client.get(reverse('comment-list'), {'first_replies': 1})
+        self.assertEqual(len(response.json()['results'][0]['replies']), 1)
+
+    def test_replies_endpoint_pages_direct_replies(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        self.make_thread(30, 1, parent=root)
+        url = reverse('comment-replies', args=[root.pk])
+
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        first = response.json()
+        self.assertEqual(len(first['results']), 25)
+        self.assertEqual(first['results'][0]['parent_username'], 'alice')
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 5)
+        self.assertIsNone(second['next'])
+        ids = [r['id'] for r in first['results'] + second['results']]
+        self.assertEqual(ids, list(root.get_descendants().order_by('created_at', 'id').values_list('id', flat=True)))
+
+        self.assertEqual(self.client.get(reverse('comment-replies', args=[0])).status_code, 404)
+
+
+class CommentAsyncViewTests(CommentTestCase):
+    def setUp(self):
+        super().setUp()
+        bob = User.objects.create(username='bob', email='bob@example.com')
+        for n in range(30):
+            root = Comment.objects.create(user=bob if n % 2 else self.user, text=f'root {n}')
+        self.make_thread(4, 2, parent=root)
+        self.root = root
+
+    def assertSameList(self, params):
+        expected = self.client.get(reverse('comment-list'), params).json()
+        actual = self.client.get(reverse('comment-list-async'), params).json()
+        self.assertEqual(actual['results'], expected['results'])
+        for link in ('next', 'previous'):
+            self.assertEqual(actual[link] is None, expected[link] is None)
+        return actual, expected
+
+    def test_list_matches_sync_view(self):
+        self.assertSameList({})
+        self.assertSameList({'shallow': '0', 'ordering': '-user__username'})
+        self.assertSameList({'user__username': 'bob', 'first_replies': 1})
+        actual, expected = self.assertSameList({'page': 2})
+        self.assertEqual(actual['count'], expected['count'])
+
+        first = self.client.get(reverse('comment-list-async'), {'ordering': 'created_at'}).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([c['text'] for c in second['results']], [f'root {n}' for n in range(25, 30)])
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+    def test_errors_match_sync_view(self):
+        for params in ({'cursor': 'bogus'}, {'created_at': 'not a date'}):
+            expected = self.client.get(reverse('comment-list'), params)
+            actual = self.client.get(reverse('comment-list-async'), params)
+            self.assertEqual((actual.status_code, actual.json()), (expected.status_code, expected.json()))
+
+    async def test_detail_uses_async_orm(self):
+        response = await self.async_client.get(reverse('comment-detail-async', args=[self.root.pk]))
+        data = response.json()
+        self.assertEqual(data['id'], self.root.pk)
+        self.assertEqual((data['reply_count'], len(data['replies'])), (4, 3))
+        self.assertEqual(data['replies'][0]['parent_username'], 'bob')
+
+        response = await self.async_client.get(reverse('comment-detail-async', args=[0]))
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'No Comment matches the given query.'}))
+
+    async def test_async_requests_are_measured(self):
+        labels = ('api/async/comments/', 'GET')
+        before = sum(registry.db_queries.series.get(labels, [0.0])[:-1])
+        await self.async_client.get(reverse('comment-list-async'))
+        series = registry.db_queries.series[labels]
+        self.assertEqual(sum(series[:-1]), before + 1)
+        self.assertGreaterEqual(series[-1], 2)
+
+
+class CommentRenderingTests(CommentTestCase):
+    def setUp(self):
+        super().setUp()
+        bob = User.objects.create(username='bob', email='bob@example.com', homepage='https://bob.example.com')
+        root = Comment.objects.create(user=bob, text='<strong>root</strong>')
+        self.make_thread(2, 3, parent=root)
+        Comment.objects.filter(pk=root.get_descendants().first().pk).update(file='uploads/notes.txt')
+
+    def make_page(self):
+        roots = Comment.objects.filter(parent__isnull=True).select_related('user').order_by('-created_at')
+        return attach_reply_trees(list(roots))
+
+    def test_fast_path_matches_serializer(self):
+        request = self.client.get(reverse('comment-list')).wsgi_request
+        page = self.make_page()
+        expected = CommentSerializer(page, many=True, context={'request': request}).data
+        self.assertEqual(json.dumps(render_comments(page, request)), json.dumps(expected))
+
+        page = self.make_page()
+        expected = CommentSerializer(page, many=True, context={'request': None}).data
+        self.assertEqual(json.dumps(render_comments(page)), json.dumps(expected))
+
+    def test_event_payload_matches_serializer(self):
+        comment = Comment.objects.create(user=self.user, text='hi', file='uploads/notes.txt')
+        comment.refresh_from_db()
+        comment._reply_tree = []
+        expected = CommentSerializer(comment, context={'request': None}).data
+        self.assertEqual(json.dumps(new_comment_event(comment)['comment']), json.dumps(expected))
+
+
+class CommentPathTests(CommentTestCase):
+    def test_path_is_maintained_on_insert(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        reply = Comment.objects.create(user=self.user, text='reply', parent=root)
+        nested = Comment.objects.create(user=self.user, text='nested', parent=reply)
+
+        nested.refresh_from_db()
+        self.assertEqual(nested.path, root.path + reply.path[-10:] + nested.path[-10:])
+        self.assertEqual((root.depth, nested.depth), (0, 2))
+        self.assertEqual(nested.root_id, root.pk)
+
+    def test_subtree_queries_stay_inside_the_thread(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        self.make_thread(2, 2, parent=root)
+        other = Comment.objects.create(user=self.user, text='other')
+        self.make_thread(1, 1, parent=other)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(root.get_descendant_count(), 6)
+        self.assertEqual(Comment.objects.subtree(root).count(), 7)
+        self.assertEqual(Comment.objects.descendants([root], max_depth=1).count(), 2)
+        self.assertEqual(root.get_last_activity(), Comment.objects.subtree(root).latest('created_at').created_at)
+
+
+class CommentCursorPaginationTests(CommentTestCase):
+    url = reverse('comment-list')
+
+    def setUp(self):
+        super().setUp()
+        bob = User.objects.create(username='bob', email='bob@example.com')
+        for i in range(30):
+            Comment.objects.create(user=bob if i % 3 else self.user, text=f'root {i}')
+        Comment.objects.filter(pk__lte=Comment.objects.order_by('pk')[9].pk).update(
+            created_at=Comment.objects.order_by('pk').first().created_at
+        )
+
+    def walk(self, params):
+        ids, url = [], self.url
+        while url:
+            data = self.client.get(url, params).json()
+            ids += [c['id'] for c in data['results']]
+            url, params = data['next'], None
+        return ids, data
+
+    def test_every_ordering_visits_each_root_once_in_order(self):
+        for ordering in ('created_at', '-created_at', 'user__username', '-user__email'):
+            with self.subTest(ordering=ordering):
+                ids, _ = self.walk({'ordering': ordering})
+                field = ordering.lstrip('-')
+                expected = Comment.objects.filter(parent__isnull=True).order_by(ordering, f"{ordering[:-len(field)]}id")
+                self.assertEqual(ids, list(expected.values_list('id', flat=True)))
+
+    def test_previous_link_returns_the_preceding_page(self):
+        first = self.client.get(self.url).json()
+        second = self.client.get(first['next']).json()
+        self.assertIsNone(first['previous'])
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertNotIn('count', second)
+
+    def test_page_param_keeps_page_number_mode(self):
+        data = self.client.get(self.url, {'page': 2}).json()
+        self.assertEqual((data['count'], len(data['results'])), (30, 5))
+
+    def test_invalid_cursor_is_404(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 404)
+
+
+class CommentListCacheTests(CommentTestCase):
+    url = reverse('comment-list')
+
+    def test_repeated_list_is_served_from_cache(self):
+        Comment.objects.create(user=self.user, text='root')
+        first = self.client.get(self.url, {'ordering': 'created_at'}).json()
+        hits = stats['hits']
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, {'ordering': 'created_at'}).json()
+        self.assertEqual(first, second)
+        self.assertEqual(stats['hits'], hits + 1)
+
+    def test_new_reply_invalidates_every_cached_page(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        self.client.get(self.url)
+        self.client.get(self.url, {'ordering': 'user__username'})
+
+        self.assertEqual(self.post_comment('reply', parent=root).status_code, 201)
+
+        for params in ({}, {'ordering': 'user__username'}):
+            replies = self.client.get(self.url, params).json()['results'][0]['replies']
+            self.assertEqual([r['text'] for r in replies], ['reply'])
+
+    def test_unchanged_list_revalidates_without_queries(self):
+        Comment.objects.create(user=self.user, text='root')
+        first = self.client.get(self.url)
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((response.status_code, response.content), (304, b''))
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        # Last-Modified is only whole seconds: a date alone never proves the list unchanged.
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        # Other parameters or another representation: another version
+        self.assertEqual(self.client.get(self.url, {'shallow': '0'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'], HTTP_ACCEPT='text/html').status_code, 200)
+
+    def test_new_reply_changes_thread_validators(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        url = reverse('comment-replies', args=[root.pk])
+        first = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        self.post_comment('reply', parent=root)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual([r['text'] for r in response.json()['results']], ['reply'])
+
+    async def test_async_views_revalidate(self):
+        root = await Comment.objects.acreate(user=self.user, text='root')
+        for url in (reverse('comment-list-async'), reverse('comment-detail-async', args=[root.pk])):
+            first = await self.async_client.get(url)
+            response = await self.async_client.get(url, headers={'If-None-Match': first['ETag']})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], first['ETag'])
+
+
+class CommentIdentityTests(CommentTestCase):
+    def user_queries(self, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_comment(**kwargs)
+        self.assertEqual(response.status_code, 201)
+        return [q['sql'] for q in queries if 'users' in q['sql']]
+
+    def test_returning_commenter_costs_no_user_queries(self):
+        self.assertEqual(len(self.user_queries(username='carol')), 1)
+        self.assertEqual(self.user_queries(username='carol'), [])
+        self.assertEqual(User.objects.filter(username='carol').count(), 1)
+        self.assertEqual(Comment.objects.filter(user__username='carol').count(), 2)
+
+    def test_profile_changes_are_written(self):
+        self.post_comment(username='carol')
+        data = {'user_name': 'carol', 'email': 'new@example.com', 'home_page': 'https://carol.example.com',
+                'text': 'moved'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('comment-list'), data)
+        self.assertEqual(response.json()['data']['user']['email'], 'new@example.com')
+        carol = User.objects.get(username='carol')
+        self.assertEqual((carol.email, carol.homepage), ('new@example.com', 'https://carol.example.com'))
+        self.assertEqual(carol.comments.count(), 2)
+
+    def test_overlong_profile_fields_are_rejected(self):
+        long_email = 'x' * 64 + '@' + '.'.join(['d' * 60] * 4) + '.com'
+        long_homepage = 'https://example.com/' + 'p' * 300
+        for field, value in (('email', long_email), ('home_page', long_homepage)):
+            data = {'user_name': 'carol', 'email': 'carol@example.com', 'home_page': '', 'text': 'hi', field: value}
+            serializer = CommentSerializer(data=data)
+            self.assertFalse(serializer.is_valid())
+            self.assertIn(field, serializer.errors)
+            self.assertEqual(self.client.post(reverse('comment-list'), data).status_code, 400)
+        self.assertFalse(User.objects.filter(username='carol').exists())
+
+    def test_unchanged_profile_is_not_rewritten_after_cache_loss(self):
+        self.post_comment(username='alice')
+        cache.clear()
+        queries = self.user_queries(username='alice')
+        # The conditional upsert writes nothing, then the id is read back.
+        self.assertEqual(len(queries), 2)
+        self.assertIn('ON CONFLICT', queries[0])
+        self.assertEqual(self.user_queries(username='alice'), [])
+        self.assertEqual(User.objects.filter(username='alice').count(), 1)
+
+    def test_backends_without_the_upsert_use_the_orm(self):
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            self.post_comment(username='alice')
+            cache.clear()
+            queries = self.user_queries(username='alice')
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn('ON CONFLICT', queries[0])
+            data = {'user_name': 'alice', 'email': 'new@example.com', 'home_page': '', 'text': 'moved'}
+            self.assertEqual(self.client.post(reverse('comment-list'), data).status_code, 201)
+        self.assertEqual(User.objects.get(username='alice').email, 'new@example.com')
+        self.assertEqual(Comment.objects.filter(user__username='alice').count(), 3)
+
+    def test_edits_outside_the_form_drop_the_cached_identity(self):
+        self.post_comment(username='alice')
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(username='alice').delete()
+        self.assertEqual(self.post_comment(username='alice').status_code, 201)
+        self.assertEqual(Comment.objects.filter(user__username='alice').count(), 1)
+
+    def test_username_rules_still_apply(self):
+        response = self.post_comment(username='not_valid')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'username': ['Only letters and digits allowed']})
+
+
+class CommentBroadcastTests(CommentTestCase):
+    def test_create_broadcasts_exactly_once_after_commit(self):
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            group_send = get_layer.return_value.group_send = mock.AsyncMock()
+            response = self.post_comment('hello')
+
+        self.assertEqual(response.status_code, 201)
+        group_send.assert_called_once()
+        group, event = group_send.call_args.args
+        message = json.loads(event['text'])
+        self.assertEqual(group, 'comments_group')
+        self.assertEqual(message['type'], 'new_comment')
+        self.assertEqual(message['comment']['id'], response.json()['data']['id'])
+        self.assertEqual(message['comment']['replies'], [])
+
+    def test_reply_is_routed_to_its_thread_group(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            group_send = get_layer.return_value.group_send = mock.AsyncMock()
+            self.post_comment('reply', parent=root)
+        self.assertEqual(group_send.call_args.args[0], thread_group(root.pk))
+
+    def test_nothing_is_sent_before_commit(self):
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            Comment.objects.create(user=self.user, text='uncommitted')
+        get_layer.assert_not_called()
+        self.assertEqual(OutboxEvent.objects.filter(delivered_at__isnull=True).count(), 1)
+
+
+class CommentOutboxTests(CommentTestCase):
+    def test_event_is_written_with_the_comment(self):
+        with mock.patch('comments.tasks.relay_outbox.delay') as delay:
+            response = self.post_comment('hello')
+        delay.assert_called_once_with()
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.group, event.payload['type']), (FEED_GROUP, 'new_comment'))
+        self.assertEqual(event.payload['comment']['id'], response.json()['data']['id'])
+
+        # The first relay has not run yet: the next commit does not queue another.
+        with mock.patch('comments.tasks.relay_outbox.delay') as delay:
+            self.post_comment('burst')
+        delay.assert_not_called()
+
+    def test_rolled_back_comment_leaves_no_event(self):
+        with mock.patch('comments.tasks.relay_outbox.delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                Comment.objects.create(user=self.user, text='rolled back')
+                raise ValueError
+        delay.assert_not_called()
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_broker_failure_keeps_the_event_for_the_periodic_relay(self):
+        with mock.patch('comments.tasks.relay_outbox.delay', side_effect=ConnectionError('broker down')):
+            self.assertEqual(self.post_comment('hello').status_code, 201)
+        self.assertEqual(OutboxEvent.objects.filter(delivered_at__isnull=True).count(), 1)
+
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            group_send = get_layer.return_value.group_send = mock.AsyncMock()
+            self.assertEqual(outbox.drain(), 1)
+        group_send.assert_called_once()
+        self.assertFalse(OutboxEvent.objects.filter(delivered_at__isnull=True).exists())
+
+    def test_burst_is_relayed_in_batches_of_coalesced_frames(self):
+        with mock.patch('comments.tasks.relay_outbox.delay'), self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                outbox.publish(FEED_GROUP, {'type': 'new_comment', 'comment': {'id': i}})
+            outbox.publish(thread_group(1), {'type': 'comment_updated', 'comment': {'id': 9}})
+
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            group_send = get_layer.return_value.group_send = mock.AsyncMock()
+            # Two batches: savepoint, lock the counter, SELECT, UPDATE events, UPDATE counter, release
+            with self.assertNumQueries(12):
+                self.assertEqual(outbox.relay(batch_size=4), 6)
+
+        seq = list(OutboxEvent.objects.order_by('id').values_list('seq', flat=True))
+        frames = [(call.args[0], json.loads(call.args[1]['text'])) for call in group_send.call_args_list]
+        self.assertEqual(frames, [
+            (FEED_GROUP, {'type': 'new_comments', 'comments': [{'id': 0}, {'id': 1}, {'id': 2}, {'id': 3}],
+                          'seq': seq[3]}),
+            (FEED_GROUP, {'type': 'new_comment', 'comment': {'id': 4}, 'seq': seq[4]}),
+            (thread_group(1), {'type': 'comment_updated', 'comment': {'id': 9}, 'seq': seq[5]}),
+        ])
+        self.assertFalse(OutboxEvent.objects.filter(delivered_at__isnull=True).exists())
+
+    def test_only_consecutive_new_comments_are_merged(self):
+        messages = [
+            {'type': 'new_comment', 'comment': {'id': 1}, 'seq': 1},
+            {'type': 'new_comment', 'comment': {'id': 2}, 'seq': 2},
+            {'type': 'comment_updated', 'comment': {'id': 1}, 'seq': 3},
+            {'type': 'new_comment', 'comment': {'id': 3}, 'seq': 4},
+        ]
+        self.assertEqual(batch_messages(messages), [
+            {'type': 'new_comments', 'comments': [{'id': 1}, {'id': 2}], 'seq': 2},
+            messages[2], messages[3],
+        ])
+
+    def test_failed_send_is_retried(self):
+        outbox.publish(FEED_GROUP, {'type': 'new_comment', 'comment': {'id': 1}})
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            get_layer.return_value.group_send = mock.AsyncMock(side_effect=ConnectionError)
+            with self.assertRaises(ConnectionError):
+                outbox.relay()
+            self.assertEqual(OutboxEvent.objects.filter(delivered_at__isnull=True).count(), 1)
+            get_layer.return_value.group_send = mock.AsyncMock()
+            self.assertEqual(outbox.relay(), 1)
+
+    def test_oversized_batch_is_split(self):
+        comments = [{'id': i, 'text': 'x' * 100} for i in range(8)]
+        with mock.patch('comments.fanout.MAX_FRAME_SIZE', 400), mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            group_send = get_layer.return_value.group_send = mock.AsyncMock()
+            send_messages(FEED_GROUP, [{'type': 'new_comment', 'comment': c} for c in comments])
+        frames = [json.loads(call.args[1]['text']) for call in group_send.call_args_list]
+        self.assertEqual([len(frame['comments']) for frame in frames], [2, 2, 2, 2])
+        self.assertEqual([c for frame in frames for c in frame['comments']], comments)
+
+    def publish_and_relay(self, *messages):
+        for group, message in messages:
+            outbox.publish(group, message)
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            get_layer.return_value.group_send = mock.AsyncMock()
+            outbox.relay()
+        return list(OutboxEvent.objects.order_by('seq').values_list('seq', flat=True))
+
+    async def resume(self, seq, threads=()):
+        # Channels closes old connections after every handler; that would close the test transaction's.
+        with mock.patch('channels.db.close_old_connections'):
+            return await self.exchange(seq, threads)
+
+    async def exchange(self, seq, threads):
+        communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        await communicator.connect()
+        if threads:
+            await communicator.send_json_to({'type': 'subscribe', 'threads': list(threads)})
+            await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'resume', 'seq': seq})
+        received = []
+        while not received or received[-1]['type'] not in ('resumed', 'reload_required', 'error'):
+            received.append(await communicator.receive_json_from())
+        await communicator.disconnect()
+        return received
+
+    async def test_resume_replays_missed_events_of_subscribed_groups(self):
+        seq = await sync_to_async(self.publish_and_relay)(
+            (FEED_GROUP, {'type': 'new_comment', 'comment': {'id': 1}}),
+            (thread_group(7), {'type': 'new_comment', 'comment': {'id': 2}}),
+            (FEED_GROUP, {'type': 'new_comment', 'comment': {'id': 3}}),
+            (thread_group(8), {'type': 'new_comment', 'comment': {'id': 4}}),
+        )
+        self.assertEqual(await self.resume(seq[0]), [
+            {'type': 'new_comment', 'comment': {'id': 3}, 'seq': seq[2]},
+            {'type': 'resumed', 'seq': seq[2], 'replayed': 1},
+        ])
+        self.assertEqual(await self.resume(seq[0], threads=[7]), [
+            {'type': 'new_comments', 'comments': [{'id': 2}, {'id': 3}], 'seq': seq[2]},
+            {'type': 'resumed', 'seq': seq[2], 'replayed': 2},
+        ])
+        self.assertEqual(await self.resume(None), [{'type': 'resumed', 'seq': seq[3]}])
+        self.assertEqual((await self.resume(-1))[0]['type'], 'error')
+
+    async def test_gap_beyond_the_buffer_requires_reload(self):
+        seq = await sync_to_async(self.publish_and_relay)(
+            *[(FEED_GROUP, {'type': 'new_comment', 'comment': {'id': i}}) for i in range(3)]
+        )
+        with self.settings(COMMENTS_REPLAY_LIMIT=2):
+            self.assertEqual((await self.resume(seq[0]))[-1], {'type': 'resumed', 'seq': seq[2], 'replayed': 2})
+            self.assertEqual(await self.resume(seq[0] - 1), [{'type': 'reload_required', 'seq': seq[2]}])
+
+        await OutboxEvent.objects.filter(seq=seq[0]).aupdate(delivered_at=timezone.now() - timedelta(days=2))
+        await sync_to_async(outbox.purge_delivered)()
+        self.assertEqual(await self.resume(seq[0] - 1), [{'type': 'reload_required', 'seq': seq[2]}])
+        self.assertEqual((await self.resume(seq[0]))[-1], {'type': 'resumed', 'seq': seq[2], 'replayed': 2})
+        # Sent by a relay whose numbering has not committed yet: nothing to replay.
+        self.assertEqual(await self.resume(seq[2] + 1), [{'type': 'resumed', 'seq': seq[2] + 1, 'replayed': 0}])
+        # A seq this outbox never handed out (e.g. from before a reset).
+        with self.settings(COMMENTS_OUTBOX_BATCH_SIZE=10):
+            self.assertEqual(await self.resume(seq[2] + 11), [{'type': 'reload_required', 'seq': seq[2]}])
+
+    async def test_event_committed_after_a_later_one_is_replayed(self):
+        # Transaction A inserts first but commits after B, whose event was already relayed.
+        (seen,) = await sync_to_async(self.publish_and_relay)((FEED_GROUP, {'type': 'new_comment', 'comment': {'id': 'B'}}))
+        later = await OutboxEvent.objects.aget(seq=seen)
+        await OutboxEvent.objects.acreate(id=later.pk - 1, group=FEED_GROUP, payload={'type': 'new_comment', 'comment': {'id': 'A'}})
+        await sync_to_async(self.publish_and_relay)()
+
+        self.assertEqual(await self.resume(seen), [
+            {'type': 'new_comment', 'comment': {'id': 'A'}, 'seq': seen + 1},
+            {'type': 'resumed', 'seq': seen + 1, 'replayed': 1},
+        ])
+
+    def test_sequence_numbers_have_no_gaps_where_ids_do(self):
+        for i in range(5):
+            outbox.publish(FEED_GROUP, {'type': 'new_comment', 'comment': {'id': i}})
+        # Ids taken by rolled-back transactions leave holes.
+        OutboxEvent.objects.filter(payload__comment__id__in=[1, 3]).delete()
+        seq = self.publish_and_relay()
+        self.assertEqual(seq, list(range(seq[0], seq[0] + 3)))
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('seq').values_list('payload__comment__id', flat=True)), [0, 2, 4]
+        )
+
+    def test_delivered_events_are_purged(self):
+        self.publish_and_relay(*[(FEED_GROUP, {'type': 'new_comment', 'comment': {'id': i}}) for i in (1, 2)])
+        OutboxEvent.objects.filter(payload__comment__id=1).update(delivered_at=timezone.now() - timedelta(days=2))
+        outbox.publish(FEED_GROUP, {'type': 'new_comment', 'comment': {'id': 3}})
+        self.assertEqual(outbox.purge_delivered(), 1)
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+        last, purged = outbox.sequence_bounds()
+        self.assertEqual(purged, last - 1)
+
+
+@override_settings(CACHES=TEST_CACHES, CHANNEL_LAYERS=TEST_CHANNEL_LAYERS)
+class CommentConsumerTests(SimpleTestCase):
+    async def test_frame_is_forwarded_without_re_encoding(self):
+        communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        frame = encode_frame({'type': 'new_comments', 'comments': [{'id': 1}, {'id': 2}]})
+        with mock.patch('comments.consumers.encode_frame') as encode, mock.patch('comments.consumers.dumps_text') as dumps:
+            await get_channel_layer().group_send('comments_group', frame)
+            self.assertEqual(await communicator.receive_from(), frame['text'])
+        encode.assert_not_called()
+        dumps.assert_not_called()
+        await communicator.disconnect()
+
+    async def test_replies_reach_only_subscribers_of_their_thread(self):
+        layer = get_channel_layer()
+        reader = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        bystander = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        await reader.connect()
+        await bystander.connect()
+
+        await reader.send_json_to({'type': 'subscribe', 'threads': [7, 8]})
+        self.assertEqual(await reader.receive_json_from(), {'type': 'subscribed', 'feed': True, 'threads': [7, 8]})
+        await reader.send_json_to({'type': 'subscribe', 'threads': [7], 'replace': True, 'feed': False})
+        self.assertEqual(await reader.receive_json_from(), {'type': 'subscribed', 'feed': False, 'threads': [7]})
+
+        await layer.group_send(thread_group(8), encode_frame({'type': 'new_comment', 'comment': {'id': 80}}))
+        await layer.group_send(FEED_GROUP, encode_frame({'type': 'new_comment', 'comment': {'id': 1}}))
+        await layer.group_send(thread_group(7), encode_frame({'type': 'new_comment', 'comment': {'id': 70}}))
+
+        self.assertEqual((await reader.receive_json_from())['comment']['id'], 70)
+        self.assertTrue(await reader.receive_nothing())
+        self.assertEqual((await bystander.receive_json_from())['comment']['id'], 1)
+        self.assertTrue(await bystander.receive_nothing())
+        await reader.disconnect()
+        await bystander.disconnect()
+
+    async def test_frames_are_counted(self):
+        sent = registry.ws_messages.series.get(('CommentConsumer', 'out'), 0)
+        communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        await communicator.connect()
+        with mock.patch('comments.consumers.loads') as loads:
+            await communicator.send_json_to({'type': 'ping'})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'pong'})
+        loads.assert_not_called()
+        await communicator.disconnect()
+        self.assertEqual(registry.ws_messages.series[('CommentConsumer', 'out')], sent + 1)
+        self.assertGreaterEqual(registry.ws_bytes.series[('CommentConsumer', 'in')], len('{"type": "ping"}'))
+
+    def events(self, event):
+        return registry.ws_events.series.get(('CommentConsumer', event), 0)
+
+    async def test_connections_over_the_caps_are_refused(self):
+        first = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        self.assertEqual((await first.connect())[0], True)
+        refused = self.events('refused_process')
+        with self.settings(COMMENTS_WS_MAX_CONNECTIONS=1):
+            second = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+            self.assertEqual(await second.connect(), (False, 1013))
+        self.assertEqual(self.events('refused_process'), refused + 1)
+
+        # Another process reports two open sockets: the total cap of 3 is reached.
+        await cache.aset('comments:ws:processes', {'comments:ws:load:other:1': time.time()})
+        await cache.aset('comments:ws:load:other:1', 2)
+        with self.settings(COMMENTS_WS_MAX_TOTAL_CONNECTIONS=3):
+            await sockets.sweep()
+            self.assertEqual(sockets.others, 2)
+            self.assertEqual(await cache.aget(sockets.process_key), 1)
+            third = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+            self.assertEqual(await third.connect(), (False, 1013))
+        sockets.others = 0
+        await first.disconnect()
+
+    async def test_idle_sockets_are_reaped(self):
+        communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        await communicator.connect()
+        self.assertEqual(await sockets.reap(time.monotonic() + 60), 0)
+        await communicator.send_json_to({'type': 'ping'})
+        await communicator.receive_json_from()
+        self.assertEqual(await sockets.reap(time.monotonic() + 91), 1)
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4408})
+        await communicator.disconnect()
+
+    @override_settings(COMMENTS_WS_SEND_QUEUE=3)
+    async def test_slow_reader_is_asked_to_resync(self):
+        communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), '/ws/comments/')
+        await communicator.connect()
+        dropped = self.events('dropped')
+        unblocked = asyncio.Event()
+        send_frame = CommentConsumer.send_frame
+
+        async def slow_send_frame(consumer, text, size):
+            await unblocked.wait()
+            await send_frame(consumer, text, size)
+
+        with mock.patch.object(CommentConsumer, 'send_frame', slow_send_frame):
+            for i in range(6):
+                await get_channel_layer().group_send(FEED_GROUP, encode_frame({'type': 'new_comment', 'comment': {'id': i}}))
+            # Frame 0 is being written, 1-3 fill the queue, 4 overflows it, 5 follows the resync.
+            self.assertTrue(await communicator.receive_nothing())
+            unblocked.set()
+            received = [await communicator.receive_json_from() for _ in range(3)]
+        self.assertEqual(received, [
+            {'type': 'new_comment', 'comment': {'id': 0}},
+            {'type': 'resync_required'},
+            {'type': 'new_comment', 'comment': {'id': 5}},
+        ])
+        self.assertEqual(self.events('dropped'), dropped + 4)
+        await communicator.disconnect()
+
+
+class CommentJSONTests(SimpleTestCase):
+    def test_renderer_matches_drf_json_renderer(self):
+        data = {
+            'created_at': datetime(2025, 9, 12, 17, 8, 24, 123456, tzinfo=dt_timezone.utc),
+            'naive': datetime(2025, 9, 12, 17, 8, 24),
+            'day': date(2025, 9, 12),
+            'price': Decimal('1.50'),
+            'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+            'label': gettext_lazy('Comment'),
+            'text': 'Привіт <i>світ</i> \u2028',
+            1: [None, True, 0.25],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            ORJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+
+    def test_parser_reports_invalid_json(self):
+        self.assertEqual(ORJSONParser().parse(BytesIO('{"text": "ок"}'.encode())), {'text': 'ок'})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{"text": NaN}'))
+
+
+class CommentLoggingTests(SimpleTestCase):
+    def make_handler(self, **kwargs):
+        stream = StringIO()
+        handler = BackgroundHandler(stream, **kwargs)
+        handler.setFormatter(JSONFormatter())
+        self.addCleanup(handler.close)
+        logger = logging.getLogger('comments.tests.logging')
+        logger.propagate = False
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+        self.addCleanup(setattr, logger, 'handlers', [])
+        return logger, handler, stream
+
+    def test_records_are_written_as_json_in_the_background(self):
+        logger, handler, stream = self.make_handler()
+        payload = ['before']
+        logger.info('Payload: %s', payload, extra={'comment_id': 7, 'data': {'args': 'x' * 300}})
+        payload.append('after')
+        logger.debug('Filtered out: %s', Truncated(payload))
+        handler.flush()
+
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'comments.tests.logging')
+        self.assertEqual(entry['message'], "Payload: ['before']")
+        self.assertEqual(entry['comment_id'], 7)
+        self.assertEqual(entry['data'], {'args': 'x' * 200 + '... (300 chars)'})
+
+    def test_full_queue_drops_records(self):
+        logger, handler, stream = self.make_handler(max_queue=1)
+        handler.listener.stop()
+        logger.info('kept')
+        logger.info('dropped')
+        self.assertEqual(handler.dropped, 1)
+
+    @skipUnless(hasattr(os, 'fork'), 'needs fork()')
+    def test_forked_child_writes_through_its_own_listener(self):
+        with tempfile.TemporaryFile('w+') as stream:
+            handler = BackgroundHandler(stream)
+            handler.setFormatter(JSONFormatter())
+            self.addCleanup(handler.close)
+            logger = logging.getLogger('comments.tests.logging')
+            logger.propagate = False
+            logger.handlers = [handler]
+            logger.setLevel(logging.INFO)
+            self.addCleanup(setattr, logger, 'handlers', [])
+
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    logger.info('from child')
+                    handler.close()
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            logger.info('from parent')
+            handler.flush()
+            stream.seek(0)
+            messages = [json.loads(line)['message'] for line in stream]
+        self.assertEqual(sorted(messages), ['from child', 'from parent'])
+
+    def test_payloads_are_truncated(self):
+        self.assertEqual(str(Truncated('short')), 'short')
+        self.assertEqual(str(Truncated('x' * 300, limit=10)), 'xxxxxxxxxx... (300 chars)')
+
+    def test_levels_from_environment(self):
+        self.assertEqual(
+            parse_levels('comments=debug, django.db.backends=WARNING,,broken'),
+            {'comments': 'DEBUG', 'django.db.backends': 'WARNING'},
+        )
+
+
+class CommentAttachmentTests(CommentTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, name, size=(1280, 960), image_format='JPEG'):
+        output = BytesIO()
+        Image.new('RGB', size, 'navy').save(output, format=image_format)
+        return SimpleUploadedFile(name, output.getvalue())
+
+    def test_image_is_thumbnailed_after_commit(self):
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            group_send = get_layer.return_value.group_send = mock.AsyncMock()
+            with mock.patch('comments.tasks.process_attachment.delay') as delay:
+                response = self.post_comment('photo', file=self.upload('photo.jpg'))
+            self.assertEqual(response.status_code, 201)
+            comment = Comment.objects.get(pk=response.json()['data']['id'])
+            self.assertEqual(Image.open(comment.file.path).size, (1280, 960))
+            delay.assert_called_once_with(comment.pk)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                process_attachment(comment.pk)
+
+        comment.refresh_from_db()
+        with Image.open(comment.file.path) as img:
+            self.assertEqual(img.size, (320, 240))
+        self.assertEqual(img.format, 'JPEG')
+        update = json.loads(group_send.call_args.args[1]['text'])
+        self.assertEqual(update['type'], 'comment_updated')
+        self.assertTrue(update['comment']['file'].endswith(os.path.basename(comment.file.name)))
+
+    def test_broker_failure_keeps_the_comment(self):
+        with mock.patch('comments.tasks.process_attachment.delay', side_effect=ConnectionError('broker down')):
+            with self.assertLogs('comments.signals', 'WARNING'):
+                response = self.post_comment('photo', file=self.upload('photo.jpg'))
+        self.assertEqual(response.status_code, 201)
+        comment = Comment.objects.get(pk=response.json()['data']['id'])
+        self.assertEqual(Image.open(comment.file.path).size, (1280, 960))
+
+    def test_image_with_wrong_content_is_dropped(self):
+        fake = SimpleUploadedFile('fake.png', b'not an image at all')
+        with mock.patch('comments.fanout.get_channel_layer') as get_layer:
+            get_layer.return_value.group_send = mock.AsyncMock()
+            response = self.post_comment('fake', file=fake)
+        comment = Comment.objects.get(pk=response.json()['data']['id'])
+        self.assertFalse(comment.file)
+
+    def test_thumbnail_and_its_event_commit_together(self):
+        with mock.patch('comments.tasks.process_attachment.delay'):
+            response = self.post_comment('photo', file=self.upload('photo.jpg'))
+        comment = Comment.objects.get(pk=response.json()['data']['id'])
+        with mock.patch('comments.outbox.publish', side_effect=RuntimeError('db gone')):
+            with self.assertRaises(RuntimeError):
+                process_attachment(comment.pk)
+        # The original stays referenced (and on disk) when the event could not be stored.
+        self.assertEqual(Comment.objects.get(pk=comment.pk).file.name, comment.file.name)
+        self.assertTrue(os.path.exists(comment.file.path))
+
+
+class CommentSanitizerTests(CommentTestCase):
+    def setUp(self):
+        super().setUp()
+        local_cache.clear()
+
+    def test_preview_then_submit_cleans_once(self):
+        text = 'Hi <strong>there</strong> <script>alert(1)</script>\nsecond line'
+        with mock.patch('comments.sanitizer.get_cleaner', wraps=get_cleaner) as cleaner:
+            preview = self.client.post(reverse('preview'), {'text': text}).json()['preview']
+            local_cache.clear()  # the submit may land on another worker
+            response = self.post_comment(text)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['data']['text'], preview)
+        self.assertNotIn('<script>', preview)
+        self.assertEqual(cleaner.call_count, 1)
+
+    def test_preview_rejects_text_longer_than_a_comment(self):
+        with mock.patch('comments.sanitizer.cache') as shared:
+            response = self.client.post(reverse('preview'), {'text': 'x' * 5001})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('text', response.json())
+        shared.set.assert_not_called()
+        self.assertEqual(self.client.post(reverse('preview'), {'text': 'x' * 5000}).status_code, 200)
+
+    def test_tag_balance(self):
+        self.assertTrue(tags_balanced('<i><strong>a</strong></i> <a href="x" title="y">b</a>'))
+        self.assertTrue(tags_balanced('1 &lt; 2 <br> <code>x</code>'))
+        self.assertFalse(tags_balanced('<i><strong>a</i></strong>'))
+        self.assertFalse(tags_balanced('<code>open'))
+        self.assertFalse(tags_balanced('</i>'))
+
+
+class CommentBulkTests(CommentTestCase):
+    def setUp(self):
+        super().setUp()
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        self.workdir = workdir
+
+    def snapshot(self):
+        return list(Comment.objects.order_by('path').values_list(
+            'id', 'parent_id', 'user__username', 'text', 'created_at', 'path',
+            'reply_count', 'descendant_count', 'last_activity_at',
+        ))
+
+    def test_export_import_round_trip(self):
+        for fmt in ('jsonl', 'csv'):
+            with self.subTest(fmt=fmt):
+                root = Comment.objects.create(user=self.user, text='<i>root</i>')
+                self.make_thread(2, 3, parent=root)
+                bob, _ = User.objects.get_or_create(username='bob', defaults={'email': 'bob@example.com'})
+                Comment.objects.create(user=bob, text='solo')
+                expected = self.snapshot()
+                path = os.path.join(self.workdir, f'comments.{fmt}')
+                call_command('export_comments', path, '--batch-size', '4', stderr=StringIO())
+
+                Comment.objects.all().delete()
+                User.objects.filter(username='bob').delete()
+                out = StringIO()
+                call_command('import_comments', path, '--batch-size', '4', stdout=out)
+
+                self.assertEqual(self.snapshot(), expected)
+                self.assertIn('Imported 16 comments (1 new users)', out.getvalue())
+                Comment.objects.all().delete()
+
+    def test_synthetic_fixtures_import(self):
+        path = os.path.join(self.workdir, 'fixtures.jsonl')
+        call_command('export_comments', path, '--synthetic', '3', '--breadth', '2', '--depth', '2',
+                     '--users', '4', stderr=StringIO())
+        call_command('import_comments', path, stdout=StringIO())
+
+        self.assertEqual(Comment.objects.count(), 21)
+        self.assertEqual(User.objects.filter(username__startswith='loadtest').count(), 4)
+        root = Comment.objects.get(pk=1)
+        self.assertEqual((root.reply_count, root.descendant_count), (2, 6))
+        reply = Comment.objects.create(user=self.user, text='after import', parent=root)
+        self.assertGreater(reply.pk, 21)
+
+    def test_export_to_stdout_is_one_record_per_line(self):
+        out = StringIO()
+        call_command('export_comments', '-', '--synthetic', '1', '--depth', '1', stdout=out, stderr=StringIO())
+        lines = out.getvalue().split('\n')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual([json.loads(line)['id'] for line in lines[:-1]], [1, 2, 3, 4])
+
+    def test_copy_import_on_postgresql(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('COPY is PostgreSQL-only')
+        path = os.path.join(self.workdir, 'fixtures.csv')
+        call_command('export_comments', path, '--synthetic', '2', '--depth', '1', stderr=StringIO())
+        call_command('import_comments', path, '--copy', stdout=StringIO())
+
+        self.assertEqual(Comment.objects.filter(parent__isnull=True).count(), 2)
+        self.assertEqual(Comment.objects.get(pk=1).reply_count, 3)
+        self.assertEqual(Comment.objects.get(pk=2).file.name, '')
+        self.assertTrue(Comment.objects.filter(search_vector__isnull=False).exists())
+
+    def test_existing_ids_are_reported(self):
+        path = os.path.join(self.workdir, 'fixtures.jsonl')
+        call_command('export_comments', path, '--synthetic', '1', '--depth', '1', stderr=StringIO())
+        Comment.objects.create(id=3, user=self.user, text='already here')
+        variants = [[], ['--copy']] if connection.vendor == 'postgresql' else [[]]
+        for extra in variants:
+            with self.subTest(extra=extra):
+                with self.assertRaisesMessage(
+                    CommandError, 'Rows already in the database: 3 (id 3) (0 comments imported before the error)'
+                ):
+                    call_command('import_comments', path, *extra, stdout=StringIO())
+                self.assertEqual(Comment.objects.count(), 1)
+
+    def test_child_before_parent_is_rejected(self):
+        path = os.path.join(self.workdir, 'bad.jsonl')
+        with open(path, 'w') as stream:
+            stream.write(json.dumps({'id': 2, 'parent': 1, 'username': 'alice', 'email': 'a@example.com',
+                                     'text': 'orphan', 'created_at': '2025-01-01T00:00:00Z'}) + '\n')
+        with self.assertRaisesMessage(CommandError, 'parent 1 must come before its replies'):
+            call_command('import_comments', path, stdout=StringIO())
+
+
+class CommentBenchmarkTests(CommentTestCase):
+    def test_list_and_create_measurements(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        self.make_thread(2, 2, parent=root)
+
+        results = measure_list(self.client, '-created_at', 1, repeat=2)
+        self.assertEqual([(r['mode'], r['queries']) for r in results], [('cursor', 2), ('page', 3)])
+        self.assertEqual(measure_list(self.client, '-created_at', 2, repeat=2), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = measure_create(self.client, count=3)
+        self.assertEqual((created['requests'], created['attachment']), (3, False))
+        self.assertEqual(Comment.objects.filter(parent__isnull=True).count(), 5)
+
+    async def test_concurrency_measurement(self):
+        # As in django.test.Client: requests must not close the test connection.
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        result = await measure_concurrency(get_asgi_application(), reverse('health-check'), clients=5, duration=0.2)
+        self.assertEqual((result['clients'], result['errors']), (5, 0))
+        self.assertGreaterEqual(result['requests'], 5)
+
+    def test_outbox_measurement(self):
+        Comment.objects.create(user=self.user, text='root')
+        result = measure_outbox(burst=10, batch_size=4)
+        self.assertEqual((result['sent'], result['frames']), (10, 3))
+        self.assertFalse(OutboxEvent.objects.filter(delivered_at__isnull=True).exists())
+
+
+class CommentMetricsTests(CommentTestCase):
+    def test_requests_are_exposed_on_metrics_endpoint(self):
+        Comment.objects.create(user=self.user, text='root')
+        self.client.get(reverse('comment-list'))
+        self.client.get(reverse('comment-list'))
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        labels = 'endpoint="api/comments/",method="GET"'
+        self.assertIn(f'comments_http_requests_total{{{labels},status="200"}}', body)
+        self.assertIn(f'comments_http_db_queries_bucket{{{labels},le="2"}}', body)
+        self.assertIn(f'comments_http_response_bytes_count{{{labels}}}', body)
+        self.assertRegex(body, r'comments_cache_events_total\{event="hits"\} [1-9]')
+
+    @override_settings(COMMENTS_SLOW_REQUEST_MS=0.001, COMMENTS_SLOW_REQUEST_SAMPLE_RATE=1.0)
+    def test_slow_requests_dump_their_queries(self):
+        with self.assertLogs('comments.metrics', 'WARNING') as logs:
+            self.client.get(reverse('comment-list'))
+        self.assertIn('Slow request GET /api/comments/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('t', 'test', ('endpoint',), (1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(('x',), value)
+        lines = list(histogram.render())
+        self.assertIn('t_bucket{endpoint="x",le="1"} 2', lines)
+        self.assertIn('t_bucket{endpoint="x",le="5"} 3', lines)
+        self.assertIn('t_bucket{endpoint="x",le="+Inf"} 4', lines)
+        self.assertIn('t_count{endpoint="x"} 4', lines)
+
+
+@override_settings(COMMENTS_DB_REPLICAS=['default'], COMMENTS_DB_PIN_SECONDS=10)
+class CommentReplicaRoutingTests(CommentTestCase):
+    def setUp(self):
+        super().setUp()
+        Comment.objects.create(user=self.user, text='root')
+        # The last write is long past: replicas have caught up.
+        cache.set(MODIFIED_KEY, time.time() - 60, timeout=None)
+
+    def routed(self, endpoint, route):
+        return registry.db_routes.series.get((endpoint, route), 0)
+
+    def assert_routed(self, method, url, route, endpoint=None, **params):
+        endpoint = endpoint or url.lstrip('/')
+        before = self.routed(endpoint, route)
+        response = method(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.routed(endpoint, route), before + 1)
+        return response
+
+    def test_reads_go_to_replicas_unless_the_client_just_wrote(self):
+        url = reverse('comment-list')
+        self.assert_routed(self.client.get, url, 'replica', ordering='created_at')
+        self.assert_routed(self.client.get, reverse('comment-search'), 'replica', q='root')
+
+        response = self.post_comment('mine')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+        # The writer's next reads stay on the primary and see its comment.
+        response = self.assert_routed(self.client.get, url, 'pinned')
+        self.assertEqual(response.json()['results'][0]['text'], 'mine')
+        self.assert_routed(self.client.get, reverse('comment-search'), 'pinned', q='mine')
+
+        # Other clients still fill the just-invalidated list cache from the primary.
+        self.client.cookies.pop(PIN_COOKIE)
+        self.assert_routed(self.client.get, url, 'recent_write', ordering='user__username')
+
+    async def test_async_views_are_routed(self):
+        root = await Comment.objects.afirst()
+        for url, endpoint in (
+            (reverse('comment-list-async'), 'api/async/comments/'),
+            (reverse('comment-detail-async', args=[root.pk]), 'api/async/comments/<int:pk>/'),
+        ):
+            before = self.routed(endpoint, 'replica')
+            self.assertEqual((await self.async_client.get(url)).status_code, 200)
+            self.assertEqual(self.routed(endpoint, 'replica'), before + 1)
+
+    def test_router_follows_the_request_route(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Comment))
+        route = ReadRoute()
+        token = current_route.set(route)
+        try:
+            self.assertIsNone(router.db_for_read(Comment))
+            route.alias = 'replica1'
+            self.assertEqual(router.db_for_read(Comment), 'replica1')
+            self.assertEqual(router.db_for_write(Comment), 'default')
+        finally:
+            current_route.reset(token)
+
+    @override_settings(COMMENTS_DB_REPLICAS=[])
+    def test_nothing_is_routed_without_replicas(self):
+        before = dict(registry.db_routes.series)
+        self.assertNotIn(PIN_COOKIE, self.post_comment('mine').cookies)
+        self.client.get(reverse('comment-list'))
+        self.assertEqual(registry.db_routes.series, before)
+
+
+class CommentSearchTests(CommentTestCase):
+    url = reverse('comment-search')
+
+    def test_search_matches_words_across_threads(self):
+        root = Comment.objects.create(user=self.user, text='Deploying <strong>Daphne</strong> today')
+        Comment.objects.create(user=self.user, text='daphne workers are busy', parent=root)
+        Comment.objects.create(user=self.user, text='unrelated')
+
+        data = self.client.get(self.url, {'q': 'daphne'}).json()
+
+        self.assertEqual(len(data['results']), 2)
+        reply = next(r for r in data['results'] if r['parent'])
+        self.assertEqual(reply['parent_username'], 'alice')
+        self.assertNotIn('replies', reply)
+
+    def test_results_are_paginated_with_a_cursor(self):
+        for i in range(30):
+            Comment.objects.create(user=self.user, text=f'needle {i}')
+        first = self.client.get(self.url, {'q': 'needle'}).json()
+        second = self.client.get(first['next']).json()
+        ids = [r['id'] for r in first['results'] + second['results']]
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(len(set(ids)), 30)
+        self.assertIsNone(second['next'])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_tampered_cursor_is_404(self):
+        Comment.objects.create(user=self.user, text='needle')
+        for position in (['abc', 1, False], [True, 1, False], [0.5, '1', False], [1], 'x'):
+            cursor = urlsafe_b64encode(json.dumps(position).encode()).decode()
+            with self.subTest(position=position):
+                self.assertEqual(self.client.get(self.url, {'q': 'needle', 'cursor': cursor}).status_code, 404)
+        valid = urlsafe_b64encode(json.dumps([0.5, 1, False]).encode()).decode()
+        self.assertEqual(self.client.get(self.url, {'q': 'needle', 'cursor': valid}).status_code, 200)
+
+
+class CommentCounterTests(CommentTestCase):
+    def counters(self, comment):
+        comment.refresh_from_db()
+        return comment.reply_count, comment.descendant_count
+
+    def test_counters_follow_inserts_and_deletes(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        reply = Comment.objects.create(user=self.user, text='reply', parent=root)
+        nested = Comment.objects.create(user=self.user, text='nested', parent=reply)
+        Comment.objects.create(user=self.user, text='second reply', parent=root)
+
+        self.assertEqual(self.counters(root), (2, 3))
+        self.assertEqual(self.counters(reply), (1, 1))
+        self.assertEqual(root.last_activity_at, Comment.objects.latest('created_at').created_at)
+        self.assertEqual(nested.last_activity_at, nested.created_at)
+
+        reply.delete()
+        self.assertEqual(self.counters(root), (1, 1))
+
+    def test_deleting_the_newest_reply_rewinds_last_activity(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        reply = Comment.objects.create(user=self.user, text='reply', parent=root)
+        newest = Comment.objects.create(user=self.user, text='newest', parent=reply)
+        root.refresh_from_db()
+        self.assertEqual(root.last_activity_at, newest.created_at)
+
+        newest.delete()
+        root.refresh_from_db()
+        reply.refresh_from_db()
+        self.assertEqual((root.last_activity_at, reply.last_activity_at), (reply.created_at, reply.created_at))
+        reply.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.last_activity_at, root.created_at)
+
+    def test_hot_threads_ordering(self):
+        quiet = Comment.objects.create(user=self.user, text='quiet')
+        busy = Comment.objects.create(user=self.user, text='busy')
+        Comment.objects.create(user=self.user, text='bump', parent=quiet)
+
+        data = self.client.get(reverse('comment-list'), {'ordering': '-last_activity_at'}).json()
+        self.assertEqual([c['id'] for c in data['results']], [quiet.pk, busy.pk])
+        self.assertEqual(data['results'][0]['reply_count'], 1)
+
+    def test_reconcile_command_repairs_drift(self):
+        root = Comment.objects.create(user=self.user, text='root')
+        self.make_thread(2, 2, parent=root)
+        expected = self.counters(root)
+        Comment.objects.update(reply_count=0, descendant_count=42)
+
+        out = StringIO()
+        call_command('reconcile_comment_counters', batch_size=2, stdout=out)
+
+        self.assertIn('fixed 7', out.getvalue())
+        self.assertEqual(self.counters(root), expected)
+
+    def test_migration_backfill_matches_reconcile(self):
+        migration = importlib.import_module('comments.migrations.0007_comment_thread_counters')
+        root = Comment.objects.create(user=self.user, text='root')
+        self.make_thread(2, 2, parent=root)
+        Comment.objects.create(user=self.user, text='second root')
+        Comment.objects.update(reply_count=0, descendant_count=42, last_activity_at=datetime(2000, 1, 1, tzinfo=dt_timezone.utc))
+
+        migration.backfill_thread_counters(django_apps, mock.Mock(connection=connection))
+
+        self.assertEqual(reconcile_thread_counters(Comment.objects.all(), dry_run=True), (8, 0))
+        self.assertEqual(self.counters(root), (2, 6))
@@ -0,0 +1,120 @@
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from .models import Comment
+
+MAX_REPLY_DEPTH = 5
+DEFAULT_FIRST_REPLIES = 3
+MAX_FIRST_REPLIES = 25
+REPLY_ORDERING_FIELDS = ('created_at', 'user__username', 'user__email', 'last_activity_at')
+DEFAULT_REPLY_ORDERING = 'created_at'
+
+
+def reply_ordering(request):
+    """
+    Reply ordering taken from ?ordering=, restricted to the allowed fields.
+    """
+    ordering = DEFAULT_REPLY_ORDERING
+    if request is not None and hasattr(request, 'query_params'):
+        ordering = request.query_params.get('ordering', DEFAULT_REPLY_ORDERING)
+    if ordering.lstrip('-') not in REPLY_ORDERING_FIELDS:
+        ordering = DEFAULT_REPLY_ORDERING
+    return ordering
+
+
+def attach_reply_trees(comments, ordering=DEFAULT_REPLY_ORDERING, max_depth=MAX_REPLY_DEPTH):
+    """
+    Load the reply trees of the given comments and build the nesting in memory.
+
+    Every node gets a `_reply_tree` list of its children and every reply gets
+    its `parent` cached, so serializing the result runs no further queries.
+    """
+    nodes = reply_nodes(comments)
+    if nodes and max_depth > 0:
+        link_replies(nodes, list(descendants_queryset(nodes, ordering, max_depth)))
+    return list(nodes.values())
+
+
+async def aattach_reply_trees(comments, ordering=DEFAULT_REPLY_ORDERING, max_depth=MAX_REPLY_DEPTH):
+    """attach_reply_trees on the async ORM."""
+    nodes = reply_nodes(comments)
+    if nodes and max_depth > 0:
+        link_replies(nodes, [reply async for reply in descendants_queryset(nodes, ordering, max_depth)])
+    return list(nodes.values())
+
+
+def attach_first_replies(comments, ordering=DEFAULT_REPLY_ORDERING, limit=DEFAULT_FIRST_REPLIES):
+    """
+    Shallow variant of attach_reply_trees: only the first `limit` direct replies
+    of each comment, fetched together with one window-function query.
+
+    Replies come without children of their own; clients use reply_count and
+    the /replies/ endpoint to load the rest on demand.
+    """
+    nodes = reply_nodes(comments)
+    if nodes and limit > 0:
+        link_replies(nodes, list(first_replies_queryset(nodes, ordering, limit)))
+    return list(nodes.values())
+
+
+async def aattach_first_replies(comments, ordering=DEFAULT_REPLY_ORDERING, limit=DEFAULT_FIRST_REPLIES):
+    """attach_first_replies on the async ORM."""
+    nodes = reply_nodes(comments)
+    if nodes and limit > 0:
+        link_replies(nodes, [reply async for reply in first_replies_queryset(nodes, ordering, limit)])
+    return list(nodes.values())
+
+
+def reply_nodes(comments):
+    """Saved comments by pk, each with an empty `_reply_tree`."""
+    nodes = {}
+    for comment in comments:
+        if comment.pk is not None:
+            comment._reply_tree = []
+            nodes[comment.pk] = comment
+    return nodes
+
+
+def descendants_queryset(nodes, ordering, max_depth):
+    return (
+        Comment.objects.descendants(list(nodes.values()), max_depth=max_depth)
+        .select_related('user').order_by(ordering, 'id')
+    )
+
+
+def first_replies_queryset(nodes, ordering, limit):
+    field = ordering.lstrip('-')
+    order_by = [F(field).desc(), F('id').desc()] if ordering.startswith('-') else [F(field).asc(), F('id').asc()]
+    return (
+        Comment.objects.filter(parent_id__in=list(nodes))
+        .annotate(position=Window(RowNumber(), partition_by=F('parent_id'), order_by=order_by))
+        .filter(position__lte=limit)
+        .select_related('user')
+        .order_by('parent_id', 'position')
+    )
+
+
+def link_replies(nodes, replies):
+    """Hang loaded replies (parents before children) under their parents in `nodes`."""
+    for reply in replies:
+        reply._reply_tree = []
+        nodes[reply.pk] = reply
+    for reply in replies:
+        parent = nodes.get(reply.parent_id)
+        if parent is None:
+            continue
+        Comment.parent.field.set_cached_value(reply, parent)
+        parent._reply_tree.append(reply)
+
+
+def first_replies_limit(request):
+    """Number of inline replies per comment from ?first_replies=, capped at MAX_FIRST_REPLIES."""
+    try:
+        limit = int(request.query_params.get('first_replies', DEFAULT_FIRST_REPLIES))
+    except (TypeError, ValueError):
+        return DEFAULT_FIRST_REPLIES
+    return max(0, min(limit, MAX_FIRST_REPLIES))
+
+
+def is_shallow(request):
+    """Shallow threads are the default; ?shallow=0 returns full trees down to MAX_REPLY_DEPTH."""
+    return request.query_params.get('shallow', '1').lower() not in ('0', 'false', 'no')
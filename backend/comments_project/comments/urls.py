@@ -1,7 +1,14 @@
 from django.urls import path
-from .views import CommentListCreateView, PreviewView
+from .views import (
+    AsyncCommentDetailView, AsyncCommentListView, CommentListCreateView, CommentRepliesView, CommentSearchView,
+    PreviewView,
+)
 
 urlpatterns = [
     path('comments/', CommentListCreateView.as_view(), name='comment-list'),
+    path('comments/<int:pk>/replies/', CommentRepliesView.as_view(), name='comment-replies'),
+    path('comments/search/', CommentSearchView.as_view(), name='comment-search'),
+    path('async/comments/', AsyncCommentListView.as_view(), name='comment-list-async'),
+    path('async/comments/<int:pk>/', AsyncCommentDetailView.as_view(), name='comment-detail-async'),
     path('preview/', PreviewView.as_view(), name='preview'),
 ]
\ No newline at end of file
@@ -2,33 +2,118 @@ from rest_framework import generics, viewsets
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Comment
-from .serializers import CommentSerializer
+from .models import TEXT_MAX_LENGTH, Comment
+from .serializers import CommentSearchSerializer, CommentSerializer
+from .pagination import CommentCursorPagination, ReplyCursorPagination, SearchCursorPagination
+from .search import search_comments
+from .caching import (
+    aget_list_version, aget_or_compute, get_list_version, get_or_compute, list_cache_key, list_etag,
+)
+from .renderers import ORJSONRenderer
+from .rendering import render_comment, render_comments
+from .logs import Truncated
+from .replicas import route_reads
+from .sanitizer import sanitize
+from .tree import (
+    aattach_first_replies, aattach_reply_trees, attach_first_replies, attach_reply_trees, first_replies_limit,
+    is_shallow, reply_ordering,
+)
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import AllowAny
 from rest_framework.filters import OrderingFilter
-import bleach
 from rest_framework.response import Response
 from rest_framework import status
+import asyncio
 import logging
-from .tasks import save_comment
-from django.core.cache import cache
+import weakref
+from django.conf import settings
 from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.shortcuts import get_object_or_404
+from django.views import View
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
 
 logger = logging.getLogger(__name__)
 
-class CommentPagination(PageNumberPagination):
-    page_size = 25
 
-class CommentViewSet(viewsets.ModelViewSet):
+def attach_replies(request, page):
+    """
+    Shallow mode (default): first N direct replies plus counts, so a page stays
+    bounded however large its threads get. ?shallow=0 inlines full trees.
+    """
+    if is_shallow(request):
+        return attach_first_replies(page, ordering=reply_ordering(request), limit=first_replies_limit(request))
+    return attach_reply_trees(page, ordering=reply_ordering(request))
+
+
+def not_modified(request, etag):
+    """
+    304 when If-None-Match already names this version, else None.
+
+    If-Modified-Since alone is not honoured: Last-Modified has one-second
+    resolution, so a write later in the same second would still look unmodified.
+    """
+    return get_conditional_response(request, etag=etag)
+
+
+def set_validators(response, etag, modified):
+    # no-cache: clients and proxies may store the response but revalidate before reuse,
+    # rather than guessing a freshness lifetime from Last-Modified.
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+async def aattach_replies(request, page):
+    if is_shallow(request):
+        return await aattach_first_replies(page, ordering=reply_ordering(request), limit=first_replies_limit(request))
+    return await aattach_reply_trees(page, ordering=reply_ordering(request))
+
+
+class FastListMixin:
+    """
+    GET list rendered by rendering.render_comments instead of CommentSerializer.
+
+    Same JSON, a fraction of the CPU; serializer_class stays for writes and the schema.
+    """
+
+    def render_list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_comments(page, request)).data
+        return render_comments(attach_replies(request, queryset), request)
+
+    def cached_list(self, request):
+        """
+        render_list through the list cache, with ETag / Last-Modified validators.
+
+        Both come from the list cache generation (one cache read), so a client
+        revalidating an unchanged list gets its 304 without a query or a render.
+        """
+        generation, modified = get_list_version()
+        key = list_cache_key(request, generation)
+        etag = list_etag(request, key)
+        response = not_modified(request, etag)
+        if response is None:
+            route_reads(request, modified)
+            response = Response(get_or_compute(key, lambda: self.render_list(request)))
+        return set_validators(response, etag, modified)
+
+
+class CommentViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = CommentSerializer
-    pagination_class = CommentPagination
+    pagination_class = CommentCursorPagination
     permission_classes = [AllowAny]
     authentication_classes = [JWTAuthentication]
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['user__username', 'user__email', 'created_at']
-    ordering_fields = ['user__username', 'user__email', 'created_at']
+    ordering_fields = ['user__username', 'user__email', 'created_at', 'last_activity_at']
     ordering = ['-created_at']
 
     def get_queryset(self):
@@ -41,46 +126,47 @@ class CommentViewSet(viewsets.ModelViewSet):
         context.update({'request': self.request})
         return context
 
-class CommentListCreateView(generics.ListCreateAPIView):
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            attach_replies(self.request, page)
+        return page
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.render_list(request))
+
+class CommentListCreateView(FastListMixin, generics.ListCreateAPIView):
     queryset = Comment.objects.filter(parent__isnull=True).select_related('user')
     serializer_class = CommentSerializer
     permission_classes = [AllowAny]
     authentication_classes = [JWTAuthentication]
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['user__username', 'user__email', 'created_at']
-    ordering_fields = ['user__username', 'user__email', 'created_at']
-    pagination_class = CommentPagination
+    ordering_fields = ['user__username', 'user__email', 'created_at', 'last_activity_at']
+    pagination_class = CommentCursorPagination
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            attach_replies(self.request, page)
+        return page
 
     def list(self, request, *args, **kwargs):
-        logger.info("Accessing CommentListCreateView.list")
         try:
-            cache_key = f"comment_list_{request.query_params.get('page', '1')}_{request.query_params.get('ordering', '-created_at')}"
-            cache.delete(cache_key)
-            logger.info(f"Cleared cache for key: {cache_key}")
-
-            response = super().list(request, *args, **kwargs)
-            logger.info("CommentListCreateView.list successful")
-            cache.set(cache_key, response.data, timeout=60 * 15)
-            return response
+            return self.cached_list(request)
         except Exception as e:
-            logger.error(f"Error in CommentListCreateView.list: {str(e)}")
+            logger.error("Error in CommentListCreateView.list: %s", e)
             raise
 
     def create(self, request, *args, **kwargs):
-        logger.info(f"Received data: {request.data}")
+        logger.debug("Received data: %s", Truncated(request.data))
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             try:
                 with transaction.atomic():
                     instance = serializer.save()
-                    logger.info(f"Comment saved with id: {instance.id}")
-
-                    # Виклик Celery-завдання для відправки через WebSocket
-                    save_comment.delay(instance.id)
-
-                cache_key = f"comment_list_1_-created_at"
-                cache.delete(cache_key)
-                logger.info(f"Cleared cache for key: {cache_key}")
+                    logger.info("Comment saved with id: %s", instance.id)
+                    # Розсилка через WebSocket та інвалідація кешу - у signals після commit
 
                 response_serializer = self.get_serializer(instance)
                 return Response(
@@ -91,18 +177,156 @@ class CommentListCreateView(generics.ListCreateAPIView):
                     status=status.HTTP_201_CREATED
                 )
             except Exception as e:
-                logger.error(f"Error creating comment: {str(e)}")
+                logger.exception("Error creating comment: %s", e)
                 return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
-            logger.error(f"Serializer errors: {serializer.errors}")
+            logger.error("Serializer errors: %s", Truncated(serializer.errors))
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class CommentRepliesView(FastListMixin, generics.ListAPIView):
+    """Direct replies of one comment, cursor-paginated: /api/comments/<id>/replies/"""
+    serializer_class = CommentSerializer
+    permission_classes = [AllowAny]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = ReplyCursorPagination
+
+    def get_queryset(self):
+        self.parent = get_object_or_404(Comment.objects.select_related('user'), pk=self.kwargs['pk'])
+        return Comment.objects.filter(parent=self.parent).select_related('user')
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            for reply in page:
+                Comment.parent.field.set_cached_value(reply, self.parent)
+            attach_replies(self.request, page)
+        return page
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_list(request)
+
+# One semaphore per event loop (Daphne runs one per process).
+_db_slots = weakref.WeakKeyDictionary()
+
+
+def db_slots():
+    """
+    Caps the async views' concurrent database work at COMMENTS_ASYNC_DB_CONCURRENCY.
+
+    Every request that queries holds a connection on its own thread; the
+    others wait on the event loop instead of opening more connections.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _db_slots.get(loop)
+    if slots is None:
+        slots = _db_slots[loop] = asyncio.Semaphore(settings.COMMENTS_ASYNC_DB_CONCURRENCY)
+    return slots
+
+
+def json_response(data, status=200):
+    return HttpResponse(ORJSONRenderer().render(data), content_type='application/json', status=status)
+
+
+def error_response(exc):
+    # Same body as DRF's exception handler
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(data, status=exc.status_code)
+
+
+class AsyncCommentListView(View):
+    """
+    Native async GET of the top-level comment list: /api/async/comments/
+
+    Same JSON as CommentListCreateView. The cache goes through the async
+    cache API and the page and its replies through the async ORM, so no
+    worker thread is held while the request waits; only the ?page= mode,
+    which needs COUNT(*), is handed to the sync view.
+    """
+    pagination_class = CommentCursorPagination
+    filterset_fields = CommentListCreateView.filterset_fields
+
+    async def get(self, request):
+        request = Request(request)
+        if self.pagination_class().uses_fallback(request):
+            return await sync_to_async(render_sync_list)(request._request)
+        try:
+            generation, modified = await aget_list_version()
+            key = list_cache_key(request, generation)
+            etag = list_etag(request, key)
+            response = not_modified(request, etag)
+            if response is None:
+                route_reads(request, modified)
+                response = json_response(await aget_or_compute(key, lambda: self.render_list(request)))
+            return set_validators(response, etag, modified)
+        except APIException as exc:
+            return error_response(exc)
+
+    async def render_list(self, request):
+        queryset = Comment.objects.filter(parent__isnull=True).select_related('user')
+        queryset = DjangoFilterBackend().filter_queryset(request, queryset, self)
+        paginator = self.pagination_class()
+        async with db_slots():
+            page = await paginator.apaginate_queryset(queryset, request)
+            await aattach_replies(request, page)
+        return paginator.get_paginated_data(render_comments(page, request))
+
+
+class AsyncCommentDetailView(View):
+    """Native async GET of one comment with its replies: /api/async/comments/<id>/"""
+
+    async def get(self, request, pk):
+        request = Request(request)
+        generation, modified = await aget_list_version()
+        key = list_cache_key(request, generation)
+        etag = list_etag(request, key)
+        response = not_modified(request, etag)
+        if response is not None:
+            return set_validators(response, etag, modified)
+        route_reads(request, modified)
+        data = await aget_or_compute(key, lambda: self.load(request, pk))
+        if data is None:
+            return error_response(NotFound('No Comment matches the given query.'))
+        return set_validators(json_response(data), etag, modified)
+
+    async def load(self, request, pk):
+        async with db_slots():
+            comment = await Comment.objects.select_related('user', 'parent__user').filter(pk=pk).afirst()
+            if comment is None:
+                return None
+            await aattach_replies(request, [comment])
+        return render_comment(comment, request)
+
+
+def render_sync_list(request):
+    return CommentListCreateView.as_view()(request).render()
+
+class CommentSearchView(generics.ListAPIView):
+    """Full-text search over all comments and replies: /api/comments/search/?q=..."""
+    serializer_class = CommentSearchSerializer
+    permission_classes = [AllowAny]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = SearchCursorPagination
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '').strip()
+        queryset = Comment.objects.select_related('user', 'parent__user')
+        return search_comments(queryset, query)
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('q', '').strip():
+            return Response({'q': 'This query parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        route_reads(request)
+        return super().list(request, *args, **kwargs)
+
 class PreviewView(APIView):
     permission_classes = [AllowAny]
     def post(self, request):
-        logger.info("Accessing PreviewView.post")
         text = request.data.get('text', '')
-        ALLOWED_TAGS = ['a', 'code', 'i', 'strong']
-        ALLOWED_ATTRIBUTES = {'a': ['href', 'title']}
-        cleaned_text = bleach.clean(text, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES)
+        # Та сама межа, що й для коментаря: анонімний preview не заповнює спільний кеш великими текстами
+        if not isinstance(text, str) or len(text) > TEXT_MAX_LENGTH:
+            return Response(
+                {'text': [f'Ensure this field is text of no more than {TEXT_MAX_LENGTH} characters.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        cleaned_text = sanitize(text)
         return Response({'preview': cleaned_text})
\ No newline at end of file
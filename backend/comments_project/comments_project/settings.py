@@ -2,10 +2,13 @@ import os
 from pathlib import Path
 from datetime import timedelta
 import dj_database_url
+from comments.logs import parse_levels
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Завантаження понад 256KB пишуться потоком у тимчасовий файл, а не тримаються в пам'яті
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-f%gv&0^mpfxzy!)f^fuedbu%3ok8y#6%1#6@hmg9+17&srv9ep')
 DEBUG = os.getenv('DEBUG', 'True') == 'True'
@@ -32,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'comments.metrics.MetricsMiddleware',
+    'comments.replicas.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -85,11 +90,25 @@ CSRF_COOKIE_SECURE = False
 
 DATABASES = {
     'default': dj_database_url.config(
-        default=os.getenv('DATABASE_URL'),
-        conn_max_age=600,
+        default=os.getenv('DATABASE_URL', f"sqlite:///{BASE_DIR / 'db.sqlite3'}"),
+        # Під Daphne кожен запит виконується у власному потоці: постійні з'єднання
+        # там не перевикористовуються, а лише накопичуються до max_connections
+        conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', '0')),
         conn_health_checks=True
     )
 }
+# Репліки лише для читання (URL через кому): з них читають GET списків, гілок і пошуку
+for index, url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(',')), start=1):
+    DATABASES[f'replica{index}'] = {
+        **dj_database_url.parse(
+            url.strip(), conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', '0')), conn_health_checks=True
+        ),
+        'TEST': {'MIRROR': 'default'},
+    }
+COMMENTS_DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['comments.replicas.ReplicaRouter']
+# Скільки секунд після запису клієнт (cookie) і кешовані списки читають з primary, поки репліки наздоганяють
+COMMENTS_DB_PIN_SECONDS = int(os.getenv('COMMENTS_DB_PIN_SECONDS', '10'))
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -118,6 +137,28 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Повільні запити (мс) логуються разом із SQL для частки COMMENTS_SLOW_REQUEST_SAMPLE_RATE з них; 0 вимикає
+COMMENTS_SLOW_REQUEST_MS = float(os.getenv('COMMENTS_SLOW_REQUEST_MS', '500'))
+COMMENTS_SLOW_REQUEST_SAMPLE_RATE = float(os.getenv('COMMENTS_SLOW_REQUEST_SAMPLE_RATE', '0.1'))
+
+# Скільки async-запитів одного процесу одночасно працюють з БД; решта чекають у event loop
+COMMENTS_ASYNC_DB_CONCURRENCY = int(os.getenv('COMMENTS_ASYNC_DB_CONCURRENCY', '20'))
+
+# Outbox WebSocket-подій: розмір пакета relay, інтервал періодичного relay (сек)
+# та скільки секунд зберігаються вже доставлені події
+COMMENTS_OUTBOX_BATCH_SIZE = int(os.getenv('COMMENTS_OUTBOX_BATCH_SIZE', '500'))
+COMMENTS_OUTBOX_RELAY_INTERVAL = float(os.getenv('COMMENTS_OUTBOX_RELAY_INTERVAL', '5'))
+COMMENTS_OUTBOX_RETENTION = int(os.getenv('COMMENTS_OUTBOX_RETENTION', '86400'))
+# Скільки пропущених подій WebSocket-клієнт може отримати через resume; більше - повне перезавантаження
+COMMENTS_REPLAY_LIMIT = int(os.getenv('COMMENTS_REPLAY_LIMIT', '500'))
+
+# Ліміти WebSocket-з'єднань: на процес та сумарно на всі процеси (0 - без ліміту),
+# закриття неактивних сокетів (сек, 0 вимикає) та черга кадрів на один сокет
+COMMENTS_WS_MAX_CONNECTIONS = int(os.getenv('COMMENTS_WS_MAX_CONNECTIONS', '20000'))
+COMMENTS_WS_MAX_TOTAL_CONNECTIONS = int(os.getenv('COMMENTS_WS_MAX_TOTAL_CONNECTIONS', '0'))
+COMMENTS_WS_IDLE_TIMEOUT = float(os.getenv('COMMENTS_WS_IDLE_TIMEOUT', '90'))
+COMMENTS_WS_SEND_QUEUE = int(os.getenv('COMMENTS_WS_SEND_QUEUE', '100'))
+
 REST_FRAMEWORK = {
 'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework_simplejwt.authentication.JWTAuthentication'],
@@ -125,6 +166,16 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 25,
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # orjson-рендерер/парсер: той самий JSON, що й у стандартних, але швидше
+    'DEFAULT_RENDERER_CLASSES': [
+        'comments.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'comments.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SIMPLE_JWT = {
@@ -146,6 +197,11 @@ CELERY_RESULT_BACKEND = os.getenv('REDIS_URL', 'redis://redis:6379/0')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# Періодичний relay підбирає події, для яких після commit не вдалося поставити задачу
+CELERY_BEAT_SCHEDULE = {
+    'relay-comment-outbox': {'task': 'comments.tasks.relay_outbox', 'schedule': COMMENTS_OUTBOX_RELAY_INTERVAL},
+    'purge-comment-outbox': {'task': 'comments.tasks.purge_outbox', 'schedule': 60 * 60},
+}
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Comments API',
@@ -164,41 +220,53 @@ CACHES = {
     }
 }
 
+# Рівень логів за замовчуванням та рівні окремих логерів,
+# напр. LOG_LEVELS="comments.consumers=DEBUG,django.db.backends=DEBUG"
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = parse_levels(os.getenv('LOG_LEVELS', ''))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'comments.logs.JSONFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
     'handlers': {
+        # Форматування і запис у stderr - у фоновому потоці (QueueListener)
         'console': {
-            'class': 'logging.StreamHandler',
-            'level': 'DEBUG',
+            'class': 'comments.logs.BackgroundHandler',
+            'formatter': os.getenv('LOG_FORMAT', 'json'),
         },
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
     },
     'loggers': {
         'django': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'django.request': {  # Логи для HTTP-запитів
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'django.server': {  # Логи для Gunicorn
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'comments': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     },
 }
+for name, level in LOG_LEVELS.items():
+    LOGGING['loggers'].setdefault(name, {}).update(level=level)
 
 print(os.getenv('REDIS_URL'))
@@ -7,6 +7,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.http import HttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+from comments.metrics import registry
 
 @ensure_csrf_cookie
 def csrf_cookie(request):
@@ -15,11 +16,16 @@ def csrf_cookie(request):
 def health_check(request):
     return HttpResponse("OK", status=200)
 
+def metrics(request):
+    # Prometheus text exposition of this worker's in-process metrics
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 urlpatterns = [
     path('schema/', SpectacularAPIView.as_view(), name='schema'),
     path('swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     path('', health_check, name='health-check'),
+    path('metrics', metrics, name='metrics'),
     path('admin/', admin.site.urls),
     path('csrf-cookie/', csrf_cookie, name='csrf_cookie'),
     path('api/', include('comments.urls')),
@@ -36,6 +36,6 @@ fi
 echo "Applying Django migrations..."
 python /app/comments_project/manage.py migrate --noinput
 
-# --- Start Celery worker ---
+# --- Start Celery worker (with embedded beat for the periodic outbox relay) ---
 echo "Starting Celery worker..."
-exec celery -A comments_project worker -l info --concurrency=4
+exec celery -A comments_project worker -B -s /tmp/celerybeat-schedule -l info --concurrency=4
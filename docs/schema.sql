@@ -1,3 +1,9 @@
+-- Схема PostgreSQL, яку створює `python manage.py migrate` (таблиці застосунку comments).
+-- Після нової міграції оновіть файл з результату:
+--   pg_dump --schema-only -t users -t comments -t comment_outbox -t comment_outbox_sequence comments_db
+-- Обмеження формату (username, email, довжина тексту) і каскадне видалення
+-- перевіряє Django, а не база даних.
+
 -- Створення бази даних
 CREATE DATABASE comments_db
     WITH ENCODING = 'UTF8'
@@ -9,38 +15,97 @@ CREATE DATABASE comments_db
 
 -- Таблиця для користувачів
 CREATE TABLE users (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
     username VARCHAR(50) NOT NULL,
-    email VARCHAR(255) NOT NULL,
-    homepage VARCHAR(255),
-    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    CONSTRAINT valid_username CHECK (username ~ '^[a-zA-Z0-9]+$'),
-    CONSTRAINT valid_email CHECK (email ~ '^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'),
-    UNIQUE (username, email)
+    email VARCHAR(254) NOT NULL,
+    homepage VARCHAR(200),
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT users_username_e8658fc8_uniq UNIQUE (username)
 );
 
--- Індекс для таблиці users
-CREATE INDEX idx_username_email ON users (username, email);
+-- Індекси для таблиці users (keyset-пагінація за ім'ям та email)
+CREATE INDEX users_username_e8658fc8_like ON users (username varchar_pattern_ops);
+CREATE INDEX users_username_id_idx ON users (username, id);
+CREATE INDEX users_email_id_idx ON users (email, id);
 
 -- Таблиця для коментарів
 CREATE TABLE comments (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
     user_id BIGINT NOT NULL,
     text TEXT NOT NULL,
     parent_id BIGINT,
-    file VARCHAR(255),
-    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    CONSTRAINT fk_user FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-    CONSTRAINT fk_parent FOREIGN KEY (parent_id) REFERENCES comments(id) ON DELETE CASCADE,
-    CONSTRAINT valid_text_length CHECK (LENGTH(text) <= 5000)
+    file VARCHAR(100),
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    path VARCHAR(1000) NOT NULL,
+    search_vector TSVECTOR,
+    reply_count INTEGER NOT NULL,
+    descendant_count INTEGER NOT NULL,
+    last_activity_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT comments_user_id_b8fd0b64_fk_users_id
+        FOREIGN KEY (user_id) REFERENCES users (id) DEFERRABLE INITIALLY DEFERRED,
+    CONSTRAINT comments_parent_id_d317363b_fk_comments_id
+        FOREIGN KEY (parent_id) REFERENCES comments (id) DEFERRABLE INITIALLY DEFERRED,
+    CONSTRAINT comments_reply_count_check CHECK (reply_count >= 0),
+    CONSTRAINT comments_descendant_count_check CHECK (descendant_count >= 0)
 );
 
 -- Індекси для таблиці comments
-CREATE INDEX idx_created_at_user ON comments (created_at, user_id);
-CREATE INDEX idx_parent ON comments (parent_id);
+CREATE INDEX comments_user_id_b8fd0b64 ON comments (user_id);
+CREATE INDEX comments_parent_id_d317363b ON comments (parent_id);
+CREATE INDEX comments_created_be8a87_idx ON comments (created_at, user_id);
+CREATE INDEX comments_parent__9f8798_idx ON comments (parent_id);
+CREATE INDEX comments_path_idx ON comments (path);
+-- Keyset-пагінація кореневих коментарів
+CREATE INDEX comments_root_created_idx ON comments (created_at, id) WHERE parent_id IS NULL;
+CREATE INDEX comments_root_activity_idx ON comments (last_activity_at, id) WHERE parent_id IS NULL;
+-- Повнотекстовий пошук
+CREATE INDEX comments_search_vector_gin ON comments USING gin (search_vector);
+
+-- search_vector заповнює тригер: текст без HTML-тегів
+CREATE FUNCTION comments_search_vector_update() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('simple', regexp_replace(NEW.text, '<[^>]*>', ' ', 'g'));
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER comments_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF text ON comments
+    FOR EACH ROW EXECUTE FUNCTION comments_search_vector_update();
+
+-- Outbox подій WebSocket: записується в тій самій транзакції, що й коментар
+CREATE TABLE comment_outbox (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    "group" VARCHAR(100) NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    delivered_at TIMESTAMP WITH TIME ZONE,
+    seq BIGINT UNIQUE
+);
+
+-- Індекси для таблиці comment_outbox
+CREATE INDEX comment_outbox_pending_idx ON comment_outbox (id) WHERE delivered_at IS NULL;
+CREATE INDEX comment_outbox_delivered_idx ON comment_outbox (delivered_at);
+CREATE INDEX comment_outbox_group_seq_idx ON comment_outbox ("group", seq);
+
+-- Лічильник номерів доставки (один рядок)
+CREATE TABLE comment_outbox_sequence (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    last BIGINT NOT NULL,
+    purged BIGINT NOT NULL
+);
 
 -- Коментарі до структури бази даних
 COMMENT ON TABLE users IS 'Таблиця для зберігання інформації про користувачів (username, email, homepage)';
 COMMENT ON TABLE comments IS 'Таблиця для зберігання коментарів із підтримкою каскадного відображення (parent_id)';
 COMMENT ON COLUMN comments.text IS 'Текст коментаря з дозволеними HTML-тегами (<a>, <code>, <i>, <strong>)';
-COMMENT ON COLUMN comments.file IS 'Шлях до файлу (зображення JPG/GIF/PNG <= 320x240 або TXT <= 100KB)';
\ No newline at end of file
+COMMENT ON COLUMN comments.path IS 'Матеріалізований шлях: id предків і самого коментаря, доповнені нулями до 10 цифр';
+COMMENT ON COLUMN comments.file IS 'Шлях до файлу (зображення JPG/GIF/PNG <= 320x240 або TXT <= 100KB)';
+COMMENT ON COLUMN comments.reply_count IS 'Кількість прямих відповідей';
+COMMENT ON COLUMN comments.descendant_count IS 'Кількість усіх відповідей у гілці';
+COMMENT ON COLUMN comments.last_activity_at IS 'Час найновішого коментаря в гілці (сам коментар або відповідь)';
+COMMENT ON TABLE comment_outbox IS 'Події для WebSocket-клієнтів; доставлені зберігаються COMMENTS_OUTBOX_RETENTION секунд для дозапиту';
+COMMENT ON COLUMN comment_outbox.seq IS 'Номер доставки, який отримує клієнт (NULL до відправки)';
+COMMENT ON TABLE comment_outbox_sequence IS 'Останній виданий номер доставки (last) і найбільший видалений (purged)';
\ No newline at end of file
@@ -1,6 +1,27 @@
 import axios from 'axios';
 import { toRaw } from 'vue';
 
+const normalizeReplies = (comment) => {
+  comment.replies = comment.replies?.map(normalizeReplies) || [];
+  comment.user = {
+    username: comment.user?.username || comment.user_name || 'Анонім',
+    email: comment.user?.email || '',
+    homepage: comment.user?.homepage || '',
+  };
+  return comment;
+};
+
+const findComment = (comments, id) => {
+  for (const c of toRaw(comments)) {
+    if (c.id === id || c.tempId === id) return c;
+    if (c.replies?.length) {
+      const found = findComment(c.replies, id);
+      if (found) return found;
+    }
+  }
+  return null;
+};
+
 export default {
   namespaced: true,
   state: () => ({
@@ -8,6 +29,8 @@ export default {
     pagination: { previous: null, next: null },
     ordering: '-created_at',
     currentPage: 1,
+    // Посилання на поточну сторінку (курсор від сервера); null - перша сторінка
+    currentUrl: null,
   }),
   mutations: {
     SET_COMMENTS(state, comments) {
@@ -18,9 +41,13 @@ export default {
       state.pagination = pagination;
       console.log('SET_PAGINATION:', pagination);
     },
-    SET_CURRENT_PAGE(state, page) {
+    SET_ORDERING(state, ordering) {
+      state.ordering = ordering;
+    },
+    SET_CURRENT_PAGE(state, { page, url }) {
       state.currentPage = page;
-      console.log('SET_CURRENT_PAGE:', page);
+      state.currentUrl = url;
+      console.log('SET_CURRENT_PAGE:', page, url);
     },
     ADD_COMMENT(state, comment) {
       // Перевіряємо, чи коментар уже є (по id або tempId)
@@ -33,20 +60,10 @@ export default {
       }
     },
     ADD_REPLY(state, { parentId, reply }) {
-      const findComment = (comments, id) => {
-        const rawComments = toRaw(comments);
-        for (const c of rawComments) {
-          if (c.id === id || c.tempId === id) return c;
-          if (c.replies?.length) {
-            const found = findComment(c.replies, id);
-            if (found) return found;
-          }
-        }
-        return null;
-      };
-
       const parent = findComment(state.comments, parentId);
       if (parent) {
+        if (reply.id && parent.replies?.some(r => r.id === reply.id)) return;
+        parent.reply_count = (parent.reply_count || 0) + 1;
         parent.replies = [
           ...(parent.replies || []),
           {
@@ -60,6 +77,14 @@ export default {
         console.warn('Parent comment not found for parentId:', parentId);
       }
     },
+    APPEND_REPLIES(state, { parentId, replies, next }) {
+      // Догружені відповіді: додаємо лише ті, яких ще немає (могли прийти через WebSocket)
+      const parent = findComment(state.comments, parentId);
+      if (!parent) return;
+      const known = new Set((parent.replies || []).map(r => r.id));
+      parent.replies = [...(parent.replies || []), ...replies.filter(r => !known.has(r.id))];
+      parent.repliesNext = next;
+    },
     UPDATE_COMMENT(state, updatedComment) {
       const findAndUpdate = (comments) => {
         const rawComments = toRaw(comments);
@@ -84,32 +109,25 @@ export default {
     },
   },
   actions: {
-    async fetchComments({ commit, state }, { baseUrl, page = 1, ordering } = {}) {
+    async fetchComments({ commit, state }, { baseUrl, url = null, page = 1, ordering } = {}) {
+      // Сторінки гортаємо курсорами з посилань next/previous: сервер не рахує OFFSET і COUNT(*)
       try {
         const apiUrl = baseUrl || 'http://localhost:8000/api';
-        console.log('Fetching comments from:', `${apiUrl}/comments/`, 'with params:', { ordering: ordering || state.ordering, page });
-        const res = await axios.get(`${apiUrl}/comments/`, {
-          params: { ordering: ordering || state.ordering, page },
+        console.log('Fetching comments from:', url || `${apiUrl}/comments/`, 'with ordering:', ordering || state.ordering);
+        const res = await axios.get(url || `${apiUrl}/comments/`, {
+          // Посилання курсора вже містить сортування
+          params: url ? {} : { ordering: ordering || state.ordering },
           withCredentials: true,
           headers: { 'X-Requested-With': 'XMLHttpRequest' },
         });
 
-        const normalizeReplies = (comment) => {
-          comment.replies = comment.replies?.map(normalizeReplies) || [];
-          comment.user = {
-            username: comment.user?.username || comment.user_name || 'Анонім',
-            email: comment.user?.email || '',
-            homepage: comment.user?.homepage || '',
-          };
-          return comment;
-        };
-
         const comments = (res.data.results || []).map(normalizeReplies);
         console.log('Fetched comments:', comments.map(c => ({ id: c.id, text: c.text })));
 
         commit('SET_COMMENTS', comments);
         commit('SET_PAGINATION', { previous: res.data.previous, next: res.data.next });
-        commit('SET_CURRENT_PAGE', page);
+        commit('SET_CURRENT_PAGE', { page, url });
+        commit('SET_ORDERING', ordering || state.ordering);
 
         return comments;
       } catch (err) {
@@ -117,9 +135,26 @@ export default {
         throw err;
       }
     },
-    changePage({ dispatch }, { baseUrl, page }) {
+    changePage({ dispatch, state }, { baseUrl, direction }) {
+      if (!state.pagination[direction]) return null;
+      const page = state.currentPage + (direction === 'next' ? 1 : -1);
       console.log('Changing page to:', page);
-      dispatch('fetchComments', { baseUrl, page });
+      // Першу сторінку завжди беремо без курсора, щоб побачити і найновіші коментарі
+      const url = page > 1 ? state.pagination[direction] : null;
+      return dispatch('fetchComments', { baseUrl, url, page });
+    },
+    async fetchReplies({ commit, state }, { baseUrl, parentId, url }) {
+      // Список коментарів містить лише перші відповіді; решту підвантажуємо сторінками
+      const apiUrl = baseUrl || 'http://localhost:8000/api';
+      const res = await axios.get(url || `${apiUrl}/comments/${parentId}/replies/`, {
+        // Те саме сортування, що й у списку, щоб догрузка продовжувала перші відповіді
+        params: url ? {} : { ordering: state.ordering },
+        withCredentials: true,
+        headers: { 'X-Requested-With': 'XMLHttpRequest' },
+      });
+      const replies = (res.data.results || []).map(normalizeReplies);
+      commit('APPEND_REPLIES', { parentId, replies, next: res.data.next });
+      return replies;
     },
   },
 };
\ No newline at end of file